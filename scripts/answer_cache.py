@@ -0,0 +1,191 @@
+# phase2/scripts/answer_cache.py
+"""
+/query 系エンドポイントの回答キャッシュ（プロセス内・LRU + TTL）。
+
+- 完全一致: 正規化した質問 + プロンプトモード
+- 近似一致: 同じプロンプトモードのエントリのうち、質問ベクトルの cos 類似度が閾値以上のもの
+- 無効化: 前回の確認以降の ingest run で更新・削除された pageId を参照しているエントリを破棄
+  （質問ベクトルの次元が変わった場合、例えば次元削減したコレクションへの切り替え後は、古いエントリを捨てる）
+"""
+import os
+import json
+import time
+import sqlite3
+from collections import OrderedDict
+
+import numpy as np
+
+from embedding_cache import normalize_text
+from ingest_manifest import DEFAULT_PATH as DEFAULT_MANIFEST_PATH
+
+ANSWER_CACHE_ENABLED = os.getenv("ANSWER_CACHE", "1") not in ("0", "false", "False")
+ANSWER_CACHE_MAX = int(os.getenv("ANSWER_CACHE_MAX", "512"))
+ANSWER_CACHE_TTL = float(os.getenv("ANSWER_CACHE_TTL", str(24 * 3600)))
+ANSWER_CACHE_SIM = float(os.getenv("ANSWER_CACHE_SIM", "0.95"))
+ANSWER_CACHE_POLL = float(os.getenv("ANSWER_CACHE_POLL", "30"))
+INGEST_MANIFEST = os.getenv("INGEST_MANIFEST", DEFAULT_MANIFEST_PATH)
+
+
+class _Entry:
+    __slots__ = ("mode", "vector", "answer", "sources", "page_ids", "extra", "created_at", "gen_seconds")
+
+    def __init__(self, mode, vector, answer, sources, page_ids, extra, gen_seconds):
+        self.mode = mode
+        self.vector = vector
+        self.answer = answer
+        self.sources = sources
+        self.page_ids = page_ids
+        self.extra = extra
+        self.created_at = time.time()
+        self.gen_seconds = gen_seconds
+
+
+def _unit(vec):
+    if vec is None:
+        return None
+    v = np.asarray(vec, dtype=np.float32)
+    n = float(np.linalg.norm(v))
+    return v / n if n else v
+
+
+class AnswerCache:
+    def __init__(self, max_entries=ANSWER_CACHE_MAX, ttl=ANSWER_CACHE_TTL, sim_threshold=ANSWER_CACHE_SIM,
+                 manifest_path=INGEST_MANIFEST, poll_seconds=ANSWER_CACHE_POLL):
+        self.max_entries = max_entries
+        self.ttl = ttl
+        self.sim_threshold = sim_threshold
+        self.manifest_path = manifest_path
+        self.poll_seconds = poll_seconds
+        self._entries = OrderedDict()
+        self._last_poll = 0.0
+        self._last_run_id = self._runs_since(0)[0]
+
+        self.exact_hits = 0
+        self.semantic_hits = 0
+        self.misses = 0
+        self.invalidated = 0
+        self.saved_seconds = 0.0
+
+    @staticmethod
+    def key(question: str, mode: str) -> str:
+        return f"{mode}\0{normalize_text(question).lower()}"
+
+    # ---- 無効化 ----
+    def _runs_since(self, last_id: int):
+        """id が last_id より大きい run の (最大の id, 更新・削除された pageId の和集合)。"""
+        if not os.path.exists(self.manifest_path):
+            return last_id, set()
+        try:
+            conn = sqlite3.connect(f"file:{self.manifest_path}?mode=ro", uri=True)
+            try:
+                rows = conn.execute(
+                    "SELECT id, updated_pages, deleted_pages FROM runs WHERE id > ? ORDER BY id", (last_id,)
+                ).fetchall()
+            finally:
+                conn.close()
+        except sqlite3.Error:
+            return last_id, set()
+        pages = set()
+        for _, updated, deleted in rows:
+            pages.update(json.loads(updated or "[]"))
+            pages.update(json.loads(deleted or "[]"))
+        return (rows[-1][0] if rows else last_id), pages
+
+    def poll_ingest(self):
+        """前回の確認以降に ingest run があれば、それらの run で触れた pageId のエントリを破棄する。"""
+        now = time.time()
+        if now - self._last_poll < self.poll_seconds:
+            return
+        self._last_poll = now
+        run_id, pages = self._runs_since(self._last_run_id)
+        if run_id != self._last_run_id:
+            self._last_run_id = run_id
+            self.invalidate_pages(pages)
+
+    def invalidate_pages(self, page_ids) -> int:
+        page_ids = {str(p) for p in page_ids}
+        victims = [k for k, e in self._entries.items() if e.page_ids & page_ids]
+        for k in victims:
+            del self._entries[k]
+        self.invalidated += len(victims)
+        return len(victims)
+
+    def clear(self) -> int:
+        n = len(self._entries)
+        self._entries.clear()
+        self.invalidated += n
+        return n
+
+    # ---- 参照・登録 ----
+    def _expired(self, e: _Entry) -> bool:
+        return self.ttl > 0 and time.time() - e.created_at > self.ttl
+
+    def lookup(self, question: str, mode: str, vector=None):
+        """
+        ヒットしたら {"answer", "sources", "extra", "match"} を返す。vector を渡さない場合は完全一致のみ。
+        ミスの計上は vector 付きの呼び出し（最終判定）のときだけ行う。
+        """
+        self.poll_ingest()
+        k = self.key(question, mode)
+        e = self._entries.get(k)
+        if e is not None and self._expired(e):
+            del self._entries[k]
+            e = None
+        if e is not None:
+            self._entries.move_to_end(k)
+            self.exact_hits += 1
+            self.saved_seconds += e.gen_seconds
+            return {"answer": e.answer, "sources": e.sources, "extra": e.extra, "match": "exact"}
+        if vector is None:
+            return None
+
+        q = _unit(vector)
+        best_key, best_sim = None, self.sim_threshold
+        for key, cand in list(self._entries.items()):
+            if self._expired(cand):
+                del self._entries[key]
+                continue
+            if cand.vector is not None and cand.vector.shape != q.shape:
+                # 埋め込みの次元が変わった（別のコレクションに切り替わった）後のエントリは比べられない
+                del self._entries[key]
+                self.invalidated += 1
+                continue
+            if cand.mode != mode or cand.vector is None:
+                continue
+            sim = float(q @ cand.vector)
+            if sim >= best_sim:
+                best_key, best_sim = key, sim
+        if best_key is None:
+            self.misses += 1
+            return None
+        e = self._entries[best_key]
+        self._entries.move_to_end(best_key)
+        self.semantic_hits += 1
+        self.saved_seconds += e.gen_seconds
+        return {"answer": e.answer, "sources": e.sources, "extra": e.extra, "match": "semantic", "similarity": best_sim}
+
+    def put(self, question: str, mode: str, vector, answer: str, sources, gen_seconds: float, extra=None):
+        page_ids = {str((s.get("metadata") or {}).get("pageId")) for s in sources}
+        self._entries[self.key(question, mode)] = _Entry(
+            mode, _unit(vector), answer, sources, page_ids, extra or {}, gen_seconds
+        )
+        self._entries.move_to_end(self.key(question, mode))
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def stats(self) -> dict:
+        hits = self.exact_hits + self.semantic_hits
+        total = hits + self.misses
+        return {
+            "entries": len(self._entries),
+            "exact_hits": self.exact_hits,
+            "semantic_hits": self.semantic_hits,
+            "misses": self.misses,
+            "hit_rate": round(hits / total, 4) if total else 0.0,
+            "saved_seconds": round(self.saved_seconds, 1),
+            "invalidated": self.invalidated,
+        }
+
+
+def make_answer_cache():
+    return AnswerCache() if ANSWER_CACHE_ENABLED else None
@@ -1,56 +1,230 @@
 # 標準ライブラリ
+import os
+import sys
+import json
+import time
+import uuid
+import atexit
+import asyncio
+import logging
+import subprocess
+from contextlib import asynccontextmanager
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
 from typing import Optional
+from urllib.parse import urlparse
 
 # サードパーティライブラリ
+import numpy as np
 import uvicorn
 from dotenv import load_dotenv
-from fastapi import FastAPI
+from fastapi import FastAPI, HTTPException, Request, Depends
 from fastapi.middleware.cors import CORSMiddleware
+from fastapi.responses import StreamingResponse, PlainTextResponse, JSONResponse
 from pydantic import BaseModel
 
 # langchain系
-from langchain_community.chat_models import ChatOllama
-from langchain_community.embeddings import HuggingFaceEmbeddings
-from langchain_weaviate.vectorstores import WeaviateVectorStore
+from langchain_core.documents import Document
+from langchain_core.messages import HumanMessage
 
 # weaviate系
 from weaviate import WeaviateClient
 from weaviate.connect import ConnectionParams
 
+# 自作モジュール
+import retrieval
+import request_metrics as metrics
+from answer_cache import make_answer_cache
+from collection_alias import resolve_alias
+from embed_client import EmbedClient, EmbedServiceError
+from embeddings import get_embedder
+from llm_gateway import LLMGateway, LLMBusyError, PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW
+from micro_batcher import MicroBatcher, HIST_BUCKETS
+from context_builder import build_context, build_sources, count_tokens
+from prompts import build_refine_prompt, resolve_prompt_mode, build_answer_prompt
+from reranker import make_reranker, RERANK_ENABLED, RERANK_MODEL, RERANK_CANDIDATES, RERANK_BUDGET_MS
+
 # === モデル・Embedding読み込み ===
 load_dotenv()
 
-# Qwen (Ollama経由)
-llm = ChatOllama(model="qwen2:7b-instruct", temperature=0.3)
+logging.basicConfig(level=logging.INFO, format="%(asctime)s - %(levelname)s - %(message)s")
+logger = logging.getLogger("api_server")
+
+# 同時実行の設定
+LLM_RETRIES = int(os.getenv("LLM_RETRIES", "1"))                # 最初のトークン前の失敗を別のバックエンドで再試行する回数
+EMBED_WORKERS = int(os.getenv("EMBED_WORKERS", "2"))            # 埋め込み計算用スレッド数
+SEARCH_WORKERS = int(os.getenv("SEARCH_WORKERS", "4"))          # Weaviate 検索用スレッド数
+
+# 起動と warmup
+API_WORKERS = int(os.getenv("API_WORKERS", "1"))                    # uvicorn のワーカープロセス数
+WARMUP_LLM = os.getenv("WARMUP_LLM", "0") not in ("0", "false", "False")  # warmup で Ollama にモデルを読み込ませる
+WARMUP_RETRY_SECONDS = float(os.getenv("WARMUP_RETRY_SECONDS", "5"))  # warmup 失敗時（Weaviate 未起動など）の再試行間隔
+EMBED_SERVER_START_TIMEOUT = float(os.getenv("EMBED_SERVER_START_TIMEOUT", "300"))  # 埋め込みサービスの起動を待つ秒数
+
+# クエリ埋め込みのマイクロバッチ（同時に来た質問を1回の forward にまとめる）
+QUERY_BATCH = os.getenv("QUERY_BATCH", "1") not in ("0", "false", "False")
+QUERY_BATCH_MAX = int(os.getenv("QUERY_BATCH_MAX", "16"))              # 1回にまとめる最大件数
+QUERY_BATCH_WAIT_MS = float(os.getenv("QUERY_BATCH_WAIT_MS", "3"))     # 最初の質問から待つ最大時間
 
-# BGE embedding
-embedding = HuggingFaceEmbeddings(model_name="BAAI/bge-m3")
+# /ask: 質問整形（refine）をするかどうかの判定
+REFINE_MODE = os.getenv("REFINE_MODE", "auto")                            # auto / always / never
+REFINE_MIN_CHARS = int(os.getenv("REFINE_MIN_CHARS", "15"))               # これより短い質問は整形する
+REFINE_SCORE_THRESHOLD = float(os.getenv("REFINE_SCORE_THRESHOLD", "0.5"))  # 上位チャンクとの cos 類似度がこれ未満なら整形
 
+# Qwen (Ollama経由)。OLLAMA_ENDPOINTS（無ければ OLLAMA_BASE_URL）に llm_gateway.py で振り分ける。
+# 負荷試験では devtools/mock_ollama.py に向ける
+OLLAMA_MODEL = os.getenv("OLLAMA_MODEL", "qwen2:7b-instruct")
+llm_gateway = LLMGateway.from_env(OLLAMA_MODEL, temperature=0.3)
+
+# BGE embedding（embeddings.py: 質問は "query: " 付き・正規化済み、埋め込みサービス / キャッシュ経由）
+# モデルの読み込みは起動後の warmup で行う（import 時には読み込まない）
+embedder = get_embedder()
+
+# 接続も warmup で行う（Weaviate が後から起動しても再試行で繋がる）
 client = WeaviateClient(
     connection_params=ConnectionParams.from_url(
         "http://localhost:8080", grpc_port=50051
     )
 )
-client.connect()
 
 # === Phase2: Confluenceドキュメント用 ===
-vectorstore = WeaviateVectorStore(
-    client=client,
-    index_name="ConfluenceChunk",
-    text_key="content",
-    embedding=embedding,
+CLASS_NAME = os.getenv("WEAVIATE_CLASS", "ConfluenceChunk")
+_collections = {}
+
+
+def current_collection():
+    """CLASS_NAME のエイリアスの現在の向き先（create_confluence_chunk_class.py --migrate で切り替わる）。"""
+    name = resolve_alias(CLASS_NAME)
+    if name not in _collections:
+        _collections[name] = client.collections.get(name)
+    return _collections[name]
+
+
+# 埋め込み（CPU）と Weaviate 検索（v4.6 クライアントは同期のみ）はイベントループ外の専用スレッドで実行
+embed_executor = ThreadPoolExecutor(max_workers=EMBED_WORKERS, thread_name_prefix="embed")
+search_executor = ThreadPoolExecutor(max_workers=SEARCH_WORKERS, thread_name_prefix="search")
+# QUERY_BATCH=1 ならクエリ埋め込みは embed_executor ではなくバッチャのスレッドでまとめて計算する
+# （埋め込みキャッシュはバッチ単位で引くので、ヒットした質問は encode されない）
+query_batcher = (
+    MicroBatcher(lambda texts, _normalize: embedder.embed_queries(texts),
+                 QUERY_BATCH_MAX, QUERY_BATCH_WAIT_MS, name="query-batcher",
+                 histogram=metrics.Histogram("rag_query_embed_batch_size", "Queries per embedding batch",
+                                             buckets=HIST_BUCKETS))
+    if QUERY_BATCH else None
 )
+# クロスエンコーダは CPU を使い切るので1本ずつ（RERANK=0 で無効）
+reranker = make_reranker()
+rerank_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="rerank")
+metrics.Gauge("rag_llm_inflight", "LLM calls currently generating", fn=lambda: llm_gateway.in_flight)
+metrics.Gauge("rag_llm_queue_depth", "LLM calls waiting for a slot", fn=lambda: llm_gateway.waiting)
+metrics.Gauge("rag_llm_backends_available", "LLM backends that are healthy and not circuit-broken",
+              fn=llm_gateway.available_backends)
+
+# 回答キャッシュ（ANSWER_CACHE=0 で無効）
+answer_cache = make_answer_cache()
+
+# warmup が終わるまでは /readyz と回答系の API が 503 を返す
+readiness = {"ready": False, "warmup_seconds": None, "attempts": 0, "error": None}
+
+
+def warmup() -> float:
+    """
+    Weaviate への接続・モデルの読み込みと、埋め込み → 検索 → 再ランキング → トークン数の1周を行う
+    （最初のリクエストが読み込みを待たないように）。所要秒数を返す。
+    """
+    t0 = time.perf_counter()
+    if not client.is_connected():
+        client.connect()
+    embedder.preload()  # 埋め込みサービスが無ければプロセス内のモデルを読み込む
+    vec = embedder.embed_query("warmup")
+    hits = retrieval.search(current_collection(), "warmup", vec, 1)
+    if reranker is not None and hits:
+        reranker.rerank("warmup", hits, 1)
+    count_tokens("warmup")
+    if WARMUP_LLM:
+        for backend in llm_gateway.backends:
+            backend.llm.invoke("ping")
+    return time.perf_counter() - t0
+
+
+async def warm_up_until_ready():
+    while True:
+        readiness["attempts"] += 1
+        try:
+            seconds = await run_in(embed_executor, warmup)
+        except Exception as e:
+            readiness["error"] = f"{type(e).__name__}: {e}"
+            logger.warning(f"warmup failed ({readiness['error']}), retrying in {WARMUP_RETRY_SECONDS:.0f}s")
+            await asyncio.sleep(WARMUP_RETRY_SECONDS)
+            continue
+        readiness.update(ready=True, error=None, warmup_seconds=round(seconds, 2))
+        logger.info(f"ready in {seconds:.1f}s (pid={os.getpid()})")
+        return
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    # warmup は裏で回し、その間も /healthz には応答する
+    task = asyncio.create_task(warm_up_until_ready())
+    llm_gateway.start()
+    yield
+    task.cancel()
+    await llm_gateway.close()
+    client.close()
+    for executor in (embed_executor, search_executor, rerank_executor):
+        executor.shutdown(wait=False, cancel_futures=True)
+
+
+def require_ready():
+    if not readiness["ready"]:
+        raise HTTPException(status_code=503, detail="warming up", headers={"Retry-After": str(int(WARMUP_RETRY_SECONDS))})
 
 # === FastAPI 初期化 ===
-app = FastAPI()
+app = FastAPI(lifespan=lifespan)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=["*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    expose_headers=["X-Request-ID", "Server-Timing"],
 )
 
+# /metrics 自身と存在しないパス（endpoint="other" にまとめてラベルを増やさない）はアクセスログに出さない
+QUIET_PATHS = {"/metrics", "/healthz", "/readyz"}
+
+
+@app.middleware("http")
+async def observe_request(request: Request, call_next):
+    """
+    request id（X-Request-ID を引き継ぐか採番）・Server-Timing ヘッダー・メトリクス・JSON アクセスログ。
+    ストリーミング応答は最後のバイトを送った後に記録する（Server-Timing はヘッダー送信時点までの段）。
+    """
+    rid = request.headers.get("X-Request-ID") or uuid.uuid4().hex
+    path = request.url.path
+    endpoint = path if any(getattr(r, "path", None) == path for r in app.routes) else "other"
+    log = endpoint not in QUIET_PATHS and endpoint != "other"
+    ctx = metrics.start_request(rid, endpoint)
+    try:
+        response = await call_next(request)
+    except Exception:
+        metrics.finish_request(ctx, 500, request.method, log=log)
+        raise
+    response.headers["X-Request-ID"] = rid
+    if ctx["timings"]:
+        response.headers["Server-Timing"] = metrics.server_timing(ctx["timings"])
+    body = response.body_iterator
+
+    async def body_then_finish():
+        try:
+            async for chunk in body:
+                yield chunk
+        finally:
+            metrics.finish_request(ctx, response.status_code, request.method, log=log)
+
+    response.body_iterator = body_then_finish()
+    return response
+
 # === モデル定義 ===
 class RefineRequest(BaseModel):
     raw_question: str
@@ -59,84 +233,494 @@ class QueryRequest(BaseModel):
     question: str
     prompt_type: Optional[str] = None
 
-# === API ①: /refine_question ===
-@app.post("/refine_question")
-def refine_question(req: RefineRequest):
-    prompt = (
-        "Here is a question input by a user in Japanese.\n"
-        "Please refine it into a technically clear and precise format that is easy for an AI to understand.\n"
-        "If the question is vague, add reasonable clarifications.\n"
-        "The output should be in Japanese, concise, and structured (e.g., bullet points or a well-organized sentence).\n\n"
-        f"【ユーザーの入力】\n{req.raw_question}\n\n"
-        "【整形された質問（日本語）】"
+class AskRequest(BaseModel):
+    raw_question: str
+    prompt_type: Optional[str] = None
+    refine: Optional[str] = None  # auto / always / never（未指定なら REFINE_MODE）
+
+# === 非同期ヘルパー ===
+async def run_in(executor, fn, *args, **kwargs):
+    loop = asyncio.get_running_loop()
+    return await loop.run_in_executor(executor, partial(fn, *args, **kwargs))
+
+
+async def embed_query_async(text: str):
+    if query_batcher is not None:
+        vecs = await asyncio.wrap_future(query_batcher.submit([text], normalize=False))
+        return vecs[0]
+    return await run_in(embed_executor, embedder.embed_query, text)
+
+
+def hit_to_document(hit) -> Document:
+    props = dict(hit["properties"])
+    text = props.pop("content", "") or ""
+    metadata = {**props, "uuid": hit["uuid"]}
+    for key in ("distance", "bm25", "ranks", "retrieval_score"):
+        if hit.get(key) not in (None, {}):
+            metadata[key] = hit[key]
+    return Document(page_content=text, metadata=metadata)
+
+
+async def search_hits(query_text: str, k: int, vec=None, timings: Optional[dict] = None, include_vector=False):
+    """埋め込み（必要なら）と retrieval.search を実行し、(ヒット, ベクトル) を返す。"""
+    timings = {} if timings is None else timings
+    if vec is None and retrieval.RETRIEVAL_MODE != "bm25":
+        t0 = time.perf_counter()
+        vec = await embed_query_async(query_text)
+        timings["embed"] = time.perf_counter() - t0
+    n = max(k, RERANK_CANDIDATES) if reranker is not None else k
+    hits = await run_in(
+        search_executor, retrieval.search, current_collection(), query_text, vec, n,
+        include_vector=include_vector, timings=timings,
     )
-    response = llm.invoke(prompt)
-    return {"refined_question": response.content}
+    hits = await rerank_hits(query_text, hits, k, timings)
+    metrics.observe_retrieval(hits)
+    return hits, vec
+
+
+async def rerank_hits(query_text: str, hits, k: int, timings: dict):
+    """
+    候補をクロスエンコーダで並べ替えて上位 k 件を返す。
+    RERANK_BUDGET_MS を超えたら、または再ランキングのサービスが使えなければ検索順の上位 k 件にフォールバックする
+    （裏で走り切った推論結果はスコアキャッシュに残るので、同じ質問の次回は間に合う）。
+    """
+    if reranker is None or len(hits) <= 1:
+        return hits[:k]
+    t0 = time.perf_counter()
+    future = rerank_executor.submit(reranker.rerank, query_text, hits, k)
+    try:
+        ranked = await asyncio.wait_for(asyncio.wrap_future(future), timeout=RERANK_BUDGET_MS / 1000)
+    except asyncio.TimeoutError:
+        reranker.fallbacks += 1
+        timings["rerank"] = time.perf_counter() - t0
+        logger.warning(f"rerank exceeded {RERANK_BUDGET_MS:.0f}ms budget, using retrieval order")
+        return hits[:k]
+    except EmbedServiceError as e:
+        reranker.fallbacks += 1
+        timings["rerank"] = time.perf_counter() - t0
+        logger.warning(f"rerank service failed ({str(e)[:200]}), using retrieval order")
+        return hits[:k]
+    timings["rerank"] = time.perf_counter() - t0
+    return ranked
+
+
+async def retrieve(query_text: str, k: int = 3, vec=None, timings: Optional[dict] = None):
+    hits, _ = await search_hits(query_text, k, vec, timings)
+    return [(hit_to_document(h), h["score"] or 0.0) for h in hits]
+
+
+def _cosine(a, b) -> float:
+    a, b = np.asarray(a, dtype=np.float32), np.asarray(b, dtype=np.float32)
+    denom = float(np.linalg.norm(a) * np.linalg.norm(b))
+    return float(a @ b) / denom if denom else 0.0
+
+
+async def retrieve_with_similarity(query_text: str, k: int = 3, vec=None, timings: Optional[dict] = None):
+    """検索結果と、クエリと上位チャンクのベクトルの最大 cos 類似度を返す。"""
+    if vec is None:
+        vec = await embed_query_async(query_text)
+    hits, vec = await search_hits(query_text, k, vec, timings, include_vector=True)
+    sims = [_cosine(vec, h["vector"]) for h in hits if h.get("vector") is not None]
+    return [(hit_to_document(h), h["score"] or 0.0) for h in hits], max(sims, default=0.0)
+
+
+def round_timings(timings: dict) -> dict:
+    return {k: round(v, 3) for k, v in timings.items()}
+
+
+def looks_well_formed(question: str) -> bool:
+    """整形しなくてもよさそうな質問か（長さと構造だけで判定する安価なヒューリスティック）。"""
+    q = (question or "").strip()
+    if len(q) < REFINE_MIN_CHARS:
+        return False
+    markers = ("?", "？", "か。", "ください", "教えて", "方法", "手順", "とは", "how", "what", "why")
+    return "\n" in q or any(m in q.lower() for m in markers)
+
+
+async def refine_and_retrieve(raw_question: str, refine_mode: str, k: int = 3, vec=None):
+    """
+    必要なときだけ質問を整形し、検索結果を返す。
+    戻り値: (検索に使った質問, 整形したか, docs_with_score, timings)
+    """
+    timings = metrics.request_timings()
+    t0 = time.perf_counter()
+    if refine_mode == "never" or (refine_mode == "auto" and looks_well_formed(raw_question)):
+        docs_with_score, top_sim = await retrieve_with_similarity(raw_question, k=k, vec=vec, timings=timings)
+        timings["retrieve"] = time.perf_counter() - t0
+        if refine_mode == "never" or top_sim >= REFINE_SCORE_THRESHOLD:
+            return raw_question, False, docs_with_score, timings
+        logger.info(f"refine: top similarity {top_sim:.3f} < {REFINE_SCORE_THRESHOLD}, refining")
+
+    t1 = time.perf_counter()
+    refined = await call_llm(build_refine_prompt(raw_question), PRIORITY_HIGH)
+    timings["refine"] = time.perf_counter() - t1
+    t2 = time.perf_counter()
+    docs_with_score = await retrieve(refined, k=k, timings=timings)
+    timings["retrieve"] = timings.get("retrieve", 0.0) + time.perf_counter() - t2
+    return refined, True, docs_with_score, timings
+
+
+def answer_priority(prompt_mode: str) -> int:
+    """詳細回答は生成が長いので、整形・簡易回答より後に回す。"""
+    return PRIORITY_LOW if prompt_mode == "detail" else PRIORITY_NORMAL
+
+
+async def call_llm(prompt: str, priority: int = PRIORITY_NORMAL) -> str:
+    tried = set()
+    for attempt in range(LLM_RETRIES + 1):
+        try:
+            async with llm_gateway.slot(priority, exclude=tried) as backend:
+                tried.add(backend.url)
+                metrics.annotate(llm_backend=backend.url)
+                t0 = time.perf_counter()
+                result = await backend.llm.agenerate([[HumanMessage(content=prompt)]])
+                elapsed = time.perf_counter() - t0
+            break
+        except LLMBusyError as e:
+            raise HTTPException(status_code=503, detail=str(e), headers={"Retry-After": "5"})
+        except Exception as e:
+            if attempt == LLM_RETRIES:
+                logger.exception("LLM call failed")
+                raise HTTPException(status_code=502, detail=f"LLM error: {e}")
+            logger.warning(f"LLM call failed ({str(e)[:200]}), retrying on another backend")
+    gen = result.generations[0][0]
+    # Ollama の最終チャンクのトークン数と生成時間（ナノ秒）。無ければ呼び出し全体の時間で近似する
+    info = gen.generation_info or {}
+    metrics.observe_llm(info.get("prompt_eval_count"), info.get("eval_count"),
+                        (info.get("eval_duration") or 0) / 1e9 or elapsed)
+    return gen.text
+
+
+def assemble_prompt(question: str, prompt_mode: str, docs_with_score, timings: dict):
+    """
+    検索結果を同じページの連続チャンクごとにまとめ、CONTEXT_MAX_TOKENS に収めてプロンプトを作る。
+    戻り値: (プロンプト, sources, context)。context はプロンプトのトークン数などでレスポンスに含める。
+    """
+    t0 = time.perf_counter()
+    built = build_context(docs_with_score)
+    prompt = build_answer_prompt(question, prompt_mode, built["text"])
+    context = {
+        "prompt_tokens": count_tokens(prompt),
+        "context_tokens": built["tokens"],
+        "passages": len(built["passages"]),
+        "dropped": built["dropped"],
+    }
+    timings["prompt"] = time.perf_counter() - t0
+    metrics.annotate(context=context)
+    return prompt, build_sources(built["passages"]), context
+
+
+async def lookup_answer(question: str, prompt_mode: str):
+    """
+    回答キャッシュを引く。戻り値は (ヒット or None, 質問ベクトル or None)。
+    完全一致で外れたら質問を埋め込んで近似一致を試し、そのベクトルは検索にも使い回す。
+    """
+    if answer_cache is None:
+        return None, None
+    hit = answer_cache.lookup(question, prompt_mode)
+    if hit:
+        return hit, None
+    vec = await embed_query_async(question)
+    return answer_cache.lookup(question, prompt_mode, vector=vec), vec
+
+
+def store_answer(question: str, prompt_mode: str, vec, answer: str, sources, gen_seconds: float, extra=None):
+    if answer_cache is not None and answer:
+        answer_cache.put(question, prompt_mode, vec, answer, sources, gen_seconds, extra)
+
+
+def sse(event: str, payload) -> str:
+    return f"event: {event}\ndata: {json.dumps(payload, ensure_ascii=False, default=str)}\n\n"
+
+
+async def stream_answer(prompt: str, sources, t0: float, label: str, extra: Optional[dict] = None, on_done=None,
+                        prompt_tokens: Optional[int] = None, priority: int = PRIORITY_NORMAL):
+    """
+    sources -> token（複数） -> done の SSE を生成する。extra は done イベントに含める。
+    on_done(answer, gen_seconds) は最後まで生成できたときに呼ばれる。
+    最初のトークンより前に失敗したら別のバックエンドで LLM_RETRIES 回まで再試行する。
+    """
+    yield sse("sources", {"sources": sources})
+    parts, ttft, tried = [], None, set()
+    for attempt in range(LLM_RETRIES + 1):
+        try:
+            async with llm_gateway.slot(priority, exclude=tried) as backend:
+                tried.add(backend.url)
+                metrics.annotate(llm_backend=backend.url)
+                t_gen = time.perf_counter()
+                async for chunk in backend.llm.astream(prompt):
+                    if not chunk.content:
+                        continue
+                    if ttft is None:
+                        ttft = time.perf_counter() - t0
+                    parts.append(chunk.content)
+                    yield sse("token", {"t": chunk.content})
+            break
+        except LLMBusyError as e:
+            logger.warning(f"{label} rejected: {e}")
+            yield sse("error", {"detail": str(e)})
+            return
+        except Exception as e:
+            if parts or attempt == LLM_RETRIES:
+                logger.exception(f"{label} LLM failed")
+                yield sse("error", {"detail": f"LLM error: {e}"})
+                return
+            logger.warning(f"{label} LLM failed before the first token ({str(e)[:200]}), retrying on another backend")
+    total = time.perf_counter() - t0
+    gen_seconds = time.perf_counter() - t_gen
+    # ストリームのチャンク数を生成トークン数とみなす（Ollama は1チャンク1トークン）
+    metrics.request_timings()["llm"] = gen_seconds
+    metrics.observe_llm(prompt_tokens, len(parts), total - ttft if ttft is not None else gen_seconds)
+    ttft_txt = f"{ttft:.3f}s" if ttft is not None else "n/a"
+    logger.info(f"{label} ttft={ttft_txt} total={total:.3f}s chunks={len(parts)} {extra or ''}")
+    answer = "".join(parts)
+    if on_done:
+        on_done(answer, gen_seconds)
+    yield sse("done", {"answer": answer, "ttft": ttft, "total": total, **(extra or {})})
+
+
+async def stream_cached(hit, t0: float, label: str, extra: Optional[dict] = None):
+    """キャッシュヒット時の SSE。回答全文を1つの token として返す。"""
+    extra = {**hit["extra"], **(extra or {}), "cached": hit["match"]}
+    metrics.annotate(cached=hit["match"])
+    logger.info(f"{label} answer cache {hit['match']} hit total={time.perf_counter() - t0:.3f}s")
+    yield sse("sources", {"sources": hit["sources"]})
+    yield sse("token", {"t": hit["answer"]})
+    yield sse("done", {"answer": hit["answer"], "ttft": time.perf_counter() - t0, "total": time.perf_counter() - t0, **extra})
+
+
+def sse_response(events) -> StreamingResponse:
+    return StreamingResponse(
+        events,
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+# === API ①: /refine_question ===
+@app.post("/refine_question", dependencies=[Depends(require_ready)])
+async def refine_question(req: RefineRequest):
+    t0 = time.perf_counter()
+    refined = await call_llm(build_refine_prompt(req.raw_question), PRIORITY_HIGH)
+    metrics.request_timings()["refine"] = time.perf_counter() - t0
+    return {"refined_question": refined}
 
 # === API ②: /query ===
-@app.post("/query")
-def query(req: QueryRequest):
+@app.post("/query", dependencies=[Depends(require_ready)])
+async def query(req: QueryRequest):
     query_text = req.question
-    prompt_type = req.prompt_type or "詳細回答ver"
+    prompt_mode = resolve_prompt_mode(req.prompt_type)
 
-    if prompt_type in ["詳細回答ver", "Detailed Answer"]:
-        prompt_mode = "detail"
-    else:
-        prompt_mode = "simple"
-
-    # Weaviateから類似検索
-    docs_with_score = vectorstore.similarity_search_with_score(query_text, k=3)
-    combined_text = "\n\n".join([doc.page_content for doc, _ in docs_with_score])
-
-    if prompt_mode == "detail":
-        prompt = (
-            f"The following is a set of past Confluence docs (topK=3).\n"
-            f"Please answer the following question **in Japanese**, based only on the information explicitly written in the documents.\n\n"
-            f"Question:\n{query_text}\n\n"
-            f"Instructions:\n"
-            f"- Output must be in **Markdown format**.\n"
-            f"- Do **not** use headings like 'Conclusion' or 'Details'.\n"
-            f"- Start with a natural sentence that clearly answers the question.\n"
-            f"- Then add background or explanation **without repeating the same wording or phrases used in the initial sentence.**\n"
-            f"- Bullet points are allowed if they improve clarity.\n"
-            f"- Use `**bold**` to emphasize important elements such as logic changes, validations, or team actions.\n"
-            f"- Do not bold common phrases.\n"
-            f"- At the end, include this line as a footnote **only if the answer is clearly supported by the docs**:\n"
-            f"\n  *この情報は、Confluenceドキュメントに基づいています。*\n"
-            f"- Do not use general knowledge or assumptions.\n\n"
-            f"Reference data:\n{combined_text}"
-        )
-    else:
-        prompt = (
-            f"The following is a set of past Confluence docs (topK=3).\n"
-            f"Please answer the following question **in Japanese**, based only on the information explicitly written in the documents.\n\n"
-            f"Question:\n{query_text}\n\n"
-            f"Instructions:\n"
-            f"- Output must be in **Markdown format**.\n"
-            f"- Start with a natural sentence that clearly answers the question.\n"
-            f"- If necessary, add one short supporting sentence without repeating the same wording.\n"
-            f"- Do not include background or assumptions.\n"
-            f"- Do not use bullet points.\n"
-            f"- Use `**bold**` only for key values, specific terms, or decisions.\n"
-            f"- At the end, include this line as a footnote **only if the answer is clearly supported by the docs**:\n"
-            f"\n  *この情報は、Confluenceドキュメントに基づいています。*\n"
-            f"- Do not use general knowledge or assumptions.\n\n"
-            f"Reference data:\n{combined_text}"
+    hit, vec = await lookup_answer(query_text, prompt_mode)
+    if hit:
+        metrics.annotate(cached=hit["match"])
+        return {"answer": hit["answer"], "sources": hit["sources"], "cached": hit["match"]}
+
+    # Weaviateから検索（dense / bm25 / hybrid は RETRIEVAL_MODE）
+    timings = metrics.request_timings()
+    docs_with_score = await retrieve(query_text, k=3, vec=vec, timings=timings)
+    prompt, sources, context = assemble_prompt(query_text, prompt_mode, docs_with_score, timings)
+
+    t1 = time.perf_counter()
+    answer = await call_llm(prompt, answer_priority(prompt_mode))
+    timings["llm"] = time.perf_counter() - t1
+    store_answer(query_text, prompt_mode, vec, answer, sources, timings["llm"])
+    logger.info(f"query timings {round_timings(timings)} context {context}")
+
+    return {"answer": answer, "sources": sources, "timings": round_timings(timings), "context": context}
+
+# === API ②': /query_stream（Server-Sent Events） ===
+@app.post("/query_stream", dependencies=[Depends(require_ready)])
+async def query_stream(req: QueryRequest):
+    """
+    /query のストリーミング版。イベントの順序:
+      sources -> token（複数） -> done（全文・TTFT）  / 失敗時は error
+    """
+    t0 = time.perf_counter()
+    query_text = req.question
+    prompt_mode = resolve_prompt_mode(req.prompt_type)
+
+    hit, vec = await lookup_answer(query_text, prompt_mode)
+    if hit:
+        return sse_response(stream_cached(hit, t0, "query_stream"))
+
+    timings = metrics.request_timings()
+    docs_with_score = await retrieve(query_text, k=3, vec=vec, timings=timings)
+    timings["retrieve"] = time.perf_counter() - t0
+    prompt, sources, context = assemble_prompt(query_text, prompt_mode, docs_with_score, timings)
+    extra = {"timings": round_timings(timings), "context": context}
+
+    def on_done(answer, gen_seconds):
+        store_answer(query_text, prompt_mode, vec, answer, sources, gen_seconds)
+
+    return sse_response(stream_answer(prompt, sources, t0, "query_stream", extra, on_done, context["prompt_tokens"],
+                                      answer_priority(prompt_mode)))
+
+# === API ⑤: /ask（整形 + 回答を1リクエストで） ===
+@app.post("/ask", dependencies=[Depends(require_ready)])
+async def ask(req: AskRequest):
+    """
+    /refine_question + /query をまとめたもの。整形済みに見える質問や、
+    そのままで十分近いチャンクが取れた質問は整形をスキップして LLM 呼び出しを1回にする。
+    """
+    t0 = time.perf_counter()
+    prompt_mode = resolve_prompt_mode(req.prompt_type)
+    hit, vec = await lookup_answer(req.raw_question, prompt_mode)
+    if hit:
+        metrics.annotate(cached=hit["match"])
+        return {**hit["extra"], "answer": hit["answer"], "sources": hit["sources"], "cached": hit["match"]}
+
+    question, refined, docs_with_score, timings = await refine_and_retrieve(
+        req.raw_question, req.refine or REFINE_MODE, vec=vec
+    )
+    prompt, sources, context = assemble_prompt(question, prompt_mode, docs_with_score, timings)
+    t1 = time.perf_counter()
+    answer = await call_llm(prompt, answer_priority(prompt_mode))
+    timings["answer"] = time.perf_counter() - t1
+    timings["total"] = time.perf_counter() - t0
+    extra = {"refined_question": question, "refined": refined}
+    store_answer(req.raw_question, prompt_mode, vec, answer, sources, timings["answer"] + timings.get("refine", 0.0), extra)
+    return {
+        **extra,
+        "answer": answer,
+        "sources": sources,
+        "timings": round_timings(timings),
+        "context": context,
+    }
+
+# === API ⑤': /ask_stream（Server-Sent Events） ===
+@app.post("/ask_stream", dependencies=[Depends(require_ready)])
+async def ask_stream(req: AskRequest):
+    """/ask のストリーミング版。done イベントに refined_question / refined を含める。"""
+    t0 = time.perf_counter()
+    prompt_mode = resolve_prompt_mode(req.prompt_type)
+    hit, vec = await lookup_answer(req.raw_question, prompt_mode)
+    if hit:
+        return sse_response(stream_cached(hit, t0, "ask_stream"))
+
+    try:
+        question, refined, docs_with_score, timings = await refine_and_retrieve(
+            req.raw_question, req.refine or REFINE_MODE, vec=vec
         )
+    except HTTPException as e:
+        return sse_response(iter([sse("error", {"detail": e.detail})]))
+    prompt, sources, context = assemble_prompt(question, prompt_mode, docs_with_score, timings)
+    cache_extra = {"refined_question": question, "refined": refined}
+    extra = {**cache_extra, "timings": round_timings(timings), "context": context}
 
-    response = llm.invoke(prompt)
+    def on_done(answer, gen_seconds):
+        store_answer(req.raw_question, prompt_mode, vec, answer, sources, gen_seconds + timings.get("refine", 0.0), cache_extra)
 
-    sources = [
-        {
-            "page_content": doc.page_content,
-            "metadata": doc.metadata,
-            "score": float(score),
-        }
-        for doc, score in docs_with_score
-    ]
+    return sse_response(stream_answer(prompt, sources, t0, "ask_stream", extra, on_done, context["prompt_tokens"],
+                                      answer_priority(prompt_mode)))
 
-    return {"answer": response.content, "sources": sources}
+# === API ③: /embedding_cache/stats ===
+@app.get("/embedding_cache/stats")
+def embedding_cache_stats():
+    return embedder.cache.stats() if embedder.cache is not None else {"enabled": False}
+
+# === API ④: /llm/stats ===
+@app.get("/llm/stats")
+def llm_stats():
+    return llm_gateway.stats()
+
+# === API ⑥: /answer_cache ===
+class InvalidateRequest(BaseModel):
+    page_ids: Optional[list[str]] = None  # 未指定なら全件破棄
+
+@app.get("/answer_cache/stats")
+async def answer_cache_stats():
+    return answer_cache.stats() if answer_cache is not None else {"enabled": False}
+
+@app.post("/answer_cache/invalidate")
+async def answer_cache_invalidate(req: InvalidateRequest):
+    if answer_cache is None:
+        return {"invalidated": 0}
+    n = answer_cache.invalidate_pages(req.page_ids) if req.page_ids else answer_cache.clear()
+    return {"invalidated": n}
+
+# === API ⑦: /rerank/stats ===
+@app.get("/rerank/stats")
+def rerank_stats():
+    return reranker.stats() if reranker is not None else {"enabled": False}
+
+# === API ⑧: /embedding_batch/stats ===
+@app.get("/embedding_batch/stats")
+def embedding_batch_stats():
+    return query_batcher.stats() if query_batcher is not None else {"enabled": False}
+
+# === API ⑨: /metrics（Prometheus テキスト形式） ===
+@app.get("/metrics")
+def prometheus_metrics():
+    return PlainTextResponse(metrics.render_metrics(), media_type="text/plain; version=0.0.4")
+
+# === API ⑩: /healthz（プロセスが動いているか）・/readyz（リクエストを受けられるか） ===
+@app.get("/healthz")
+def healthz():
+    return {"status": "ok", "pid": os.getpid()}
+
+@app.get("/readyz")
+async def readyz():
+    if not readiness["ready"]:
+        return JSONResponse(status_code=503, content={**readiness, "pid": os.getpid()})
+    weaviate_ready = await run_in(search_executor, client.is_ready)
+    status = 200 if weaviate_ready else 503
+    return JSONResponse(status_code=status, content={
+        **readiness, "ready": weaviate_ready, "weaviate": weaviate_ready, "embed_source": embedder.source,
+        "pid": os.getpid(),
+    })
 
 # === 実行 ===
+def start_embed_service():
+    """
+    ワーカー間で埋め込みモデルと再ランキングのモデルを1つずつだけ持つよう、embed_server.py を子プロセスで起動して
+    EMBED_SERVER_URL / RERANK_SERVER_URL をワーカーに引き継ぐ。既にサービスが動いていればそれを使う。
+    """
+    port = os.getenv("EMBED_SERVER_PORT", "8089")
+    url = os.getenv("EMBED_SERVER_URL") or f"http://{os.getenv('EMBED_SERVER_HOST', '127.0.0.1')}:{port}"
+    probe = EmbedClient(url)
+    proc = None
+    try:
+        info = probe.health()
+        logger.info(f"using embed service at {url} ({info.get('model_id')})")
+    except EmbedServiceError:
+        parsed = urlparse(url)
+        cmd = [sys.executable, os.path.join(os.path.dirname(os.path.abspath(__file__)), "embed_server.py"),
+               "--host", parsed.hostname, "--port", str(parsed.port or port)]
+        if RERANK_ENABLED:
+            cmd += ["--rerank-model", RERANK_MODEL]
+        logger.info(f"starting embed service: {' '.join(cmd)}")
+        proc = subprocess.Popen(cmd)
+        atexit.register(proc.terminate)
+        deadline = time.monotonic() + EMBED_SERVER_START_TIMEOUT
+        while time.monotonic() < deadline:
+            if proc.poll() is not None:
+                raise RuntimeError(f"embed_server.py exited with code {proc.returncode}")
+            try:
+                info = probe.health()
+                break
+            except EmbedServiceError:
+                time.sleep(1)
+        else:
+            proc.terminate()
+            raise RuntimeError(f"embed service did not start within {EMBED_SERVER_START_TIMEOUT:.0f}s")
+    os.environ["EMBED_SERVER_URL"] = url
+    if RERANK_ENABLED:
+        if info.get("rerank_model") == RERANK_MODEL:
+            os.environ["RERANK_SERVER_URL"] = url
+        else:
+            # ワーカーごとにクロスエンコーダを読み込むとメモリがワーカー数に比例するので、再ランキングは止める
+            logger.warning(f"embed service at {url} does not serve {RERANK_MODEL} (restart it with "
+                           f"--rerank-model {RERANK_MODEL}); reranking is disabled in the workers")
+            os.environ["RERANK"] = "0"
+    return proc
+
+
 if __name__ == "__main__":
-    uvicorn.run(app, host="0.0.0.0", port=8000)
+    if API_WORKERS > 1:
+        # uvicorn のワーカーは spawn で起動し直す（fork ではない）ので、埋め込みと再ランキングのモデルは埋め込みサービスに1つだけ読み込んで共有する
+        start_embed_service()
+        uvicorn.run("api_server_phase2:app", host="0.0.0.0", port=8000, workers=API_WORKERS,
+                    app_dir=os.path.dirname(os.path.abspath(__file__)))
+    else:
+        uvicorn.run(app, host="0.0.0.0", port=8000)
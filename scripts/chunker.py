@@ -0,0 +1,313 @@
+# phase2/scripts/chunker.py
+"""
+Confluence storage(XHTML) の構造を使ったチャンク分割。
+
+- 見出し（h1〜h6）の区切りでチャンクを分け、見出しの階層を headingPath（"概要 > 手順"）として持たせる
+- コードブロック（code / noformat マクロ、<pre>）と表は途中で切らない
+  （予算を超える場合だけ、コードは行単位、表は行単位 + ヘッダー行の繰り返しで分割）
+- チャンクの大きさは文字数ではなく bge-m3 トークナイザのトークン数で測る
+- チャンク間のオーバーラップは持たない
+
+  from chunker import chunk_storage, make_token_counter
+  chunks = chunk_storage(storage_html, make_token_counter("BAAI/bge-m3"))
+  # -> [{"content": "...", "headingPath": "概要 > 手順", "tokens": 412}, ...]
+
+ingest のパイプラインからは split_page をプロセスプールで呼ぶ（本文テキストとチャンクを1回のパースで作る）。
+"""
+import os
+import re
+import time
+
+from bs4 import BeautifulSoup, NavigableString, Tag
+from bs4.element import CData, PreformattedString
+
+CHUNK_MAX_TOKENS = int(os.environ.get("CHUNK_MAX_TOKENS", "800"))
+CHUNK_MIN_TOKENS = int(os.environ.get("CHUNK_MIN_TOKENS", "100"))  # これ未満なら次の見出しと同じチャンクにまとめる
+
+# CHUNKER=chars（旧来の固定長ウィンドウ）用
+CHARS_PER_CHUNK = 1200
+CHUNK_OVERLAP = 200
+
+# チャンク分割ロジックを変えたら上げる（マニフェストの本文ハッシュに含め、再 ingest させる）
+CHUNKER_VERSION = "structure-4"
+
+HEADINGS = {"h1", "h2", "h3", "h4", "h5", "h6"}
+CODE_MACROS = {"code", "noformat"}
+# 中身をそのまま辿るだけのコンテナ要素
+CONTAINERS = {
+    "div", "section", "article", "body",
+    "ac:layout", "ac:layout-section", "ac:layout-cell", "ac:rich-text-body",
+}
+# 子孫にこれがある要素は1ブロックにまとめず中を辿る
+STRUCTURAL = HEADINGS | {"pre", "table", "ac:structured-macro"}
+HEADING_SEP = " > "
+
+
+def make_token_counter(model_name_or_path: str):
+    """bge-m3 のトークナイザでトークン数を数える関数を返す（特殊トークンは含めない）。"""
+    from transformers import AutoTokenizer
+
+    tok = AutoTokenizer.from_pretrained(model_name_or_path)
+
+    def count(text: str) -> int:
+        return len(tok(text, add_special_tokens=False)["input_ids"])
+
+    return count
+
+
+_counters = {}
+
+
+def cached_token_counter(model_name_or_path: str):
+    """プロセスごとに1回だけトークナイザを読み込む（プロセスプールのワーカー用）。"""
+    if model_name_or_path not in _counters:
+        _counters[model_name_or_path] = make_token_counter(model_name_or_path)
+    return _counters[model_name_or_path]
+
+
+def parse_storage(storage_html: str):
+    """
+    Confluence storage(XHTML) をパースする。
+    コードブロックの <ac:plain-text-body><![CDATA[...]]></ac:plain-text-body> は
+    事前に <pre>...</pre> に置換しておく。
+    """
+    html = re.sub(
+        r"<ac:plain-text-body><!\[CDATA\[(.*?)\]\]></ac:plain-text-body>",
+        lambda m: f"<pre>{m.group(1)}</pre>",
+        storage_html or "",
+        flags=re.S,
+    )
+    return BeautifulSoup(html, "html5lib")
+
+
+def soup_to_text(soup) -> str:
+    """パース済み storage -> プレーンテキスト（変更判定のハッシュと chars モードに使う）。"""
+    text = soup.get_text("\n")
+    return re.sub(r"\n{3,}", "\n\n", text).strip()
+
+
+def chunk_text(txt: str, size=CHARS_PER_CHUNK, overlap=CHUNK_OVERLAP):
+    """旧来の固定長分割（CHUNKER=chars）。"""
+    txt = (txt or "").strip()
+    if not txt:
+        return []
+    out, i, n = [], 0, len(txt)
+    while i < n:
+        j = min(n, i + size)
+        out.append(txt[i:j])
+        if j == n:
+            break
+        i = max(j - overlap, 0)
+    return out
+
+
+def _clean(text: str) -> str:
+    text = re.sub(r"[ \t ]+\n", "\n", text)
+    return re.sub(r"\n{3,}", "\n\n", text).strip()
+
+
+def _table_text(table: Tag) -> str:
+    rows = []
+    for tr in table.find_all("tr"):
+        cells = [c.get_text(" ", strip=True) for c in tr.find_all(["th", "td"], recursive=False)]
+        if any(cells):
+            rows.append("| " + " | ".join(cells) + " |")
+    return "\n".join(rows)
+
+
+def _macro_name(tag: Tag) -> str:
+    return (tag.get("ac:name") or "").lower()
+
+
+def iter_blocks(soup):
+    """
+    文書順に (見出しパス, 種類, テキスト) を返す。種類は heading / text / code / table。
+    """
+    path = []
+    root = soup.body or soup
+
+    def here():
+        return tuple(p for p in path if p)
+
+    def walk(node):
+        for child in node.children:
+            if isinstance(child, PreformattedString) and not isinstance(child, CData):
+                continue  # コメント・DOCTYPE など（soup_to_text の get_text と同じく本文に含めない）
+            if isinstance(child, NavigableString):
+                text = _clean(str(child))
+                if text:
+                    yield here(), "text", text
+                continue
+            if not isinstance(child, Tag):
+                continue
+            name = child.name
+            if name in HEADINGS:
+                text = child.get_text(" ", strip=True)
+                if not text:
+                    continue
+                level = int(name[1])
+                del path[level - 1:]
+                path.extend([""] * (level - 1 - len(path)))
+                path.append(text)
+                yield here(), "heading", text
+            elif name == "pre":
+                text = child.get_text().strip("\n")
+                if text.strip():
+                    yield here(), "code", text
+            elif name == "table":
+                text = _table_text(child)
+                if text:
+                    yield here(), "table", text
+            elif name == "ac:structured-macro":
+                if _macro_name(child) in CODE_MACROS:
+                    pre = child.find("pre")
+                    if pre is not None and pre.get_text().strip():
+                        yield here(), "code", pre.get_text().strip("\n")
+                else:
+                    # info / panel / expand などは本文（rich-text-body）だけ辿る。パラメータは捨てる
+                    for body in child.find_all("ac:rich-text-body", recursive=False):
+                        yield from walk(body)
+            elif name == "ac:parameter":
+                continue
+            elif name in CONTAINERS or child.find(STRUCTURAL):
+                yield from walk(child)
+            else:
+                text = _clean(child.get_text("\n"))
+                if text:
+                    yield here(), "text", text
+
+    yield from walk(root)
+
+
+# ---- 予算を超えるブロックの分割 ----
+# 幅ゼロで区切る（英文の後の空白は次の文の先頭に残るので、sep="" で詰め直しても単語がくっつかない）
+_SENTENCE_RE = re.compile(r"(?<=[。．！？!?])(?!\s)|(?<=[。．！？!?.])(?=\s)")
+
+
+def _hard_split(text: str, budget: int, count) -> list:
+    """1文でも予算を超える場合の最終手段。トークン数に比例した文字数で切る。"""
+    out = []
+    while text:
+        n = count(text)
+        if n <= budget:
+            out.append(text)
+            break
+        size = max(1, len(text) * budget // n)
+        while size > 1 and count(text[:size]) > budget:
+            size = size * 9 // 10
+        out.append(text[:size])
+        text = text[size:]
+    return out
+
+
+def _pack_lines(lines, budget: int, count, header: str = "", sep: str = "\n") -> list:
+    """行を予算内に詰める。header（表の見出し行）は各パートの先頭に付け直す。"""
+    header_tokens = count(header) if header else 0
+    room = budget - header_tokens
+    parts, cur, cur_tokens = [], [], 0
+    for line in lines:
+        n = count(line)
+        if n > room:
+            # 1行で予算を超える → 文 → 文字の順に細かくする
+            if cur:
+                parts.append(cur)
+                cur, cur_tokens = [], 0
+            pieces = [p for p in _SENTENCE_RE.split(line) if p and p.strip()]
+            if len(pieces) > 1:
+                parts.extend([p.strip()] for p in _pack_lines(pieces, room, count, sep=""))
+            else:
+                parts.extend([p] for p in _hard_split(line, room, count))
+            continue
+        if cur and cur_tokens + n > room:
+            parts.append(cur)
+            cur, cur_tokens = [], 0
+        cur.append(line)
+        cur_tokens += n
+    if cur:
+        parts.append(cur)
+    prefix = header + "\n" if header else ""
+    return [prefix + sep.join(p) for p in parts]
+
+
+def _split_block(kind: str, text: str, budget: int, count) -> list:
+    lines = text.split("\n")
+    if kind == "table" and len(lines) > 1 and count(lines[0]) < budget // 2:
+        return _pack_lines(lines[1:], budget, count, header=lines[0])
+    return _pack_lines(lines, budget, count)
+
+
+def _common_prefix(paths) -> tuple:
+    first = paths[0]
+    n = len(first)
+    for p in paths[1:]:
+        n = min(n, len(p))
+        for i in range(n):
+            if p[i] != first[i]:
+                n = i
+                break
+    return first[:n]
+
+
+def chunk_blocks(blocks, count, max_tokens: int = CHUNK_MAX_TOKENS, min_tokens: int = CHUNK_MIN_TOKENS) -> list:
+    """
+    iter_blocks の結果を見出し単位でチャンクにまとめる。
+    見出しが変わったら区切る（ただし今のチャンクが min_tokens 未満で、次の節が同じ最上位の見出しの下なら合わせる）。
+    headingPath はチャンク内の節に共通する見出しパス。
+    見出しの直後のブロックが予算に収まらないときは、見出しだけのチャンクを作らず、
+    ブロックを見出しの分だけ小さく分割して最初のパートを見出しと同じチャンクに入れる。
+    """
+    chunks = []
+    cur, cur_paths, cur_kinds, cur_tokens, cur_path = [], [], [], 0, None
+
+    def flush():
+        nonlocal cur, cur_paths, cur_kinds, cur_tokens
+        if cur:
+            path = _common_prefix(cur_paths)
+            chunks.append({"content": "\n\n".join(cur), "headingPath": HEADING_SEP.join(path), "tokens": cur_tokens})
+        cur, cur_paths, cur_kinds, cur_tokens = [], [], [], 0
+
+    for path, kind, text in blocks:
+        if path != cur_path:
+            if cur_tokens >= min_tokens or not (cur_path and path and cur_path[0] == path[0]):
+                flush()
+            cur_path = path
+        n = count(text)
+        headings_only = bool(cur) and all(k == "heading" for k in cur_kinds) and cur_tokens < max_tokens // 2
+        if headings_only and kind != "heading" and cur_tokens + n > max_tokens:
+            pieces = _split_block(kind, text, max_tokens - cur_tokens, count)
+        elif n > max_tokens:
+            pieces = _split_block(kind, text, max_tokens, count)
+        else:
+            pieces = [text]
+        for piece in pieces:
+            pn = n if len(pieces) == 1 else count(piece)
+            if cur and cur_tokens + pn > max_tokens:
+                flush()
+            cur.append(piece)
+            cur_paths.append(path)
+            cur_kinds.append(kind)
+            cur_tokens += pn
+    flush()
+    return chunks
+
+
+def chunk_storage(storage_html: str, count, max_tokens: int = CHUNK_MAX_TOKENS,
+                  min_tokens: int = CHUNK_MIN_TOKENS) -> list:
+    """storage(XHTML) -> [{"content", "headingPath", "tokens"}]"""
+    return chunk_blocks(iter_blocks(parse_storage(storage_html)), count, max_tokens, min_tokens)
+
+
+def split_page(storage_html: str, chunker: str = "structure", model_name_or_path: str = "BAAI/bge-m3",
+               max_tokens: int = CHUNK_MAX_TOKENS, min_tokens: int = CHUNK_MIN_TOKENS) -> dict:
+    """
+    1ページ分のパースと分割。{"text", "chunks", "seconds"} を返す。
+    ingest のプロセスプールから呼ばれるので、引数・戻り値は pickle できるものだけにする。
+    """
+    t0 = time.perf_counter()
+    soup = parse_storage(storage_html)
+    text = soup_to_text(soup)
+    if chunker == "chars":
+        chunks = [{"content": c, "headingPath": ""} for c in chunk_text(text)]
+    else:
+        chunks = chunk_blocks(iter_blocks(soup), cached_token_counter(model_name_or_path), max_tokens, min_tokens)
+    return {"text": text, "chunks": chunks, "seconds": time.perf_counter() - t0}
@@ -0,0 +1,66 @@
+# phase2/scripts/collection_alias.py
+"""
+コレクション名のエイリアス（WEAVIATE_CLASS -> 実際のコレクション）。
+Weaviate 1.27 にはエイリアス機能が無いので、data/collection_alias.json で管理する。
+
+  {"ConfluenceChunk": {"target": "ConfluenceChunk_v3", "previous": "ConfluenceChunk_v2", "switched_at": "..."}}
+
+create_confluence_chunk_class.py --migrate が新しいコレクションへコピーしたあとに切り替え、
+ingest・検索・API サーバーは resolve_alias() で毎回引き直す（ファイルの更新時刻が変わったときだけ読み直す）。
+ファイルは一時ファイルから os.replace で置き換えるので、読み手が書きかけの内容を見ることはない。
+"""
+import os
+import json
+import threading
+from datetime import datetime, timezone
+
+from dotenv import load_dotenv
+
+# 呼び出し側の import 順に依存しないように、COLLECTION_ALIAS_FILE を読む前に .env を反映する
+load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), "..", ".env"))
+
+ALIAS_FILE = os.getenv(
+    "COLLECTION_ALIAS_FILE", os.path.join(os.path.dirname(__file__), "..", "data", "collection_alias.json")
+)
+
+_lock = threading.Lock()
+_cached = {"mtime": None, "aliases": {}}
+
+
+def load_aliases(path: str = ALIAS_FILE) -> dict:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return {}
+
+
+def resolve_alias(name: str, path: str = ALIAS_FILE) -> str:
+    """エイリアスが設定されていればその先のコレクション名、無ければ name をそのまま返す。"""
+    try:
+        mtime = os.stat(path).st_mtime_ns
+    except FileNotFoundError:
+        return name
+    with _lock:
+        if _cached["mtime"] != mtime:
+            _cached["aliases"] = load_aliases(path)
+            _cached["mtime"] = mtime
+        entry = _cached["aliases"].get(name)
+    return entry["target"] if entry else name
+
+
+def set_alias(name: str, target: str, path: str = ALIAS_FILE) -> str:
+    """name の向き先を target に切り替え、直前の向き先を返す。"""
+    aliases = load_aliases(path)
+    previous = aliases.get(name, {}).get("target", name)
+    aliases[name] = {
+        "target": target,
+        "previous": previous,
+        "switched_at": datetime.now(timezone.utc).isoformat(timespec="seconds"),
+    }
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp = f"{path}.{os.getpid()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(aliases, f, ensure_ascii=False, indent=2)
+    os.replace(tmp, path)
+    return previous
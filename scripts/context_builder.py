@@ -0,0 +1,169 @@
+# phase2/scripts/context_builder.py
+"""
+検索結果から LLM に渡す参照データ（Reference data）を組み立てる。
+
+  1. 同じ pageId で chunkIndex が連続するチャンクを1つのパッセージにまとめ、
+     前のチャンクの末尾と次のチャンクの先頭の重なり（CHUNKER=chars の 200 文字など）を取り除く
+  2. 本文が同じパッセージ（コピーされたページなど）は1つだけ残す
+  3. 検索順にパッセージを詰め、LLM のトークナイザで数えて CONTEXT_MAX_TOKENS に収める
+     （収まらないパッセージは飛ばす。1件も入らない場合だけ先頭を途中で切る）
+
+Ollama は num_ctx（既定 2048）を超えたプロンプトの先頭を黙って切り捨てるので、
+予算は num_ctx から指示文と回答の分を引いた値にしておく。
+
+  from context_builder import build_context, count_tokens
+  ctx = build_context(docs_with_score)
+  # -> {"text": "...", "passages": [...], "tokens": 812, "dropped": 1}
+"""
+import os
+import logging
+
+CONTEXT_MAX_TOKENS = int(os.getenv("CONTEXT_MAX_TOKENS", "1500"))
+# 空にすると文字数からの概算（日本語 2 文字 ≒ 1 トークン）で数える
+CONTEXT_TOKENIZER = os.getenv("CONTEXT_TOKENIZER", "Qwen/Qwen2-7B-Instruct")
+SOURCE_PREVIEW_CHARS = int(os.getenv("SOURCE_PREVIEW_CHARS", "300"))
+MAX_OVERLAP_CHARS = 400  # 重なりを探す最大文字数（CHUNK_OVERLAP より十分大きく）
+MIN_OVERLAP_CHARS = 20   # これより短い一致は偶然とみなして取り除かない
+SEPARATOR = "\n\n"
+
+logger = logging.getLogger(__name__)
+
+_counter = None
+
+
+def approx_tokens(text: str) -> int:
+    return len(text or "") // 2
+
+
+def _load_counter():
+    if not CONTEXT_TOKENIZER:
+        return approx_tokens
+    try:
+        from chunker import make_token_counter
+        return make_token_counter(CONTEXT_TOKENIZER)
+    except Exception as e:
+        logger.warning(f"tokenizer {CONTEXT_TOKENIZER} unavailable ({e}), using approximate token counts")
+        return approx_tokens
+
+
+def count_tokens(text: str) -> int:
+    """LLM のトークナイザでトークン数を数える（トークナイザは初回に1度だけ読み込む）。"""
+    global _counter
+    if _counter is None:
+        _counter = _load_counter()
+    return _counter(text)
+
+
+def strip_overlap(prev: str, nxt: str, max_chars: int = MAX_OVERLAP_CHARS) -> str:
+    """prev の末尾と一致する nxt の先頭部分を取り除いた nxt を返す。"""
+    for n in range(min(len(prev), len(nxt), max_chars), MIN_OVERLAP_CHARS - 1, -1):
+        if prev.endswith(nxt[:n]):
+            return nxt[n:]
+    return nxt
+
+
+def merge_adjacent(docs_with_score):
+    """
+    [(Document, score)] を、同じページの連続するチャンクをまとめたパッセージのリストにする。
+    並びは各パッセージの最上位チャンクの検索順。
+    """
+    groups = {}
+    for rank, (doc, score) in enumerate(docs_with_score):
+        meta = doc.metadata or {}
+        page_id = meta.get("pageId")
+        key = page_id if page_id is not None else f"#{rank}"
+        groups.setdefault(key, []).append((meta.get("chunkIndex"), rank, doc, float(score)))
+
+    passages = []
+    for items in groups.values():
+        items.sort(key=lambda it: (it[0] is None, it[0] if it[0] is not None else it[1]))
+        run = None
+        for index, rank, doc, score in items:
+            if run is not None and index is not None and run["chunk_indexes"][-1] == index - 1:
+                run["text"] += SEPARATOR + strip_overlap(run["text"], doc.page_content).lstrip()
+                run["chunk_indexes"].append(index)
+                run["ids"].append(doc.metadata.get("uuid"))
+                run["rank"] = min(run["rank"], rank)
+                run["score"] = max(run["score"], score)
+                continue
+            run = {
+                "text": doc.page_content or "",
+                "metadata": doc.metadata or {},
+                "chunk_indexes": [index],
+                "ids": [(doc.metadata or {}).get("uuid")],
+                "rank": rank,
+                "score": score,
+                "truncated": False,
+            }
+            passages.append(run)
+    passages.sort(key=lambda p: p["rank"])
+    return passages
+
+
+def _truncate(text: str, budget: int) -> str:
+    """budget トークンに収まる最長の先頭部分（文字数で二分探索）。"""
+    lo, hi = 0, len(text)
+    while lo < hi:
+        mid = (lo + hi + 1) // 2
+        if count_tokens(text[:mid]) <= budget:
+            lo = mid
+        else:
+            hi = mid - 1
+    return text[:lo]
+
+
+def build_context(docs_with_score, max_tokens: int = None) -> dict:
+    """
+    検索結果から参照データを作る。戻り値:
+      text      プロンプトに入れる本文
+      passages  使ったパッセージ（text / metadata / chunk_indexes / ids / score / tokens / truncated）
+      tokens    text のトークン数
+      dropped   予算に入らなかったパッセージ数
+    """
+    budget = CONTEXT_MAX_TOKENS if max_tokens is None else max_tokens
+    sep_tokens = count_tokens(SEPARATOR)
+    used, seen, dropped, total = [], set(), 0, 0
+    for p in merge_adjacent(docs_with_score):
+        body = p["text"].strip()
+        if not body or body in seen:
+            continue
+        seen.add(body)
+        need = count_tokens(body) + (sep_tokens if used else 0)
+        if budget > 0 and total + need > budget:
+            if used:
+                dropped += 1
+                continue
+            body = _truncate(body, budget)
+            need = count_tokens(body)
+            p["truncated"] = True
+        p["text"] = body
+        p["tokens"] = need
+        total += need
+        used.append(p)
+    return {
+        "text": SEPARATOR.join(p["text"] for p in used),
+        "passages": used,
+        "tokens": total,
+        "dropped": dropped,
+    }
+
+
+def build_sources(passages):
+    """レスポンスの sources。本文は冒頭 SOURCE_PREVIEW_CHARS 文字のプレビューとチャンク ID だけにする。"""
+    sources = []
+    for p in passages:
+        meta = p["metadata"]
+        text = p["text"]
+        sources.append({
+            "ids": [i for i in p["ids"] if i],
+            "metadata": {
+                "pageId": meta.get("pageId"),
+                "title": meta.get("title"),
+                "url": meta.get("url"),
+                "headingPath": meta.get("headingPath"),
+                "chunkIndexes": [i for i in p["chunk_indexes"] if i is not None],
+            },
+            "score": p["score"],
+            "preview": text[:SOURCE_PREVIEW_CHARS] + ("..." if len(text) > SOURCE_PREVIEW_CHARS else ""),
+        })
+    return sources
@@ -1,44 +1,295 @@
 import os
+import re
+import time
+import argparse
 import weaviate
+import numpy as np
 from dotenv import load_dotenv
-from weaviate.classes.config import Property, DataType, Configure
+from weaviate.classes.config import Property, DataType, Configure, Tokenization, VectorDistances
 
 # .env 読み込み（WEAVIATE_CLASS など任意）
 load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), "..", ".env"))
 
+from collection_alias import load_aliases, resolve_alias, set_alias  # noqa: E402
+from vector_reduction import VectorReducer, load_reducer, parse_spec, reducer_path  # noqa: E402
+
 # 環境変数（なくてもデフォルト値でOK）
-CLASS_NAME = os.getenv("WEAVIATE_CLASS", "ConfluenceChunk")
+CLASS_NAME = os.getenv("WEAVIATE_CLASS", "ConfluenceChunk")  # エイリアス名（実体は collection_alias.py で解決）
 HOST = os.getenv("WEAVIATE_HOST", "localhost")
 PORT = int(os.getenv("WEAVIATE_PORT", "8080"))
 GRPC_PORT = int(os.getenv("WEAVIATE_GRPC_PORT", "50051"))
 
-# --- Weaviate 接続（ローカル。API Key/ヘッダー不要） ---
-client = weaviate.connect_to_local(host=HOST, port=PORT, grpc_port=GRPC_PORT)
-print("✅ Connected to Weaviate")
-
-# 既存クラスがあれば削除（必要に応じてコメントアウト）
-existing = client.collections.list_all()
-if CLASS_NAME in existing:
-    client.collections.delete(CLASS_NAME)
-    print(f"🧹 既存の {CLASS_NAME} コレクションを削除しました")
-
-# --- クラス作成 ---
-# ※ Phase1 と違い：
-#   - vectorizer は外部（bge-m3）で生成するため none
-#   - Generative も使わないので未設定
-#   - updatedAt は DATE 型にしておくと後で範囲検索が楽
-client.collections.create(
-    name=CLASS_NAME,
-    properties=[
-        Property(name="pageId",     data_type=DataType.TEXT),
-        Property(name="title",      data_type=DataType.TEXT),
-        Property(name="url",        data_type=DataType.TEXT),
-        Property(name="updatedAt",  data_type=DataType.DATE),
-        Property(name="content",    data_type=DataType.TEXT),
-        Property(name="chunkIndex", data_type=DataType.INT),
-    ],
-    vectorizer_config=Configure.Vectorizer.none(),
-)
-
-print(f"✅ {CLASS_NAME} コレクションを作成しました")
-client.close()
+# BM25 用の title / content のトークナイズ方式
+#   trigram: 辞書不要。日本語・チケット番号・テーブル名などの識別子の部分一致に強い（既定）
+#   gse    : 日本語の形態素分割（Weaviate 側で ENABLE_TOKENIZER_GSE=true が必要）
+#   word   : 英語向け（Weaviate の既定）
+TEXT_TOKENIZATION = Tokenization(os.getenv("TEXT_TOKENIZATION", "trigram"))
+
+# ベクトルの圧縮（bench_vector_compression.py で recall とメモリを比較してから選ぶ）
+#   VECTOR_REDUCTION: none / truncate:<dim> / pca:<dim>  保存する次元そのものを減らす（ingest・検索も自動で従う）
+#   VECTOR_QUANTIZER: none / pq / bq                     Weaviate の HNSW 圧縮（検索時は元ベクトルで再スコア）
+VECTOR_REDUCTION = os.getenv("VECTOR_REDUCTION", "none")
+VECTOR_QUANTIZER = os.getenv("VECTOR_QUANTIZER", "none")
+PQ_SEGMENTS = int(os.getenv("PQ_SEGMENTS", "0"))                # 0 = Weaviate 既定
+PQ_TRAINING_LIMIT = int(os.getenv("PQ_TRAINING_LIMIT", "100000"))
+PCA_FIT_SAMPLE = int(os.getenv("PCA_FIT_SAMPLE", "50000"))      # PCA の学習に使う最大件数
+FULL_DIM = 1024
+
+# HNSW のパラメータ（未設定なら Weaviate の既定値）
+#   ef: 検索時の候補数（-1 = 動的）/ efConstruction: 構築時の候補数 / maxConnections: 1ノードの最大接続数
+HNSW_EF = os.getenv("HNSW_EF")
+HNSW_EF_CONSTRUCTION = os.getenv("HNSW_EF_CONSTRUCTION")
+HNSW_MAX_CONNECTIONS = os.getenv("HNSW_MAX_CONNECTIONS")
+VECTOR_DISTANCE = os.getenv("VECTOR_DISTANCE", "cosine")  # cosine / dot / l2-squared
+
+# --migrate のコピー設定
+COPY_BATCH_SIZE = int(os.getenv("COPY_BATCH_SIZE", "200"))
+
+
+def _int_or_none(value):
+    return int(value) if value not in (None, "") else None
+
+
+def quantizer_config(kind: str):
+    if kind == "pq":
+        return Configure.VectorIndex.Quantizer.pq(segments=PQ_SEGMENTS or None, training_limit=PQ_TRAINING_LIMIT)
+    if kind == "bq":
+        return Configure.VectorIndex.Quantizer.bq()
+    return None
+
+
+def vector_index_config(args):
+    return Configure.VectorIndex.hnsw(
+        distance_metric=VectorDistances(args.distance),
+        ef=args.ef,
+        ef_construction=args.ef_construction,
+        max_connections=args.max_connections,
+        quantizer=quantizer_config(args.quantizer),
+    )
+
+
+def collect_vectors(client, name: str, limit: int):
+    """既存コレクションのベクトルを最大 limit 件集める（PCA の学習用。削除前に呼ぶ）。"""
+    if name not in client.collections.list_all():
+        return np.zeros((0, FULL_DIM), dtype=np.float32)
+    vecs = []
+    for o in client.collections.get(name).iterator(include_vector=True, return_properties=[]):
+        vec = o.vector.get("default") if isinstance(o.vector, dict) else o.vector
+        if vec is not None:
+            vecs.append(vec)
+        if len(vecs) >= limit:
+            break
+    return np.asarray(vecs, dtype=np.float32).reshape(-1, len(vecs[0]) if vecs else FULL_DIM)
+
+
+def build_reducer(client, spec: str, source: str, fit_from: str = None):
+    method, dim = parse_spec(spec)
+    if method is None:
+        return None
+    if not 0 < dim < FULL_DIM:
+        raise SystemExit(f"reduction dim must be between 1 and {FULL_DIM - 1}: {spec}")
+    if method == "truncate":
+        return VectorReducer.truncate(dim)
+    vectors = np.load(fit_from) if fit_from else collect_vectors(client, source, PCA_FIT_SAMPLE)
+    if vectors.shape[1] != FULL_DIM:
+        raise SystemExit(
+            f"PCA には {FULL_DIM} 次元のベクトルが必要です（既存の {source} は {vectors.shape[1]} 次元）。"
+            "--fit-from で元の次元のベクトル（.npy）を指定してください"
+        )
+    reducer = VectorReducer.fit_pca(vectors, dim)
+    print(f"📉 PCA {FULL_DIM} -> {dim} を {len(vectors)} 件で学習（寄与率 {reducer.explained:.3f}）")
+    return reducer
+
+
+def create_collection(client, name: str, args, reducer):
+    # ※ Phase1 と違い：
+    #   - vectorizer は外部（bge-m3）で生成するため none
+    #   - Generative も使わないので未設定
+    #   - updatedAt は DATE 型にしておくと後で範囲検索が楽
+    client.collections.create(
+        name=name,
+        properties=[
+            Property(name="pageId",     data_type=DataType.TEXT),
+            Property(name="title",      data_type=DataType.TEXT, tokenization=TEXT_TOKENIZATION),
+            Property(name="url",        data_type=DataType.TEXT),
+            Property(name="updatedAt",  data_type=DataType.DATE),
+            Property(name="content",    data_type=DataType.TEXT, tokenization=TEXT_TOKENIZATION),
+            Property(name="chunkIndex", data_type=DataType.INT),
+            # チャンクが属する見出しの階層（例: "概要 > 手順"）。chunker.py が付与
+            Property(name="headingPath", data_type=DataType.TEXT, tokenization=TEXT_TOKENIZATION),
+        ],
+        vectorizer_config=Configure.Vectorizer.none(),
+        vector_index_config=vector_index_config(args),
+    )
+
+    # 次元削減の設定は ingest / 検索（embeddings.py）が読む
+    path = reducer_path(name)
+    if reducer is not None:
+        reducer.save(path)
+    elif os.path.exists(path):
+        os.remove(path)
+
+    hnsw = ", ".join(
+        f"{k}={v}" for k, v in (("ef", args.ef), ("efConstruction", args.ef_construction),
+                                ("maxConnections", args.max_connections)) if v is not None
+    )
+    print(
+        f"✅ {name} コレクションを作成しました（tokenization={TEXT_TOKENIZATION.value}, "
+        f"vectors={reducer.spec if reducer else f'full:{FULL_DIM}'}, quantizer={args.quantizer}, "
+        f"distance={args.distance}{', ' + hnsw if hnsw else ''}）"
+    )
+
+
+def next_version_name(client, base: str) -> str:
+    """base_v2, base_v3 ... のうち未使用の次の名前（base 自体を v1 とみなす）。"""
+    pattern = re.compile(rf"^{re.escape(base)}_v(\d+)$", re.IGNORECASE)
+    used = [int(m.group(1)) for n in client.collections.list_all() if (m := pattern.match(n))]
+    return f"{base}_v{max(used + [1]) + 1}"
+
+
+def count(client, name: str) -> int:
+    return client.collections.get(name).aggregate.over_all(total_count=True).total_count or 0
+
+
+def copy_objects(client, source: str, target: str, transform=None) -> int:
+    """source の全オブジェクトを同じ UUID・同じベクトル（transform があれば変換後）で target にコピーする。"""
+    t0 = time.perf_counter()
+    n = 0
+    with client.batch.fixed_size(batch_size=COPY_BATCH_SIZE) as batch:
+        for o in client.collections.get(source).iterator(include_vector=True):
+            vec = o.vector.get("default") if isinstance(o.vector, dict) else o.vector
+            if transform is not None and vec is not None:
+                vec = transform([vec])[0]
+            batch.add_object(collection=target, properties=o.properties, uuid=o.uuid, vector=vec)
+            n += 1
+            if n % 10000 == 0:
+                print(f"  ... {n} objects ({n / (time.perf_counter() - t0):.0f}/s)")
+    failed = client.batch.failed_objects
+    if failed:
+        raise SystemExit(f"コピーに失敗したオブジェクトがあります: {len(failed)} 件（例: {failed[0].message}）")
+    print(f"📦 {source} -> {target}: {n} objects in {time.perf_counter() - t0:.1f}s")
+    return n
+
+
+def migrate_reducer(client, args, source: str):
+    """
+    移行先の次元削減と、コピー時にベクトルへかける変換を決める。
+    --reduce（VECTOR_REDUCTION）の指定が無ければ移行元の設定を引き継ぐ。
+    既存のベクトルから作れない組み合わせ（削減済み -> 別の次元など）は再 ingest が必要なのでエラーにする。
+    """
+    src = load_reducer(source)
+    spec = args.reduce or os.getenv("VECTOR_REDUCTION") or (src.spec if src is not None else "none")
+    method, _ = parse_spec(spec)
+    if src is not None and spec == src.spec:
+        return src, None  # 同じ設定（PCA は学習済みの射影をそのまま引き継ぐ）
+    if src is None and method is None:
+        return None, None
+    if src is None:
+        reducer = build_reducer(client, spec, source, args.fit_from)
+        return reducer, reducer.apply
+    raise SystemExit(
+        f"{source} は {src.spec} で保存されているため {spec} には移行できません。"
+        f"同じ設定のまま移行するなら --reduce {src.spec} を指定（または --reduce を外す）してください。"
+        "別の次元にするには通常モードで作り直して ingest --full で再登録してください"
+    )
+
+
+def show_status(client):
+    aliases = load_aliases()
+    print(f"alias {CLASS_NAME} -> {resolve_alias(CLASS_NAME)}  {aliases.get(CLASS_NAME, {})}")
+    for name in sorted(client.collections.list_all()):
+        if name.lower() != CLASS_NAME.lower() and not name.lower().startswith(f"{CLASS_NAME.lower()}_v"):
+            continue
+        cfg = client.collections.get(name).config.get().vector_index_config
+        reducer = load_reducer(name)
+        print(
+            f"- {name}: objects={count(client, name)}  vectors={reducer.spec if reducer else f'full:{FULL_DIM}'}  "
+            f"ef={cfg.ef} efConstruction={cfg.ef_construction} maxConnections={cfg.max_connections} "
+            f"distance={cfg.distance_metric.value} quantizer={type(cfg.quantizer).__name__ if cfg.quantizer else 'none'}"
+        )
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Create the Weaviate collection for Confluence chunks")
+    ap.add_argument("--reduce", help="none / truncate:<dim> / pca:<dim>（VECTOR_REDUCTION。--migrate で未指定なら移行元と同じ）")
+    ap.add_argument("--quantizer", choices=["none", "pq", "bq"], default=VECTOR_QUANTIZER,
+                    help="Weaviate の HNSW 圧縮（VECTOR_QUANTIZER）")
+    ap.add_argument("--fit-from", help="PCA の学習に使う .npy（N x 1024）。未指定なら既存コレクションのベクトル")
+    ap.add_argument("--ef", type=int, default=_int_or_none(HNSW_EF), help="HNSW の検索時候補数（HNSW_EF, -1 = 動的）")
+    ap.add_argument("--ef-construction", type=int, default=_int_or_none(HNSW_EF_CONSTRUCTION),
+                    help="HNSW の構築時候補数（HNSW_EF_CONSTRUCTION）")
+    ap.add_argument("--max-connections", type=int, default=_int_or_none(HNSW_MAX_CONNECTIONS),
+                    help="HNSW の最大接続数（HNSW_MAX_CONNECTIONS）")
+    ap.add_argument("--distance", choices=["cosine", "dot", "l2-squared"], default=VECTOR_DISTANCE,
+                    help="距離関数（VECTOR_DISTANCE）")
+    mode = ap.add_mutually_exclusive_group()
+    mode.add_argument("--migrate", action="store_true",
+                      help="新しいバージョンのコレクションを作って既存ベクトルごとコピーし、エイリアスを切り替える")
+    mode.add_argument("--switch", metavar="COLLECTION", help="エイリアスを指定のコレクションに切り替える（ロールバック用）")
+    mode.add_argument("--drop", metavar="COLLECTION", help="使っていない旧バージョンのコレクションを削除する")
+    mode.add_argument("--status", action="store_true", help="エイリアスと各バージョンの設定・件数を表示")
+    ap.add_argument("--no-switch", action="store_true", help="--migrate でコピーだけ行い、エイリアスは切り替えない")
+    args = ap.parse_args()
+
+    # --- Weaviate 接続（ローカル。API Key/ヘッダー不要） ---
+    client = weaviate.connect_to_local(host=HOST, port=PORT, grpc_port=GRPC_PORT)
+    print("✅ Connected to Weaviate")
+    try:
+        current = resolve_alias(CLASS_NAME)
+        existing = client.collections.list_all()
+
+        if args.status:
+            show_status(client)
+
+        elif args.switch:
+            if args.switch not in existing:
+                raise SystemExit(f"{args.switch} は存在しません")
+            previous = set_alias(CLASS_NAME, args.switch)
+            print(f"🔀 {CLASS_NAME}: {previous} -> {args.switch}")
+
+        elif args.drop:
+            if args.drop == current:
+                raise SystemExit(f"{args.drop} は {CLASS_NAME} の現在の向き先なので削除できません")
+            client.collections.delete(args.drop)
+            if os.path.exists(reducer_path(args.drop)):
+                os.remove(reducer_path(args.drop))
+            print(f"🧹 {args.drop} を削除しました")
+
+        elif args.migrate:
+            # Blue/Green: 新コレクションに既存ベクトルごとコピー → 件数を確認 → エイリアスを切り替え
+            if current not in existing:
+                raise SystemExit(f"移行元の {current} がありません。通常モードで作成してください")
+            target = next_version_name(client, CLASS_NAME)
+            reducer, transform = migrate_reducer(client, args, current)
+            create_collection(client, target, args, reducer)
+            copied = copy_objects(client, current, target, transform)
+            n_src, n_dst = count(client, current), count(client, target)
+            if n_dst != n_src:
+                raise SystemExit(
+                    f"件数が一致しません（{current}={n_src}, {target}={n_dst}, copied={copied}）。"
+                    f"移行中に ingest が動いていないか確認し、--drop {target} してからやり直してください"
+                )
+            if args.no_switch:
+                print(f"ℹ️  {target} を作成しました。切り替えは --switch {target}")
+            else:
+                previous = set_alias(CLASS_NAME, target)
+                print(f"🔀 {CLASS_NAME}: {previous} -> {target}（戻すときは --switch {previous}）")
+
+        else:
+            # 通常モード: 現在の向き先を削除して作り直す（ベクトルは空になる）
+            # PCA は削除前の既存ベクトルで学習する
+            reducer = build_reducer(client, args.reduce or VECTOR_REDUCTION, current, args.fit_from)
+
+            # 既存クラスがあれば削除（必要に応じてコメントアウト）
+            if current in existing:
+                client.collections.delete(current)
+                print(f"🧹 既存の {current} コレクションを削除しました")
+
+            create_collection(client, current, args, reducer)
+            print("ℹ️  コレクションは空です。ingest を --full で実行して再登録してください")
+    finally:
+        client.close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,117 @@
+# phase2/scripts/devtools/bench_embed_backend.py
+"""
+埋め込みバックエンド（EMBED_BACKEND）の比較: PyTorch fp32 / ONNX Runtime fp32 / ONNX Runtime int8。
+
+  python scripts/devtools/bench_embed_backend.py
+  python scripts/devtools/bench_embed_backend.py --backends torch,onnx-int8 --threads 4,8 --corpus passages.txt
+
+バックエンド × スレッド数ごとに次を表示する。
+  load      モデル読み込み秒数（int8 の初回は量子化の時間を含む）
+  passages  passage の一括 encode のスループット（texts/s）
+  query     1件ずつの query encode の p50 / p95
+  parity    torch のベクトルとの cos 類似度（平均 / 最小）と、質問ごとの上位 passage の一致率
+"""
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from devtools.bench_refine_flow import DEFAULT_QUESTIONS, percentile  # noqa: E402
+from embed_backend import BACKENDS, load_embedder  # noqa: E402
+
+SAMPLE_PASSAGES = [
+    "SQL の実行方法: 踏み台サーバーに ssh し、psql で読み取り専用ユーザーとして接続してから実行します。",
+    "更新系の SQL は必ずレビューを受け、トランザクション内で実行してから COMMIT してください。",
+    "夜間バッチが失敗した場合は、ジョブ管理画面でエラーログを確認し、原因を取り除いてから再実行ボタンを押します。",
+    "バッチの再実行は冪等になるよう設計されていますが、途中まで書き込まれたデータは事前に削除してください。",
+    "リリース手順: main ブランチにマージ後、タグを打つと CI が本番環境へデプロイします。",
+    "リリース前日までに変更内容をリリースノートにまとめ、承認者の確認を得てください。",
+    "本番環境のアプリケーションログはログ基盤（Kibana）で確認できます。保存期間は 30 日です。",
+    "本番サーバーへの直接ログインは禁止されています。調査はログ基盤とメトリクスで行ってください。",
+    "権限申請はワークフローシステムから行います。上長の承認後、情報システム部が付与します。",
+    "DB のバックアップは毎日 2:00 にフルバックアップを取得し、14 日間保存します。",
+    "障害発生時は、まず #incident チャンネルで第一報を出し、当番のオンコール担当に電話で連絡します。",
+    "障害の影響範囲が顧客に及ぶ場合は、カスタマーサポートへの連絡も同時に行ってください。",
+    "cron の設定は /etc/cron.d 配下に置き、実行ユーザーとログ出力先を必ず明記します。",
+    "crontab -e で個人の crontab を編集するのは検証環境だけにしてください。",
+    "開発環境の構築手順: リポジトリを clone し、docker compose up で依存サービスを起動します。",
+    "パスワードは 90 日ごとに変更が必要です。過去 5 回分と同じものは使えません。",
+]
+
+
+def load_corpus(path):
+    if not path:
+        return SAMPLE_PASSAGES
+    with open(path, encoding="utf-8") as f:
+        return [line.strip() for line in f if line.strip()]
+
+
+def encode(model, texts, batch):
+    return np.asarray(model.encode(texts, batch_size=batch, normalize_embeddings=True), dtype=np.float32)
+
+
+def run(backend, threads, passages, questions, batch, repeat):
+    t0 = time.perf_counter()
+    model = load_embedder(os.getenv("MODEL_PATH") or os.getenv("EMBED_MODEL_NAME", "BAAI/bge-m3"),
+                          backend=backend, device="cpu", threads=threads)
+    load = time.perf_counter() - t0
+    encode(model, ["warmup"], batch)
+
+    t0 = time.perf_counter()
+    for _ in range(repeat):
+        p_vecs = encode(model, [f"passage: {p}" for p in passages], batch)
+    tput = len(passages) * repeat / (time.perf_counter() - t0)
+
+    lat, q_vecs = [], []
+    for _ in range(repeat):
+        q_vecs = []
+        for q in questions:
+            t0 = time.perf_counter()
+            q_vecs.append(encode(model, [f"query: {q}"], batch)[0])
+            lat.append(time.perf_counter() - t0)
+    return {"load": load, "tput": tput, "lat": lat, "p": p_vecs, "q": np.stack(q_vecs)}
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Compare bge-m3 embedding backends (latency, throughput, parity)")
+    ap.add_argument("--backends", default=",".join(BACKENDS), help="カンマ区切り（torch / onnx / onnx-int8）")
+    ap.add_argument("--threads", default="0", help="カンマ区切りのスレッド数（0 = ライブラリ既定）")
+    ap.add_argument("--corpus", help="1行1 passage のテキストファイル（未指定なら内蔵サンプル）")
+    ap.add_argument("--batch", type=int, default=32, help="passage encode のバッチサイズ")
+    ap.add_argument("--repeat", type=int, default=3)
+    args = ap.parse_args()
+
+    backends = [b.strip() for b in args.backends.split(",") if b.strip()]
+    threads = [int(t) for t in args.threads.split(",")]
+    passages = load_corpus(args.corpus)
+    questions = DEFAULT_QUESTIONS
+
+    results = {}
+    for backend in backends:
+        for th in threads:
+            results[(backend, th)] = run(backend, th, passages, questions, args.batch, args.repeat)
+
+    # parity の基準は torch（一覧に無ければ既定スレッド数で1回計算する）
+    ref = next((r for (b, _), r in results.items() if b == "torch"), None)
+    if ref is None:
+        ref = run("torch", 0, passages, questions, args.batch, 1)
+    ref_top = np.argmax(ref["q"] @ ref["p"].T, axis=1)
+
+    print(f"\npassages={len(passages)}  questions={len(questions)}  batch={args.batch}  repeat={args.repeat}")
+    print(f"{'backend':<10} {'threads':>7} {'load':>7} {'passages/s':>11} {'q p50':>8} {'q p95':>8} "
+          f"{'cos mean':>9} {'cos min':>8} {'top1':>6}")
+    for (backend, th), r in results.items():
+        cos = np.concatenate([np.sum(r["p"] * ref["p"], axis=1), np.sum(r["q"] * ref["q"], axis=1)])
+        top1 = float(np.mean(np.argmax(r["q"] @ r["p"].T, axis=1) == ref_top))
+        print(
+            f"{backend:<10} {th or 'auto':>7} {r['load']:6.1f}s {r['tput']:11.1f} "
+            f"{percentile(r['lat'], 50) * 1000:6.1f}ms {percentile(r['lat'], 95) * 1000:6.1f}ms "
+            f"{cos.mean():9.5f} {cos.min():8.5f} {top1:6.2f}"
+        )
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,96 @@
+# phase2/scripts/devtools/bench_embed_service.py
+"""
+クエリ埋め込みのレイテンシ比較: cold（毎回プロセス起動 + モデル読み込み）と warm（常駐の embed_server.py）。
+
+  python scripts/embed_server.py &                      # 別ターミナルで常駐させておく
+  python scripts/devtools/bench_embed_service.py --url http://127.0.0.1:8089
+  python scripts/devtools/bench_embed_service.py --cold-runs 0 --requests 200 --concurrency 8
+
+cold はサブプロセスで search_weaviate.py 相当の処理（import → モデル読み込み → 1件 encode）を行い、
+段階ごとの秒数を表示する。warm は逐次と並列（マイクロバッチが効く）で p50 / p95 を表示する。
+"""
+import os
+import sys
+import json
+import time
+import argparse
+import subprocess
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from devtools.bench_refine_flow import DEFAULT_QUESTIONS, percentile  # noqa: E402
+from embed_client import EmbedClient, EMBED_SERVER_URL  # noqa: E402
+
+
+def cold_once():
+    """サブプロセス側: import・モデル読み込み・1件 encode の秒数を JSON で出力。"""
+    t0 = time.perf_counter()
+    from sentence_transformers import SentenceTransformer
+
+    t1 = time.perf_counter()
+    model = SentenceTransformer(os.getenv("MODEL_PATH") or os.getenv("EMBED_MODEL_NAME", "BAAI/bge-m3"))
+    t2 = time.perf_counter()
+    model.encode([f"query: {DEFAULT_QUESTIONS[0]}"], normalize_embeddings=True)
+    t3 = time.perf_counter()
+    print(json.dumps({"import": t1 - t0, "load": t2 - t1, "encode": t3 - t2}))
+
+
+def run_cold(runs):
+    rows = []
+    for _ in range(runs):
+        t0 = time.perf_counter()
+        out = subprocess.run(
+            [sys.executable, __file__, "--cold-once"], capture_output=True, text=True, check=True
+        ).stdout.strip().splitlines()[-1]
+        row = json.loads(out)
+        row["total"] = time.perf_counter() - t0
+        rows.append(row)
+    for key in ("import", "load", "encode", "total"):
+        vals = [r[key] for r in rows]
+        print(f"cold  {key:<7} p50={percentile(vals, 50) * 1000:8.1f}ms  max={max(vals) * 1000:8.1f}ms")
+
+
+def run_warm(url, n, concurrency):
+    client = EmbedClient(url)
+    before = client.health()
+    questions = [f"query: {DEFAULT_QUESTIONS[i % len(DEFAULT_QUESTIONS)]} #{i}" for i in range(n)]
+
+    def one(q):
+        t0 = time.perf_counter()
+        client.encode([q])
+        return time.perf_counter() - t0
+
+    for c in sorted({1, concurrency}):
+        t0 = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=c) as ex:
+            lat = list(ex.map(one, questions))
+        wall = time.perf_counter() - t0
+        print(
+            f"warm  c={c:<3} n={n:<4} p50={percentile(lat, 50) * 1000:8.1f}ms  "
+            f"p95={percentile(lat, 95) * 1000:8.1f}ms  {n / wall:7.1f} req/s"
+        )
+
+    after = client.health()
+    hist = {k: after["batch_size_hist"][k] - before["batch_size_hist"].get(k, 0) for k in after["batch_size_hist"]}
+    batches = after["batches"] - before["batches"]
+    print(f"server batches={batches}  avg_batch={(after['texts'] - before['texts']) / max(batches, 1):.2f}  hist={hist}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Cold vs warm query embedding latency")
+    ap.add_argument("--url", default=EMBED_SERVER_URL or "http://127.0.0.1:8089")
+    ap.add_argument("--cold-runs", type=int, default=3, help="cold 計測の回数（0 でスキップ）")
+    ap.add_argument("--requests", type=int, default=100, help="warm 計測のリクエスト数")
+    ap.add_argument("--concurrency", type=int, default=8, help="warm 並列計測の同時数")
+    ap.add_argument("--cold-once", action="store_true", help=argparse.SUPPRESS)
+    args = ap.parse_args()
+
+    if args.cold_once:
+        return cold_once()
+    if args.cold_runs:
+        run_cold(args.cold_runs)
+    run_warm(args.url, args.requests, args.concurrency)
+
+
+if __name__ == "__main__":
+    main()
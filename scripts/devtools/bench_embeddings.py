@@ -0,0 +1,116 @@
+# phase2/scripts/devtools/bench_embeddings.py
+"""
+埋め込み（embeddings.py）のオフライン回帰チェック: 検索品質（recall@k / MRR）とレイテンシ。
+Weaviate も API サーバーも使わず、小さな正解付きコーパスをメモリ上で総当たり検索する。
+
+  python scripts/devtools/bench_embeddings.py
+  python scripts/devtools/bench_embeddings.py --corpus passages.txt --eval eval.jsonl --min-mrr 0.8
+
+  --corpus  1行1 passage のテキストファイル
+  --eval    1行1件の JSONL: {"question": "...", "relevant": [passage の行番号（0 始まり）, ...]}
+
+prefix の規約ごと（query/passage = 現行、none/passage = 旧 API サーバー、none/none）に品質を並べて表示し、
+現行規約の MRR / recall@1 が --min-mrr / --min-recall を下回ったら終了コード 1 にする。
+"""
+import os
+import sys
+import json
+import time
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from devtools.bench_embed_backend import SAMPLE_PASSAGES  # noqa: E402
+from devtools.bench_refine_flow import DEFAULT_QUESTIONS, percentile  # noqa: E402
+from embeddings import Embedder, QUERY_PREFIX, PASSAGE_PREFIX  # noqa: E402
+
+# DEFAULT_QUESTIONS[i] に対する SAMPLE_PASSAGES の正解
+SAMPLE_RELEVANT = [[0, 1], [2, 3], [4, 5], [6, 7], [8], [9], [10, 11], [12, 13]]
+
+POLICIES = {
+    "query/passage": (QUERY_PREFIX, PASSAGE_PREFIX),
+    "none/passage": ("", PASSAGE_PREFIX),
+    "none/none": ("", ""),
+}
+
+
+def load_eval(corpus_path, eval_path):
+    if not corpus_path:
+        return SAMPLE_PASSAGES, list(zip(DEFAULT_QUESTIONS, SAMPLE_RELEVANT))
+    with open(corpus_path, encoding="utf-8") as f:
+        passages = [line.strip() for line in f if line.strip()]
+    with open(eval_path, encoding="utf-8") as f:
+        items = [json.loads(line) for line in f if line.strip()]
+    return passages, [(it["question"], it["relevant"]) for it in items]
+
+
+def quality(q_vecs, p_vecs, relevant, ks=(1, 3, 5)):
+    order = np.argsort(-(q_vecs @ p_vecs.T), axis=1)
+    recall = {k: 0.0 for k in ks}
+    mrr = 0.0
+    for row, rel in zip(order, relevant):
+        rel = set(rel)
+        for k in ks:
+            recall[k] += len(rel & set(row[:k].tolist())) / len(rel)
+        rank = next(i for i, p in enumerate(row.tolist(), 1) if p in rel)
+        mrr += 1 / rank
+    n = len(relevant)
+    return {f"recall@{k}": recall[k] / n for k in ks}, mrr / n
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Offline retrieval-quality and latency check for embeddings.py")
+    ap.add_argument("--corpus", help="1行1 passage のテキストファイル（未指定なら内蔵サンプル）")
+    ap.add_argument("--eval", help="正解付きの質問（JSONL）。--corpus と一緒に指定")
+    ap.add_argument("--repeat", type=int, default=3, help="レイテンシ計測の繰り返し回数")
+    ap.add_argument("--min-mrr", type=float, default=0.0, help="現行規約の MRR がこれ未満なら失敗")
+    ap.add_argument("--min-recall", type=float, default=0.0, help="現行規約の recall@1 がこれ未満なら失敗")
+    args = ap.parse_args()
+    if bool(args.corpus) != bool(args.eval):
+        ap.error("--corpus と --eval は一緒に指定してください")
+
+    passages, items = load_eval(args.corpus, args.eval)
+    questions = [q for q, _ in items]
+    relevant = [rel for _, rel in items]
+    embedder = Embedder(use_cache=False)  # キャッシュに当たると計測にならない
+
+    # ---- 品質: prefix の規約ごと ----
+    print(f"passages={len(passages)}  questions={len(questions)}  model={embedder.model_id}")
+    print(f"{'policy':<14} {'recall@1':>9} {'recall@3':>9} {'recall@5':>9} {'MRR':>7}")
+    current = None
+    for name, (q_prefix, p_prefix) in POLICIES.items():
+        p_vecs = np.asarray(embedder.encode([f"{p_prefix}{p}" for p in passages]), dtype=np.float32)
+        q_vecs = np.asarray(embedder.encode([f"{q_prefix}{q}" for q in questions]), dtype=np.float32)
+        recall, mrr = quality(q_vecs, p_vecs, relevant)
+        if current is None:
+            current = (recall["recall@1"], mrr)
+        print(f"{name:<14} {recall['recall@1']:9.3f} {recall['recall@3']:9.3f} {recall['recall@5']:9.3f} {mrr:7.3f}")
+
+    # ---- レイテンシ: 現行の embed_query / embed_passages ----
+    embedder.embed_query("warmup")
+    lat = []
+    for _ in range(args.repeat):
+        for q in questions:
+            t0 = time.perf_counter()
+            embedder.embed_query(q)
+            lat.append(time.perf_counter() - t0)
+    t0 = time.perf_counter()
+    for _ in range(args.repeat):
+        embedder.embed_passages(passages)
+    tput = len(passages) * args.repeat / (time.perf_counter() - t0)
+    print(
+        f"\nembed_query   p50={percentile(lat, 50) * 1000:.1f}ms  p95={percentile(lat, 95) * 1000:.1f}ms  "
+        f"(source={embedder.source})"
+    )
+    print(f"embed_passages {tput:.1f} passages/s (batch={embedder.batch_size})")
+
+    recall1, mrr = current
+    if mrr < args.min_mrr or recall1 < args.min_recall:
+        print(f"[FAIL] query/passage MRR={mrr:.3f} recall@1={recall1:.3f} "
+              f"(min MRR={args.min_mrr}, min recall@1={args.min_recall})")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,86 @@
+# phase2/scripts/devtools/bench_refine_flow.py
+"""
+2回呼び出し（/refine_question -> /query）と1回呼び出し（/ask）のレイテンシ比較。
+起動中の API サーバーに対して固定の質問セットを順番に投げ、p50 / p95 を表示する。
+
+  python scripts/devtools/bench_refine_flow.py
+  python scripts/devtools/bench_refine_flow.py --questions questions.txt --repeat 3 --refine auto
+"""
+import time
+import argparse
+import requests
+
+DEFAULT_QUESTIONS = [
+    "SQL の実行方法",
+    "バッチが失敗したときの再実行手順を教えてください",
+    "リリース手順",
+    "本番環境のログはどこで確認できますか？",
+    "権限申請",
+    "DB のバックアップ取得手順と保存期間を教えてください",
+    "障害発生時の連絡フローはどうなっていますか？",
+    "cron",
+]
+
+
+def percentile(values, p):
+    if not values:
+        return float("nan")
+    s = sorted(values)
+    k = (len(s) - 1) * p / 100
+    lo, hi = int(k), min(int(k) + 1, len(s) - 1)
+    return s[lo] + (s[hi] - s[lo]) * (k - lo)
+
+
+def two_call(base, q, prompt_type):
+    r = requests.post(f"{base}/refine_question", json={"raw_question": q}, timeout=600)
+    r.raise_for_status()
+    refined = r.json()["refined_question"]
+    r = requests.post(f"{base}/query", json={"question": refined, "prompt_type": prompt_type}, timeout=600)
+    r.raise_for_status()
+    return True
+
+
+def one_call(base, q, prompt_type, refine):
+    payload = {"raw_question": q, "prompt_type": prompt_type}
+    if refine:
+        payload["refine"] = refine
+    r = requests.post(f"{base}/ask", json=payload, timeout=600)
+    r.raise_for_status()
+    return r.json().get("refined", True)
+
+
+def run(label, fn, questions, repeat):
+    lat, refined = [], 0
+    for _ in range(repeat):
+        for q in questions:
+            t0 = time.perf_counter()
+            refined += bool(fn(q))
+            lat.append(time.perf_counter() - t0)
+    print(
+        f"{label:<10} n={len(lat):>3}  p50={percentile(lat, 50):6.2f}s  p95={percentile(lat, 95):6.2f}s  "
+        f"mean={sum(lat) / len(lat):6.2f}s  refined={refined}/{len(lat)}"
+    )
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Latency of two-call vs one-call (/ask) flows")
+    ap.add_argument("--base-url", default="http://localhost:8000")
+    ap.add_argument("--questions", help="1行1質問のテキストファイル（未指定なら組み込みの質問セット）")
+    ap.add_argument("--repeat", type=int, default=1)
+    ap.add_argument("--prompt-type", default="簡易回答ver")
+    ap.add_argument("--refine", choices=["auto", "always", "never"], default=None, help="/ask の refine（未指定ならサーバー既定）")
+    args = ap.parse_args()
+
+    if args.questions:
+        with open(args.questions, encoding="utf-8") as f:
+            questions = [line.strip() for line in f if line.strip()]
+    else:
+        questions = DEFAULT_QUESTIONS
+
+    print(f"[INFO] {len(questions)} questions x {args.repeat}  base={args.base_url}")
+    run("two-call", lambda q: two_call(args.base_url, q, args.prompt_type), questions, args.repeat)
+    run("one-call", lambda q: one_call(args.base_url, q, args.prompt_type, args.refine), questions, args.repeat)
+
+
+if __name__ == "__main__":
+    main()
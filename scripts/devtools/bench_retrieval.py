@@ -0,0 +1,379 @@
+# phase2/scripts/devtools/bench_retrieval.py
+"""
+検索スタックのオフラインベンチマーク: 記録済みの質問セットを再生し、段ごとのレイテンシと検索品質を出す。
+API サーバーは使わず、API サーバーと同じ部品（embeddings / retrieval / reranker / prompts）を直接呼ぶ。
+
+  python scripts/devtools/bench_retrieval.py                                  # 内蔵サンプル（スタンドイン + 偽 LLM）
+  python scripts/devtools/bench_retrieval.py --store weaviate --queries data/bench_queries.jsonl
+  python scripts/devtools/bench_retrieval.py --export-store data/store.jsonl  # Weaviate の中身を書き出す（要 Weaviate）
+  python scripts/devtools/bench_retrieval.py --store-file data/store.jsonl --queries data/bench_queries.jsonl \
+      --save before.json                                                      # 変更前を保存
+  python scripts/devtools/bench_retrieval.py ... --baseline before.json       # 変更後と比較
+  python scripts/devtools/bench_retrieval.py --history logs/confluence_qa_history.sqlite \
+      --write-queries data/bench_queries.jsonl                                # UI の履歴から質問セットを作る
+
+質問セット（--queries）は 1行1件の JSONL:
+  {"question": "...", "relevant_pages": ["98439", ...]}   relevant_pages が無い質問はレイテンシだけ集計する
+
+検索先:
+  --store weaviate   ローカルの Weaviate（WEAVIATE_CLASS のエイリアスの向き先）
+  --store standin    インプロセスのスタンドイン（devtools/vector_store_standin.py）。データは
+                     --store-file（--export-store の JSONL）/ --corpus（1行1チャンクの JSONL。起動時に埋め込む）/
+                     どちらも無ければ bench_embeddings.py と同じ内蔵サンプル
+LLM:
+  --llm fake（既定）は devtools/fake_llm.py の決定的な偽 LLM、--llm ollama は実際の Ollama、--llm none は呼ばない
+
+段（stage）ごとに p50 / p95 / p99 / mean を表示する:
+  embed / search（dense / bm25 / fuse の内訳つき）/ rerank / prompt / llm / total
+"""
+import os
+import sys
+import json
+import time
+import hashlib
+import sqlite3
+import argparse
+from types import SimpleNamespace
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+import retrieval  # noqa: E402
+from devtools.bench_embed_backend import SAMPLE_PASSAGES  # noqa: E402
+from devtools.bench_embeddings import SAMPLE_RELEVANT  # noqa: E402
+from devtools.bench_refine_flow import DEFAULT_QUESTIONS, percentile  # noqa: E402
+from devtools.fake_llm import FakeLLM  # noqa: E402
+from devtools.vector_store_standin import StandinCollection, trigrams  # noqa: E402
+from context_builder import build_context, count_tokens  # noqa: E402
+from prompts import build_answer_prompt  # noqa: E402
+
+STAGES = ["embed", "search", "dense", "bm25", "fuse", "hybrid", "rerank", "prompt", "llm", "total"]
+PROMPT_TOP_K = 3  # API サーバーと同じくプロンプトには上位3件を使う
+
+
+# ---- 質問セット ----
+def load_queries(args):
+    if args.queries:
+        with open(args.queries, encoding="utf-8") as f:
+            items = [json.loads(line) for line in f if line.strip()]
+        return [(it["question"], it.get("relevant_pages")) for it in items]
+    if args.history:
+        if args.history.endswith(".sqlite"):
+            conn = sqlite3.connect(args.history)
+            history = [{"question": r[0]} for r in conn.execute("SELECT question FROM history ORDER BY id")]
+            conn.close()
+        else:
+            with open(args.history, encoding="utf-8") as f:
+                history = json.load(f)
+        seen, out = set(), []
+        for h in history:
+            q = (h.get("question") or "").strip()
+            if q and q not in seen:
+                seen.add(q)
+                out.append((q, None))
+        return out
+    if args.store == "standin" and not (args.store_file or args.corpus):
+        return [(q, [f"sample-{i}" for i in rel]) for q, rel in zip(DEFAULT_QUESTIONS, SAMPLE_RELEVANT)]
+    return [(q, None) for q in DEFAULT_QUESTIONS]
+
+
+def write_queries(path, queries):
+    os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+    with open(path, "w", encoding="utf-8") as f:
+        for q, rel in queries:
+            f.write(json.dumps({"question": q, "relevant_pages": rel or []}, ensure_ascii=False) + "\n")
+    print(f"saved {len(queries)} questions -> {path}（relevant_pages に正解の pageId を記入してください）")
+
+
+# ---- 埋め込み ----
+class HashEmbedder:
+    """
+    モデルを使わない決定的な埋め込み（trigram を次元にハッシュした bag-of-words）。
+    モデルが手元に無くても検索・プロンプト・LLM の段を回せるようにするためのもので、品質の比較には使わない。
+    """
+
+    source = "hash"
+
+    def __init__(self, dim=1024):
+        self.dim = dim
+
+    def _embed(self, texts):
+        out = np.zeros((len(texts), self.dim), dtype=np.float32)
+        for i, t in enumerate(texts):
+            for tok in trigrams(t):
+                h = int.from_bytes(hashlib.md5(tok.encode("utf-8")).digest()[:4], "little")
+                out[i, h % self.dim] += 1.0
+        out /= np.maximum(np.linalg.norm(out, axis=1, keepdims=True), 1e-12)
+        return out.tolist()
+
+    def embed_query(self, text):
+        return self._embed([text])[0]
+
+    def embed_passages(self, texts):
+        return self._embed(list(texts))
+
+
+def make_embedder(args):
+    if args.embed == "hash":
+        return HashEmbedder()
+    from embeddings import Embedder
+
+    return Embedder(use_cache=args.embed_cache)
+
+
+# ---- 検索先 ----
+def sample_chunks():
+    return [
+        {"pageId": f"sample-{i}", "title": p.split(":")[0][:20], "chunkIndex": 0, "content": p}
+        for i, p in enumerate(SAMPLE_PASSAGES)
+    ]
+
+
+def make_store(args, embedder):
+    if args.store == "weaviate":
+        import weaviate
+        from collection_alias import resolve_alias
+        from create_confluence_chunk_class import HOST, PORT, GRPC_PORT, CLASS_NAME
+
+        client = weaviate.connect_to_local(host=HOST, port=PORT, grpc_port=GRPC_PORT)
+        return client.collections.get(resolve_alias(CLASS_NAME)), client
+    if args.store_file:
+        return StandinCollection.from_jsonl(args.store_file), None
+    if args.corpus:
+        with open(args.corpus, encoding="utf-8") as f:
+            chunks = [json.loads(line) for line in f if line.strip()]
+    else:
+        chunks = sample_chunks()
+    t0 = time.perf_counter()
+    vectors = embedder.embed_passages([c.get("content") or "" for c in chunks])
+    print(f"[INFO] embedded {len(chunks)} chunks for the stand-in in {time.perf_counter() - t0:.1f}s")
+    return StandinCollection.from_chunks(chunks, vectors), None
+
+
+def export_store(path):
+    import weaviate
+    from collection_alias import resolve_alias
+    from create_confluence_chunk_class import HOST, PORT, GRPC_PORT, CLASS_NAME
+
+    client = weaviate.connect_to_local(host=HOST, port=PORT, grpc_port=GRPC_PORT)
+    name = resolve_alias(CLASS_NAME)
+    n = 0
+    try:
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        with open(path, "w", encoding="utf-8") as f:
+            for o in client.collections.get(name).iterator(include_vector=True):
+                vec = o.vector.get("default") if isinstance(o.vector, dict) else o.vector
+                props = {k: (v.isoformat() if hasattr(v, "isoformat") else v) for k, v in o.properties.items()}
+                f.write(json.dumps({"uuid": str(o.uuid), "properties": props, "vector": vec}, ensure_ascii=False) + "\n")
+                n += 1
+    finally:
+        client.close()
+    print(f"saved {n} objects from {name} -> {path}")
+
+
+# ---- LLM ----
+def make_llm(args):
+    if args.llm == "none":
+        return None
+    if args.llm == "fake":
+        return FakeLLM(ttft_ms=args.fake_ttft_ms, per_token_ms=args.fake_token_ms, sleep=not args.no_sleep)
+    from langchain_community.chat_models import ChatOllama
+
+    chat = ChatOllama(model=args.llm_model, temperature=0.3)
+    return SimpleNamespace(invoke=lambda prompt: chat.invoke(prompt).content)
+
+
+# ---- 実行 ----
+def page_ranking(hits):
+    """ヒットの pageId を出現順に重複なく並べる（1ページに複数チャンクがあるため）。"""
+    seen, pages = set(), []
+    for h in hits:
+        pid = str(h["properties"].get("pageId"))
+        if pid not in seen:
+            seen.add(pid)
+            pages.append(pid)
+    return pages
+
+
+def run_one(question, embedder, coll, reranker, llm, args):
+    timings = {}
+    t_start = time.perf_counter()
+    vec = None
+    if args.mode != "bm25":
+        t0 = time.perf_counter()
+        vec = embedder.embed_query(question)
+        timings["embed"] = time.perf_counter() - t0
+
+    n = max(args.k, args.rerank_candidates) if reranker is not None else args.k
+    t0 = time.perf_counter()
+    hits = retrieval.search(coll, question, vec, n, mode=args.mode, fusion=args.fusion, timings=timings)
+    timings["search"] = time.perf_counter() - t0
+
+    if reranker is not None and len(hits) > 1:
+        t0 = time.perf_counter()
+        hits = reranker.rerank(question, hits, args.k)
+        timings["rerank"] = time.perf_counter() - t0
+    hits = hits[:args.k]
+
+    t0 = time.perf_counter()
+    docs = [
+        (SimpleNamespace(page_content=h["properties"].get("content") or "", metadata={**h["properties"], "uuid": h["uuid"]}),
+         h["score"])
+        for h in hits[:PROMPT_TOP_K]
+    ]
+    prompt = build_answer_prompt(question, args.prompt_mode, build_context(docs)["text"])
+    timings["prompt"] = time.perf_counter() - t0
+
+    if llm is not None:
+        t0 = time.perf_counter()
+        llm.invoke(prompt)
+        timings["llm"] = time.perf_counter() - t0
+    elapsed = time.perf_counter() - t_start
+    if args.llm == "fake" and args.no_sleep:
+        # 待たずに回したので、偽 LLM の所要時間に置き換える
+        elapsed += llm.duration(prompt) - timings["llm"]
+        timings["llm"] = llm.duration(prompt)
+    timings["total"] = elapsed
+    return timings, page_ranking(hits), count_tokens(prompt)
+
+
+def quality(rankings, ks):
+    """rankings は [(ページの順位リスト, 正解 pageId のリスト)]。"""
+    recall = {k: 0.0 for k in ks}
+    mrr = 0.0
+    for pages, rel in rankings:
+        rel = {str(p) for p in rel}
+        for k in ks:
+            recall[k] += len(rel & set(pages[:k])) / len(rel)
+        mrr += next((1 / i for i, p in enumerate(pages, 1) if p in rel), 0.0)
+    n = len(rankings)
+    return {**{f"recall@{k}": recall[k] / n for k in ks}, "mrr": mrr / n}
+
+
+def summarize(samples):
+    return {
+        stage: {
+            "n": len(vals),
+            "p50": percentile(vals, 50),
+            "p95": percentile(vals, 95),
+            "p99": percentile(vals, 99),
+            "mean": sum(vals) / len(vals),
+        }
+        for stage, vals in ((s, samples[s]) for s in STAGES if samples.get(s))
+    }
+
+
+def print_report(stats, qual, baseline=None):
+    base_stats = (baseline or {}).get("stages", {})
+    print(f"\n{'stage':<8} {'n':>5} {'p50':>10} {'p95':>10} {'p99':>10} {'mean':>10}" + (f"  {'Δp50':>7} {'Δp95':>7}" if baseline else ""))
+    for stage, s in stats.items():
+        line = (f"{stage:<8} {s['n']:5d} {s['p50'] * 1000:8.1f}ms {s['p95'] * 1000:8.1f}ms "
+                f"{s['p99'] * 1000:8.1f}ms {s['mean'] * 1000:8.1f}ms")
+        b = base_stats.get(stage)
+        if b:
+            line += f"  {(s['p50'] - b['p50']) * 1000:+7.1f} {(s['p95'] - b['p95']) * 1000:+7.1f}ms"
+        print(line)
+    if qual:
+        base_q = (baseline or {}).get("quality") or {}
+        print("\n" + "  ".join(
+            f"{k}={v:.3f}" + (f" ({v - base_q[k]:+.3f})" if k in base_q else "") for k, v in qual.items() if k != "labeled"
+        ) + f"  (labeled={qual['labeled']})")
+    else:
+        print("\n（relevant_pages 付きの質問が無いので recall@k / MRR は省略）")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Offline retrieval benchmark: per-stage latency and recall@k / MRR")
+    src = ap.add_argument_group("query set")
+    src.add_argument("--queries", help="質問セットの JSONL（question / relevant_pages）")
+    src.add_argument("--history", help="UI の履歴（logs/confluence_qa_history.sqlite、または旧形式の .json）の質問を使う（正解なし）")
+    src.add_argument("--write-queries", help="読み込んだ質問セットを JSONL に書き出して終了（正解のラベル付け用）")
+    st = ap.add_argument_group("store")
+    st.add_argument("--store", choices=["standin", "weaviate"], default="standin")
+    st.add_argument("--store-file", help="スタンドインに読み込む JSONL（--export-store の出力）")
+    st.add_argument("--corpus", help="スタンドインに読み込むチャンクの JSONL（pageId / title / content ...）。起動時に埋め込む")
+    st.add_argument("--export-store", help="Weaviate の中身をスタンドイン用の JSONL に書き出して終了")
+    rt = ap.add_argument_group("retrieval")
+    rt.add_argument("--mode", choices=["dense", "bm25", "hybrid"], default=retrieval.RETRIEVAL_MODE)
+    rt.add_argument("--fusion", choices=["rrf", "weaviate"], default=retrieval.HYBRID_FUSION)
+    rt.add_argument("--k", type=int, default=10, help="取得するチャンク数（recall@k の最大 k）")
+    rt.add_argument("--rerank", action="store_true", help="クロスエンコーダで再ランキングする（reranker.py）")
+    rt.add_argument("--rerank-candidates", type=int, default=None, help="再ランキングの候補数（既定: RERANK_CANDIDATES）")
+    rt.add_argument("--embed", choices=["model", "hash"], default="model",
+                    help="model = embeddings.py（bge-m3）/ hash = モデル不要の決定的な埋め込み（品質は測れない）")
+    rt.add_argument("--embed-cache", action="store_true", help="埋め込みキャッシュを使う（既定は無効にして毎回計算）")
+    lm = ap.add_argument_group("llm")
+    lm.add_argument("--llm", choices=["fake", "ollama", "none"], default="fake")
+    lm.add_argument("--llm-model", default="qwen2:7b-instruct")
+    lm.add_argument("--prompt-mode", choices=["detail", "simple"], default="simple")
+    lm.add_argument("--fake-ttft-ms", type=float, default=200)
+    lm.add_argument("--fake-token-ms", type=float, default=20)
+    lm.add_argument("--no-sleep", action="store_true", help="偽 LLM で実際には待たず、所要時間だけ加算する")
+    out = ap.add_argument_group("run")
+    out.add_argument("--repeat", type=int, default=1)
+    out.add_argument("--warmup", type=int, default=2, help="集計しない先頭の質問数（モデル読み込みなど）")
+    out.add_argument("--save", help="結果を JSON に保存（--baseline で比較用）")
+    out.add_argument("--baseline", help="以前に --save した JSON と比較する")
+    args = ap.parse_args()
+
+    if args.export_store:
+        export_store(args.export_store)
+        return
+
+    queries = load_queries(args)
+    if args.write_queries:
+        write_queries(args.write_queries, queries)
+        return
+    if not queries:
+        raise SystemExit("質問がありません")
+
+    embedder = make_embedder(args)
+    coll, client = make_store(args, embedder)
+    reranker = None
+    if args.rerank:
+        from reranker import Reranker, RERANK_CANDIDATES
+
+        reranker = Reranker()
+        args.rerank_candidates = args.rerank_candidates or RERANK_CANDIDATES
+    args.rerank_candidates = args.rerank_candidates or args.k
+    llm = make_llm(args)
+
+    size = len(coll) if isinstance(coll, StandinCollection) else "?"
+    print(f"[INFO] questions={len(queries)} x {args.repeat}  store={args.store}({size})  mode={args.mode}/"
+          f"{args.fusion}  k={args.k}  rerank={bool(reranker)}  embed={args.embed}  llm={args.llm}")
+    try:
+        for q, _ in queries[:args.warmup]:
+            run_one(q, embedder, coll, reranker, llm, args)
+
+        samples = {s: [] for s in STAGES}
+        rankings, prompt_tokens = [], []
+        for r in range(args.repeat):
+            for q, rel in queries:
+                timings, pages, n_tokens = run_one(q, embedder, coll, reranker, llm, args)
+                for stage, sec in timings.items():
+                    samples.setdefault(stage, []).append(sec)
+                prompt_tokens.append(n_tokens)
+                if r == 0 and rel:
+                    rankings.append((pages, rel))
+    finally:
+        if client is not None:
+            client.close()
+
+    stats = summarize(samples)
+    ks = sorted({k for k in (1, 3, 5, args.k) if k <= args.k})
+    qual = {**quality(rankings, ks), "labeled": len(rankings)} if rankings else None
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+    print_report(stats, qual, baseline)
+    print(f"prompt tokens≈ p50={percentile(prompt_tokens, 50):.0f}  max={max(prompt_tokens)}")
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "stages": stats, "quality": qual}, f, ensure_ascii=False, indent=2)
+        print(f"saved -> {args.save}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,140 @@
+# phase2/scripts/devtools/bench_upsert.py
+"""
+Weaviate 書き込みのスループット比較（chunks/sec）。
+
+  # ローカルのスタンドイン（Weaviate不要）で比較
+  python scripts/devtools/bench_upsert.py --pages 50 --chunks-per-page 10 --latency-ms 5
+
+  # docker-compose の実 Weaviate で RestWriter と BatchWriter を比較
+  python scripts/devtools/bench_upsert.py --real
+
+スタンドインは gRPC を話せないため、batch 側は同じ往復数になる REST の
+/v1/batch/objects + pageId フィルタ削除で代替して計測する。
+--real では ingest_confluence_bge.py の BatchWriter をそのまま使う。
+"""
+import os
+import sys
+import time
+import uuid
+import random
+import argparse
+import requests
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from devtools.weaviate_standin import WeaviateStandin  # noqa: E402
+
+DIM = 1024
+
+
+def make_pages(n_pages, chunks_per_page):
+    pages = []
+    for p in range(n_pages):
+        page_id = f"bench-{p}"
+        objs = []
+        for i in range(chunks_per_page):
+            vec = [random.random() for _ in range(DIM)]
+            props = {"pageId": page_id, "title": f"bench {p}", "content": "x" * 1200, "chunkIndex": i}
+            objs.append((str(uuid.uuid5(uuid.NAMESPACE_URL, f"{page_id}:{i}")), props, vec))
+        pages.append((page_id, objs))
+    return pages
+
+
+def run_rest(ingest, pages):
+    w = ingest.RestWriter()
+    t0 = time.perf_counter()
+    for page_id, objs in pages:
+        w.write_page(page_id, objs)
+    w.close()
+    return w.written, time.perf_counter() - t0
+
+
+def run_standin_batch(url, pages, class_name, batch_size, concurrency):
+    """BatchWriter と同じ往復パターン（batch 送信 + ページ単位のフィルタ削除）を REST で再現。"""
+    session = requests.Session()
+    flat = [
+        {"id": obj_id, "class": class_name, "properties": props, "vector": vec}
+        for _, objs in pages
+        for obj_id, props, vec in objs
+    ]
+
+    def send(chunk):
+        r = session.post(f"{url}/v1/batch/objects", json={"objects": chunk}, timeout=60)
+        r.raise_for_status()
+        return len(chunk)
+
+    t0 = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=concurrency) as ex:
+        written = sum(ex.map(send, [flat[i:i + batch_size] for i in range(0, len(flat), batch_size)]))
+    for page_id, objs in pages:
+        where = {
+            "operator": "And",
+            "operands": [
+                {"path": ["pageId"], "operator": "Equal", "valueText": page_id},
+                {"path": ["chunkIndex"], "operator": "GreaterThanEqual", "valueInt": len(objs)},
+            ],
+        }
+        session.delete(f"{url}/v1/batch/objects", json={"match": {"class": class_name, "where": where}}, timeout=60)
+    return written, time.perf_counter() - t0
+
+
+def run_real_batch(ingest, pages, batch_size, concurrency):
+    w = ingest.BatchWriter(batch_size=batch_size, concurrency=concurrency)
+    t0 = time.perf_counter()
+    for page_id, objs in pages:
+        w.write_page(page_id, objs)
+    w.close()
+    return w.written, time.perf_counter() - t0
+
+
+def report(label, written, elapsed, requests_made=None):
+    extra = f"  requests={requests_made}" if requests_made is not None else ""
+    print(f"{label:<8} chunks={written:>6}  elapsed={elapsed:7.2f}s  {written / elapsed:8.1f} chunks/sec{extra}")
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Weaviate upsert throughput benchmark")
+    ap.add_argument("--pages", type=int, default=50)
+    ap.add_argument("--chunks-per-page", type=int, default=10)
+    ap.add_argument("--batch-size", type=int, default=100)
+    ap.add_argument("--concurrency", type=int, default=2)
+    ap.add_argument("--latency-ms", type=float, default=5.0, help="スタンドインの1リクエストあたりの処理時間")
+    ap.add_argument("--real", action="store_true", help=".env の WEAVIATE_URL に対して実測する")
+    args = ap.parse_args()
+
+    standin = None
+    if not args.real:
+        standin = WeaviateStandin(latency=args.latency_ms / 1000).start()
+        os.environ["WEAVIATE_URL"] = standin.url
+    # ingest スクリプトは import 時に必須 env を読むのでダミーを入れておく
+    for k in ("CONF_BASE_URL", "CONF_EMAIL", "CONF_API_TOKEN", "WEAVIATE_URL"):
+        os.environ.setdefault(k, "http://localhost")
+    import ingest_confluence_bge as ingest
+
+    pages = make_pages(args.pages, args.chunks_per_page)
+    print(f"[INFO] {args.pages} pages x {args.chunks_per_page} chunks, batch_size={args.batch_size}, concurrency={args.concurrency}")
+
+    written, elapsed = run_rest(ingest, pages)
+    report("rest", written, elapsed, standin.requests if standin else None)
+
+    if standin:
+        before = standin.requests
+        written, elapsed = run_standin_batch(
+            standin.url, pages, ingest.target_class(), args.batch_size, args.concurrency
+        )
+        report("batch", written, elapsed, standin.requests - before)
+        standin.shutdown()
+    else:
+        written, elapsed = run_real_batch(ingest, pages, args.batch_size, args.concurrency)
+        report("batch", written, elapsed)
+        client = ingest.connect_weaviate()
+        try:
+            coll = client.collections.get(ingest.target_class())
+            for page_id, _ in pages:
+                ingest.delete_stale_chunks(coll, page_id, 0)
+        finally:
+            client.close()
+
+
+if __name__ == "__main__":
+    main()
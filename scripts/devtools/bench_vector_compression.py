@@ -0,0 +1,178 @@
+# phase2/scripts/devtools/bench_vector_compression.py
+"""
+ベクトル圧縮方式の比較（create_confluence_chunk_class.py の --reduce / --quantizer を選ぶため）。
+登録済みのベクトル（または .npy）をメモリ上で総当たり検索し、非圧縮の結果を正解として比べる。
+
+  python scripts/devtools/bench_vector_compression.py                      # Weaviate の既存コレクションから取得
+  python scripts/devtools/bench_vector_compression.py --npy vectors.npy --k 10
+  python scripts/devtools/bench_vector_compression.py --export vectors.npy # 取得したベクトルを保存（--fit-from 用）
+
+方式ごとに次を表示する。
+  bytes/vec   インメモリのベクトル1件あたりのバイト数
+  GB/1M       100 万チャンクあたりのメモリ（ベクトル + HNSW グラフの概算）
+  p50 / p95   1クエリの総当たり検索時間（HNSW の探索時間そのものではなく、距離計算コストの比較）
+  recall@k    非圧縮（1024 次元 float32）の上位 k 件との一致率
+
+PQ / BQ は Weaviate と同じく圧縮ベクトルで候補を多めに取り（--rescore 件）、元ベクトルで並べ直した結果も出す。
+クエリには登録済みベクトルの一部（--queries 件）を取り分けて使う。
+"""
+import os
+import sys
+import time
+import argparse
+
+import numpy as np
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from devtools.bench_refine_flow import percentile  # noqa: E402
+from vector_reduction import VectorReducer  # noqa: E402
+
+HNSW_LINK_BYTES = 8  # Weaviate の HNSW は接続を uint64 で持つ
+
+
+def load_vectors(args):
+    if args.npy:
+        return np.load(args.npy).astype(np.float32)
+    import weaviate
+    from collection_alias import resolve_alias
+    from create_confluence_chunk_class import HOST, PORT, GRPC_PORT, CLASS_NAME, collect_vectors
+
+    client = weaviate.connect_to_local(host=HOST, port=PORT, grpc_port=GRPC_PORT)
+    try:
+        return collect_vectors(client, args.collection or resolve_alias(CLASS_NAME), args.limit)
+    finally:
+        client.close()
+
+
+def unit(x):
+    return x / np.maximum(np.linalg.norm(x, axis=1, keepdims=True), 1e-12)
+
+
+def topk(scores, k):
+    idx = np.argpartition(-scores, k - 1)[:k]
+    return idx[np.argsort(-scores[idx])]
+
+
+# ---- PQ（segments 個の部分ベクトルをそれぞれ 256 個の重心で符号化） ----
+def _nearest(s, c):
+    # ||s - c||^2 の argmin（||s||^2 は順位に影響しないので省く）
+    return np.argmin((c * c).sum(axis=1) - 2 * s @ c.T, axis=1)
+
+
+def train_pq(x, segments, iters=10, seed=0):
+    rng = np.random.default_rng(seed)
+    books = []
+    for s in np.split(x, segments, axis=1):
+        c = s[rng.choice(len(s), 256, replace=len(s) < 256)].copy()
+        for _ in range(iters):
+            assign = _nearest(s, c)
+            counts = np.bincount(assign, minlength=256)
+            sums = np.zeros_like(c)
+            np.add.at(sums, assign, s)
+            filled = counts > 0
+            c[filled] = sums[filled] / counts[filled, None]
+        books.append(c)
+    return books
+
+
+def encode_pq(x, books):
+    sub = np.split(x, len(books), axis=1)
+    return np.stack([_nearest(s, c) for s, c in zip(sub, books)], axis=1).astype(np.uint8)
+
+
+def search_pq(q, codes, books, k):
+    # ADC: クエリの部分ベクトルと各重心の内積表を作り、符号で引いて足す
+    table = np.stack([c @ qs for c, qs in zip(books, np.split(q, len(books)))])  # (segments, 256)
+    scores = table[np.arange(len(books)), codes].sum(axis=1)
+    return topk(scores, k)
+
+
+# ---- BQ（符号ビット。ハミング距離で近い順） ----
+def encode_bq(x):
+    return np.packbits(x > 0, axis=1)
+
+
+def search_bq(q, bits, k):
+    qb = np.packbits(q > 0)
+    x = np.bitwise_xor(bits, qb)
+    ham = np.bitwise_count(x).sum(axis=1) if hasattr(np, "bitwise_count") else np.unpackbits(x, axis=1).sum(axis=1)
+    return topk(-ham.astype(np.float32), k)
+
+
+def rescore(q, cand, base, k):
+    return cand[topk(base[cand] @ q, k)]
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Compare vector compression options (memory, latency, recall@k)")
+    ap.add_argument("--npy", help="N x 1024 の .npy（未指定なら Weaviate の既存コレクションから取得）")
+    ap.add_argument("--collection", help="取得元のコレクション（既定: WEAVIATE_CLASS）")
+    ap.add_argument("--limit", type=int, default=50000, help="Weaviate から取得する最大件数")
+    ap.add_argument("--export", help="取得したベクトルを .npy に保存して終了")
+    ap.add_argument("--queries", type=int, default=200, help="クエリとして取り分ける件数")
+    ap.add_argument("--k", type=int, default=10)
+    ap.add_argument("--dims", default="512,256", help="truncate / pca で試す次元（カンマ区切り）")
+    ap.add_argument("--pq-segments", type=int, default=128, help="PQ のセグメント数（1024 の約数）")
+    ap.add_argument("--rescore", type=int, default=100, help="PQ / BQ で元ベクトルで並べ直す候補数")
+    ap.add_argument("--max-connections", type=int, default=32, help="HNSW の maxConnections（メモリ概算用）")
+    args = ap.parse_args()
+
+    vectors = load_vectors(args)
+    if args.export:
+        np.save(args.export, vectors)
+        print(f"saved {vectors.shape} -> {args.export}")
+        return
+    if len(vectors) <= args.queries + args.k:
+        raise SystemExit(f"ベクトルが少なすぎます（{len(vectors)} 件）")
+
+    rng = np.random.default_rng(0)
+    perm = rng.permutation(len(vectors))
+    queries, base = unit(vectors[perm[:args.queries]]), unit(vectors[perm[args.queries:]])
+    k = args.k
+    truth = [set(topk(base @ q, k).tolist()) for q in queries]
+    graph_bytes = args.max_connections * 2 * HNSW_LINK_BYTES  # レイヤー0 は 2 x maxConnections
+
+    rows = []
+
+    def run(name, bytes_per_vec, search):
+        lat, hits = [], 0
+        for i, (q, t) in enumerate(zip(queries, truth)):
+            t0 = time.perf_counter()
+            found = search(i, q)
+            lat.append(time.perf_counter() - t0)
+            hits += len(t & set(found[:k].tolist()))
+        rows.append((name, bytes_per_vec, lat, hits / (k * len(queries))))
+
+    dim = base.shape[1]
+    run(f"float32:{dim}", dim * 4, lambda i, q: topk(base @ q, k))
+    for d in [int(x) for x in args.dims.split(",") if x]:
+        for reducer in (VectorReducer.truncate(d), VectorReducer.fit_pca(base, d)):
+            rb = np.asarray(reducer.apply(base), dtype=np.float32)
+            rq = np.asarray(reducer.apply(queries), dtype=np.float32)
+            run(reducer.spec, d * 4, lambda i, q, rb=rb, rq=rq: topk(rb @ rq[i], k))
+
+    t0 = time.perf_counter()
+    train = base[rng.choice(len(base), min(len(base), 20000), replace=False)]
+    books = train_pq(train, args.pq_segments)
+    codes = encode_pq(base, books)
+    print(f"[INFO] PQ trained ({args.pq_segments} segments) in {time.perf_counter() - t0:.1f}s")
+    run(f"pq:{args.pq_segments}", args.pq_segments, lambda i, q: search_pq(q, codes, books, k))
+    run(f"pq:{args.pq_segments}+rescore", args.pq_segments,
+        lambda i, q: rescore(q, search_pq(q, codes, books, args.rescore), base, k))
+
+    bits = encode_bq(base)
+    run("bq", dim // 8, lambda i, q: search_bq(q, bits, k))
+    run("bq+rescore", dim // 8, lambda i, q: rescore(q, search_bq(q, bits, args.rescore), base, k))
+
+    print(f"\nbase={len(base)}  queries={len(queries)}  k={k}  rescore={args.rescore}  "
+          f"graph≈{graph_bytes}B/vec (maxConnections={args.max_connections})")
+    print(f"{'method':<18} {'bytes/vec':>9} {'GB/1M':>7} {'p50':>9} {'p95':>9} {f'recall@{k}':>10}")
+    for name, bpv, lat, recall in rows:
+        gb = (bpv + graph_bytes) * 1_000_000 / 1e9
+        print(f"{name:<18} {bpv:9d} {gb:7.2f} {percentile(lat, 50) * 1000:7.2f}ms "
+              f"{percentile(lat, 95) * 1000:7.2f}ms {recall:10.3f}")
+    print("\n※ PQ / BQ の rescore は元ベクトルをディスクから読むため、その分のメモリは含めていない")
+
+
+if __name__ == "__main__":
+    main()
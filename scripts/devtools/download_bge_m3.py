@@ -1,12 +1,27 @@
+import argparse
+import os
+import sys
+
 from huggingface_hub import snapshot_download
 
+parser = argparse.ArgumentParser(description="Download BAAI/bge-m3")
+parser.add_argument("--onnx", action="store_true", help="ONNX モデル（onnx/）も取得する（EMBED_BACKEND=onnx 用）")
+parser.add_argument("--int8", action="store_true", help="取得した ONNX モデルを int8 量子化しておく（EMBED_BACKEND=onnx-int8 用）")
+args = parser.parse_args()
+
 # 保存先をプロジェクト配下に指定
 local_dir = "./phase2/models/bge-m3"
 
 snapshot_download(
     repo_id="BAAI/bge-m3",
     local_dir=local_dir,
-    ignore_patterns=["*.h5", "*.onnx"]
+    ignore_patterns=["*.h5"] if args.onnx or args.int8 else ["*.h5", "*.onnx", "*.onnx_data"]
 )
 
 print(f"モデルを {local_dir} に保存しました")
+
+if args.int8:
+    sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+    from embed_backend import quantize_int8
+
+    quantize_int8(os.path.join(local_dir, "onnx", "model.onnx"))
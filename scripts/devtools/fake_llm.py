@@ -0,0 +1,54 @@
+# phase2/scripts/devtools/fake_llm.py
+"""
+ベンチマーク用の決定的な LLM の代わり（Ollama もネットワークも不要）。
+同じプロンプトには常に同じ回答を返し、生成時間も
+  ttft + 出力トークン数 x per_token + 入力トークン数 x per_prompt_token
+で決まるので、LLM 以外の変更によるレイテンシの差だけを比べられる。
+"""
+import time
+import hashlib
+
+WORDS = [
+    "手順", "設定", "確認", "実行", "バッチ", "ログ", "権限", "申請", "リリース", "環境",
+    "DB", "バックアップ", "障害", "連絡", "再実行", "Confluence", "ページ", "参照", "対応", "完了",
+]
+
+
+def approx_tokens(text: str) -> int:
+    """bge-m3 / Qwen の日本語は概ね 1〜2 文字で 1 トークンなので、文字数 / 2 で概算する。"""
+    return max(1, len(text or "") // 2)
+
+
+class FakeLLM:
+    def __init__(self, ttft_ms: float = 200, per_token_ms: float = 20, per_prompt_token_ms: float = 0.05,
+                 answer_tokens: int = 60, sleep: bool = True):
+        self.ttft_ms = ttft_ms
+        self.per_token_ms = per_token_ms
+        self.per_prompt_token_ms = per_prompt_token_ms
+        self.answer_tokens = answer_tokens
+        self.sleep = sleep  # False なら待たずに所要時間だけ返す（計算のみで高速に回す）
+
+    def tokens(self, prompt: str):
+        """プロンプトから決まる出力トークン列。"""
+        seed = hashlib.sha256(prompt.encode("utf-8")).digest()
+        n = max(1, self.answer_tokens + seed[0] % 21 - 10)
+        return [WORDS[seed[i % len(seed)] % len(WORDS)] for i in range(n)]
+
+    def duration(self, prompt: str) -> float:
+        """このプロンプトの生成にかかる（ことにする）秒数。"""
+        ms = self.ttft_ms + len(self.tokens(prompt)) * self.per_token_ms
+        ms += approx_tokens(prompt) * self.per_prompt_token_ms
+        return ms / 1000
+
+    def stream(self, prompt: str):
+        """トークンを1つずつ返す。最初のトークンまで ttft + プロンプト処理分、以降 per_token ずつ待つ。"""
+        first = (self.ttft_ms + approx_tokens(prompt) * self.per_prompt_token_ms) / 1000
+        for i, tok in enumerate(self.tokens(prompt)):
+            if self.sleep:
+                time.sleep(first if i == 0 else self.per_token_ms / 1000)
+            yield tok
+
+    def invoke(self, prompt: str) -> str:
+        if not self.sleep:
+            return "".join(self.tokens(prompt))
+        return "".join(self.stream(prompt))
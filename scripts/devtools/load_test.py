@@ -0,0 +1,325 @@
+# phase2/scripts/devtools/load_test.py
+"""
+API サーバー（api_server_phase2.py）の負荷試験。同時接続数または到着レートを段階的に上げ、
+エンドポイントごとのスループット・レイテンシ（p50 / p90 / p95 / p99）・エラー率を表示する。
+
+  # LLM を Ollama モックに差し替えて起動（実機の GPU を使わずにサーバー側の限界を見る）
+  python scripts/devtools/mock_ollama.py --parallel 2 &
+  OLLAMA_BASE_URL=http://localhost:11434 python scripts/api_server_phase2.py
+
+  python scripts/devtools/load_test.py --concurrency 1,2,4,8,16 --duration 30            # クローズドループ
+  python scripts/devtools/load_test.py --rate 0.5,1,2,4 --duration 60                    # オープンループ（req/s）
+  python scripts/devtools/load_test.py --endpoints query:3,refine_question:1 --unique    # 比率指定・回答キャッシュ回避
+  python scripts/devtools/load_test.py --concurrency 4 --max-p95-ms 5000 --max-error-rate 0.01  # 回帰ゲート
+
+--concurrency: 各ワーカーが応答を受け取ってから次を投げる（同時接続数を固定）
+--rate:        ポアソン到着で投げる。レイテンシは「投げるはずだった時刻」から測るので、
+               クライアント側で詰まった時間も含まれる（coordinated omission を避ける）
+--mock-ollama: このプロセス内で mock_ollama.py を起動する（サーバーの OLLAMA_BASE_URL をこのポートに向けておく）
+
+*_stream エンドポイントは SSE を最後まで読み、最初の token までの時間（ttft）も集計する。
+--max-p95-ms / --max-error-rate を超えた段があれば終了コード 1。
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import argparse
+import threading
+from collections import defaultdict
+from concurrent.futures import ThreadPoolExecutor
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from devtools.bench_refine_flow import DEFAULT_QUESTIONS, percentile  # noqa: E402
+
+ENDPOINTS = {
+    "refine_question": lambda q, pt: {"raw_question": q},
+    "query": lambda q, pt: {"question": q, "prompt_type": pt},
+    "query_stream": lambda q, pt: {"question": q, "prompt_type": pt},
+    "ask": lambda q, pt: {"raw_question": q, "prompt_type": pt},
+    "ask_stream": lambda q, pt: {"raw_question": q, "prompt_type": pt},
+}
+
+
+def parse_mix(spec: str):
+    """'query:3,refine_question:1' -> [("query", 3.0), ("refine_question", 1.0)]"""
+    mix = []
+    for part in spec.split(","):
+        name, _, weight = part.strip().partition(":")
+        if name not in ENDPOINTS:
+            raise SystemExit(f"unknown endpoint: {name}（{', '.join(ENDPOINTS)}）")
+        mix.append((name, float(weight or 1)))
+    return mix
+
+
+class Recorder:
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.lat = defaultdict(list)
+        self.ttft = defaultdict(list)
+        self.errors = defaultdict(lambda: defaultdict(int))
+        self.count = defaultdict(int)
+
+    def ok(self, endpoint, latency, ttft=None):
+        with self._lock:
+            self.count[endpoint] += 1
+            self.lat[endpoint].append(latency)
+            if ttft is not None:
+                self.ttft[endpoint].append(ttft)
+
+    def error(self, endpoint, kind):
+        with self._lock:
+            self.count[endpoint] += 1
+            self.errors[endpoint][kind] += 1
+
+
+class Client:
+    def __init__(self, args, recorder):
+        self.args = args
+        self.recorder = recorder
+        self.mix = parse_mix(args.endpoints)
+        self._local = threading.local()
+        self._rng = random.Random(args.seed)
+        self._rng_lock = threading.Lock()
+        self.questions = load_questions(args.questions)
+
+    def session(self):
+        if not hasattr(self._local, "session"):
+            self._local.session = requests.Session()
+        return self._local.session
+
+    def pick(self):
+        with self._rng_lock:
+            endpoint = self._rng.choices([n for n, _ in self.mix], weights=[w for _, w in self.mix])[0]
+            q = self._rng.choice(self.questions)
+        if self.args.unique:
+            q = f"{q}（{uuid.uuid4().hex[:6]}）"  # 回答キャッシュ・埋め込みキャッシュに当たらないように
+        return endpoint, q
+
+    def send(self, t_start=None):
+        """1リクエスト送って記録する。t_start は計測の起点（オープンループでは予定時刻）。"""
+        endpoint, q = self.pick()
+        t_start = time.perf_counter() if t_start is None else t_start
+        url = f"{self.args.base_url}/{endpoint}"
+        payload = ENDPOINTS[endpoint](q, self.args.prompt_type)
+        try:
+            if endpoint.endswith("_stream"):
+                ttft, failure = self._stream(url, payload, t_start)
+                if failure:
+                    return self.recorder.error(endpoint, failure)
+                return self.recorder.ok(endpoint, time.perf_counter() - t_start, ttft)
+            r = self.session().post(url, json=payload, timeout=self.args.timeout)
+            if r.status_code >= 400:
+                return self.recorder.error(endpoint, str(r.status_code))
+            self.recorder.ok(endpoint, time.perf_counter() - t_start)
+        except requests.Timeout:
+            self.recorder.error(endpoint, "timeout")
+        except requests.RequestException as e:
+            self.recorder.error(endpoint, type(e).__name__)
+
+    def _stream(self, url, payload, t_start):
+        """SSE を最後まで読み、(ttft, 失敗の種類 or None) を返す。"""
+        ttft = None
+        with self.session().post(url, json=payload, stream=True, timeout=self.args.timeout) as r:
+            if r.status_code >= 400:
+                return None, str(r.status_code)
+            for line in r.iter_lines():
+                if not line.startswith(b"event:"):
+                    continue
+                event = line.split(b":", 1)[1].strip().decode()
+                if event == "token" and ttft is None:
+                    ttft = time.perf_counter() - t_start
+                if event == "error":
+                    return ttft, "sse_error"
+        return ttft, None
+
+
+def load_questions(path):
+    if not path:
+        return DEFAULT_QUESTIONS
+    with open(path, encoding="utf-8") as f:
+        if path.endswith(".jsonl"):
+            return [json.loads(line)["question"] for line in f if line.strip()]
+        return [line.strip() for line in f if line.strip()]
+
+
+def run_closed(client, concurrency, duration):
+    deadline = time.perf_counter() + duration
+
+    def worker():
+        while time.perf_counter() < deadline:
+            client.send()
+
+    threads = [threading.Thread(target=worker, daemon=True) for _ in range(concurrency)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+
+
+def run_open(client, rate, duration, max_inflight, seed):
+    rng = random.Random(seed)
+    with ThreadPoolExecutor(max_workers=max_inflight, thread_name_prefix="load") as ex:
+        t0 = time.perf_counter()
+        at = t0
+        while True:
+            at += rng.expovariate(rate)
+            if at - t0 >= duration:
+                break
+            delay = at - time.perf_counter()
+            if delay > 0:
+                time.sleep(delay)
+            ex.submit(client.send, at)
+
+
+def summarize(recorder, elapsed):
+    out = {}
+    for endpoint in sorted(recorder.count):
+        lat = recorder.lat[endpoint]
+        errors = dict(recorder.errors[endpoint])
+        n = recorder.count[endpoint]
+        row = {
+            "n": n,
+            "ok": len(lat),
+            "rps": len(lat) / elapsed if elapsed else 0.0,
+            "error_rate": sum(errors.values()) / n if n else 0.0,
+            "errors": errors,
+        }
+        if lat:
+            row.update({f"p{p}": percentile(lat, p) for p in (50, 90, 95, 99)}, max=max(lat))
+        if recorder.ttft[endpoint]:
+            row.update(ttft_p50=percentile(recorder.ttft[endpoint], 50), ttft_p95=percentile(recorder.ttft[endpoint], 95))
+        out[endpoint] = row
+    return out
+
+
+def print_step(label, summary):
+    print(f"\n== {label}")
+    print(f"{'endpoint':<16} {'n':>5} {'ok':>5} {'rps':>6} {'p50':>8} {'p90':>8} {'p95':>8} {'p99':>8} {'max':>8} "
+          f"{'err%':>6}  errors / ttft")
+    for endpoint, s in summary.items():
+        lat = " ".join(f"{s[k]:7.2f}s" if k in s else f"{'-':>8}" for k in ("p50", "p90", "p95", "p99", "max"))
+        extra = " ".join(f"{k}={v}" for k, v in s["errors"].items())
+        if "ttft_p50" in s:
+            extra += f" ttft p50={s['ttft_p50']:.2f}s p95={s['ttft_p95']:.2f}s"
+        print(f"{endpoint:<16} {s['n']:5d} {s['ok']:5d} {s['rps']:6.2f} {lat} {s['error_rate'] * 100:5.1f}%  {extra}")
+
+
+def gate(results, max_p95_ms, max_error_rate):
+    failures = []
+    for label, summary in results:
+        for endpoint, s in summary.items():
+            if max_p95_ms and s.get("p95", 0) * 1000 > max_p95_ms:
+                failures.append(f"{label} {endpoint}: p95 {s['p95'] * 1000:.0f}ms > {max_p95_ms:.0f}ms")
+            if max_error_rate is not None and s["error_rate"] > max_error_rate:
+                failures.append(f"{label} {endpoint}: error rate {s['error_rate']:.3f} > {max_error_rate}")
+    return failures
+
+
+def wait_ready(base_url, timeout):
+    """API サーバーの /readyz が 200 になるまで待つ（warmup 中の 503 を計測に混ぜない）。"""
+    deadline = time.monotonic() + timeout
+    while True:
+        try:
+            r = requests.get(f"{base_url}/readyz", timeout=5)
+            if r.status_code in (200, 404):  # 404: /readyz の無い古いサーバー
+                return
+            detail = r.json().get("error") or "warming up"
+        except (requests.RequestException, ValueError) as e:
+            detail = str(e)
+        if time.monotonic() >= deadline:
+            raise SystemExit(f"[ERROR] {base_url} not ready after {timeout:.0f}s: {detail}")
+        time.sleep(1)
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Load test for api_server_phase2.py")
+    ap.add_argument("--base-url", default="http://localhost:8000")
+    ap.add_argument("--endpoints", default="refine_question,query",
+                    help=f"name[:weight] のカンマ区切り（{', '.join(ENDPOINTS)}）")
+    ap.add_argument("--questions", help="1行1質問のテキスト、または bench_retrieval.py の質問セット（.jsonl）")
+    ap.add_argument("--prompt-type", default="簡易回答ver")
+    ap.add_argument("--unique", action="store_true", help="質問に一意な接尾辞を付けて回答キャッシュを回避する")
+    load = ap.add_mutually_exclusive_group()
+    load.add_argument("--concurrency", default="1,2,4,8", help="クローズドループの同時接続数（カンマ区切りで段階実行）")
+    load.add_argument("--rate", help="オープンループの到着レート req/s（カンマ区切りで段階実行）")
+    ap.add_argument("--max-inflight", type=int, default=256, help="オープンループで同時に待てる最大リクエスト数")
+    ap.add_argument("--duration", type=float, default=30, help="1段あたりの秒数")
+    ap.add_argument("--warmup", type=int, default=2, help="計測前に順番に投げるリクエスト数")
+    ap.add_argument("--timeout", type=float, default=600)
+    ap.add_argument("--wait-ready", type=float, default=300, help="開始前に /readyz が 200 になるまで待つ秒数（0 で待たない）")
+    ap.add_argument("--seed", type=int, default=0)
+    ap.add_argument("--max-p95-ms", type=float, default=0, help="どれかの段・エンドポイントの p95 がこれを超えたら失敗")
+    ap.add_argument("--max-error-rate", type=float, default=None, help="エラー率がこれを超えたら失敗（0〜1）")
+    ap.add_argument("--save", help="結果を JSON に保存")
+    mock = ap.add_argument_group("mock ollama（このプロセス内で起動）")
+    mock.add_argument("--mock-ollama", type=int, metavar="PORT", help="指定ポートで mock_ollama.py を起動する")
+    mock.add_argument("--mock-instances", type=int, default=1, help="モックの台数（PORT から連番。OLLAMA_ENDPOINTS に並べる）")
+    mock.add_argument("--mock-ttft-ms", type=float, default=300)
+    mock.add_argument("--mock-tokens-per-sec", type=float, default=30)
+    mock.add_argument("--mock-parallel", type=int, default=1)
+    mock.add_argument("--mock-error-rate", type=float, default=0.0)
+    args = ap.parse_args()
+
+    mock_servers = []
+    if args.mock_ollama:
+        from devtools.mock_ollama import MockOllama
+
+        mock_servers = [
+            MockOllama(
+                port=args.mock_ollama + i, ttft_ms=args.mock_ttft_ms, tokens_per_sec=args.mock_tokens_per_sec,
+                parallel=args.mock_parallel, error_rate=args.mock_error_rate, seed=args.seed + i,
+            ).start()
+            for i in range(max(1, args.mock_instances))
+        ]
+        print(f"[INFO] mock ollama on {','.join(m.url for m in mock_servers)}")
+
+    if args.wait_ready > 0:
+        wait_ready(args.base_url, args.wait_ready)
+    warm = Client(args, Recorder())
+    for _ in range(args.warmup):
+        warm.send()
+
+    if args.rate:
+        steps = [("rate", float(x)) for x in args.rate.split(",") if x]
+    else:
+        steps = [("concurrency", int(x)) for x in args.concurrency.split(",") if x]
+    print(f"[INFO] base={args.base_url}  endpoints={args.endpoints}  duration={args.duration:.0f}s/step  "
+          f"unique={args.unique}")
+
+    results = []
+    for kind, value in steps:
+        recorder = Recorder()
+        client = Client(args, recorder)
+        t0 = time.perf_counter()
+        if kind == "rate":
+            run_open(client, value, args.duration, args.max_inflight, args.seed)
+        else:
+            run_closed(client, value, args.duration)
+        label = f"{kind}={value:g}"
+        summary = summarize(recorder, time.perf_counter() - t0)
+        print_step(label, summary)
+        results.append((label, summary))
+
+    for mock_server in mock_servers:
+        print(f"\n[mock ollama {mock_server.url}] {json.dumps(mock_server.stats())}")
+        mock_server.shutdown()
+
+    if args.save:
+        with open(args.save, "w", encoding="utf-8") as f:
+            json.dump({"args": vars(args), "steps": dict(results)}, f, ensure_ascii=False, indent=2)
+        print(f"saved -> {args.save}")
+
+    failures = gate(results, args.max_p95_ms, args.max_error_rate)
+    if failures:
+        for msg in failures:
+            print(f"[FAIL] {msg}")
+        raise SystemExit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,247 @@
+# phase2/scripts/devtools/mock_ollama.py
+"""
+負荷試験用の Ollama モック（標準ライブラリのみ）。ChatOllama が使うエンドポイントだけを実装する:
+  POST /api/chat       NDJSON ストリーム（{"message": {"content": ...}, "done": false} ... {"done": true}）
+  POST /api/generate   NDJSON ストリーム（{"response": ..., "done": false} ... {"done": true}）
+  GET  /api/tags, /api/version
+  GET  /mock/stats     モック自身の統計（リクエスト数・同時実行数・待ち時間）
+  POST /mock/down, /mock/up  障害の模擬（down の間は全エンドポイントが 503）
+
+  python scripts/devtools/mock_ollama.py --port 11434 --ttft-ms 300 --tokens-per-sec 30 --parallel 2
+  OLLAMA_BASE_URL=http://localhost:11434 python scripts/api_server_phase2.py
+
+  # 複数台（11434〜11436）。llm_gateway.py の振り分け・ヘルスチェック・サーキットブレーカーの確認用
+  python scripts/devtools/mock_ollama.py --port 11434 --instances 3
+  OLLAMA_ENDPOINTS=http://localhost:11434,http://localhost:11435,http://localhost:11436 python scripts/api_server_phase2.py
+  curl -X POST localhost:11435/mock/down
+
+レイテンシは TTFT（対数正規分布、中央値 --ttft-ms・ばらつき --ttft-sigma）+ トークンごとに 1 / --tokens-per-sec 秒。
+--parallel は Ollama の OLLAMA_NUM_PARALLEL 相当で、超えたリクエストは空くまで待たされる（実機の GPU 1枚を模擬）。
+回答の中身は fake_llm.py と同じくプロンプトから決定的に決まる。
+"""
+import os
+import sys
+import json
+import time
+import random
+import argparse
+import threading
+from contextlib import contextmanager
+from datetime import datetime, timezone
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), ".."))
+from devtools.fake_llm import FakeLLM, approx_tokens  # noqa: E402
+
+
+def _now():
+    return datetime.now(timezone.utc).isoformat()
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, fmt, *args):  # アクセスログは出さない
+        pass
+
+    def _body(self):
+        n = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(n) or b"{}") if n else {}
+
+    def _send(self, status, payload):
+        data = json.dumps(payload, ensure_ascii=False).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def _chunk(self, payload):
+        data = (json.dumps(payload, ensure_ascii=False) + "\n").encode()
+        self.wfile.write(f"{len(data):X}\r\n".encode() + data + b"\r\n")
+        self.wfile.flush()
+
+    def do_GET(self):
+        path = self.path.split("?")[0].rstrip("/")
+        if path == "/mock/stats":
+            return self._send(200, self.server.stats())
+        if self.server.down:
+            return self._send(503, {"error": "mock: down"})
+        if path == "/api/tags":
+            return self._send(200, {"models": [{"name": self.server.model, "model": self.server.model}]})
+        if path == "/api/version":
+            return self._send(200, {"version": "mock"})
+        if path == "":
+            return self._send(200, "Ollama is running")
+        self._send(404, {"error": path})
+
+    def do_POST(self):
+        path = self.path.split("?")[0].rstrip("/")
+        body = self._body()
+        if path in ("/mock/down", "/mock/up"):
+            self.server.down = path == "/mock/down"
+            return self._send(200, {"down": self.server.down})
+        if self.server.down:
+            return self._send(503, {"error": "mock: down"})
+        if path == "/api/chat":
+            prompt = "\n".join(m.get("content") or "" for m in body.get("messages") or [])
+            return self._generate(body, prompt, lambda t: {"message": {"role": "assistant", "content": t}})
+        if path == "/api/generate":
+            return self._generate(body, body.get("prompt") or "", lambda t: {"response": t})
+        self._send(404, {"error": path})
+
+    def _generate(self, body, prompt, wrap):
+        server = self.server
+        model = body.get("model") or server.model
+        if not server.admit():
+            return self._send(500, {"error": "mock: injected failure"})
+
+        t_arrive = time.perf_counter()
+        with server.slot():
+            t_start = time.perf_counter()
+            tokens = server.llm.tokens(prompt)
+            time.sleep(server.ttft())
+            stream = body.get("stream", True)
+            base = {"model": model, "created_at": _now()}
+            if stream:
+                self.send_response(200)
+                self.send_header("Content-Type", "application/x-ndjson")
+                self.send_header("Transfer-Encoding", "chunked")
+                self.end_headers()
+            for i, tok in enumerate(tokens):
+                if i:
+                    time.sleep(1 / server.tokens_per_sec)
+                if stream:
+                    self._chunk({**base, **wrap(tok), "done": False})
+            final = {
+                **base, "done": True, "done_reason": "stop",
+                "total_duration": int((time.perf_counter() - t_arrive) * 1e9),
+                "load_duration": 0,
+                "prompt_eval_count": approx_tokens(prompt),
+                "eval_count": len(tokens),
+                "eval_duration": int((time.perf_counter() - t_start) * 1e9),
+            }
+            if stream:
+                self._chunk({**final, **wrap("")})
+                self.wfile.write(b"0\r\n\r\n")
+                self.wfile.flush()
+            else:
+                self._send(200, {**final, **wrap("".join(tokens))})
+        server.count("completed", queued=t_start - t_arrive)
+
+
+class MockOllama(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=11434, model="qwen2:7b-instruct", ttft_ms=300.0, ttft_sigma=0.3,
+                 tokens_per_sec=30.0, answer_tokens=120, parallel=1, error_rate=0.0, seed=0, host="127.0.0.1"):
+        super().__init__((host, port), _Handler)
+        self.model = model
+        self.ttft_ms = ttft_ms
+        self.ttft_sigma = ttft_sigma
+        self.tokens_per_sec = tokens_per_sec
+        self.error_rate = error_rate
+        self.down = False
+        self.llm = FakeLLM(answer_tokens=answer_tokens, sleep=False)
+        self._rng = random.Random(seed)
+        self._slots = threading.BoundedSemaphore(parallel) if parallel > 0 else None
+        self.parallel = parallel
+        self._lock = threading.Lock()
+        self._counts = {"requests": 0, "completed": 0, "errors": 0}
+        self._inflight = 0
+        self._max_inflight = 0
+        self._queued_total = 0.0
+
+    @property
+    def url(self):
+        return f"http://{self.server_address[0]}:{self.server_address[1]}"
+
+    def admit(self) -> bool:
+        """リクエストを数え、--error-rate の割合で失敗させる（False = 500 を返す）。"""
+        with self._lock:
+            self._counts["requests"] += 1
+            if self._rng.random() < self.error_rate:
+                self._counts["errors"] += 1
+                return False
+            return True
+
+    def ttft(self) -> float:
+        with self._lock:
+            return self._rng.lognormvariate(0, self.ttft_sigma) * self.ttft_ms / 1000
+
+    @contextmanager
+    def slot(self):
+        """生成枠（--parallel）を1つ使う。空いていなければ待つ。"""
+        if self._slots is not None:
+            self._slots.acquire()
+        with self._lock:
+            self._inflight += 1
+            self._max_inflight = max(self._max_inflight, self._inflight)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self._inflight -= 1
+            if self._slots is not None:
+                self._slots.release()
+
+    def count(self, key, queued=0.0):
+        with self._lock:
+            self._counts[key] += 1
+            self._queued_total += queued
+
+    def stats(self) -> dict:
+        with self._lock:
+            done = self._counts["completed"]
+            return {
+                **self._counts,
+                "inflight": self._inflight,
+                "max_inflight": self._max_inflight,
+                "parallel": self.parallel,
+                "down": self.down,
+                "avg_queue_ms": round(self._queued_total / done * 1000, 1) if done else 0.0,
+            }
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Mock Ollama server for load tests")
+    ap.add_argument("--host", default="127.0.0.1")
+    ap.add_argument("--port", type=int, default=11434)
+    ap.add_argument("--instances", type=int, default=1, help="起動する台数（--port から連番のポート）")
+    ap.add_argument("--model", default="qwen2:7b-instruct")
+    ap.add_argument("--ttft-ms", type=float, default=300, help="最初のトークンまでの時間の中央値")
+    ap.add_argument("--ttft-sigma", type=float, default=0.3, help="TTFT の対数正規分布のばらつき（0 で一定）")
+    ap.add_argument("--tokens-per-sec", type=float, default=30, help="生成速度（1リクエストあたり）")
+    ap.add_argument("--answer-tokens", type=int, default=120, help="回答のトークン数の目安")
+    ap.add_argument("--parallel", type=int, default=1, help="同時に生成するリクエスト数（0 = 無制限）")
+    ap.add_argument("--error-rate", type=float, default=0.0, help="500 を返す割合（0〜1）")
+    ap.add_argument("--seed", type=int, default=0)
+    args = ap.parse_args()
+
+    servers = [
+        MockOllama(
+            port=args.port + i, model=args.model, ttft_ms=args.ttft_ms, ttft_sigma=args.ttft_sigma,
+            tokens_per_sec=args.tokens_per_sec, answer_tokens=args.answer_tokens, parallel=args.parallel,
+            error_rate=args.error_rate, seed=args.seed + i, host=args.host,
+        )
+        for i in range(max(1, args.instances))
+    ]
+    for server in servers[1:]:
+        server.start()
+    print(f"[INFO] mock ollama on {', '.join(s.url for s in servers)} (ttft≈{args.ttft_ms:.0f}ms, "
+          f"{args.tokens_per_sec:.0f} tok/s, parallel={args.parallel}, error_rate={args.error_rate})")
+    try:
+        servers[0].serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        for server in servers:
+            print(json.dumps({"url": server.url, **server.stats()}))
+
+
+if __name__ == "__main__":
+    main()
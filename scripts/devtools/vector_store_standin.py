@@ -0,0 +1,149 @@
+# phase2/scripts/devtools/vector_store_standin.py
+"""
+ベンチマーク用のインプロセス版 ConfluenceChunk（Weaviate もネットワークも不要）。
+retrieval.search() が使う v4 クライアントの一部だけを真似る:
+  coll.query.near_vector(near_vector=, limit=, return_metadata=, return_properties=, include_vector=)
+  coll.query.bm25(query=, query_properties=, limit=, ...)
+  coll.query.hybrid(query=, vector=, alpha=, ...)   （relativeScoreFusion 相当）
+ベクトル検索は総当たりの内積（正規化済み前提で cosine 距離 = 1 - 内積）、BM25 は
+Weaviate の trigram トークナイズ（TEXT_TOKENIZATION の既定）に近い分割で計算する。
+
+データは 1行1オブジェクトの JSONL: {"uuid": "...", "properties": {...}, "vector": [...]}
+（bench_retrieval.py --export-store で Weaviate から書き出せる）
+"""
+import json
+import math
+import uuid as uuidlib
+from collections import Counter
+from types import SimpleNamespace
+
+import numpy as np
+
+BM25_K1 = 1.2
+BM25_B = 0.75
+
+
+def trigrams(text: str):
+    tokens = []
+    for word in (text or "").lower().split():
+        if len(word) < 3:
+            tokens.append(word)
+        else:
+            tokens.extend(word[i:i + 3] for i in range(len(word) - 2))
+    return tokens
+
+
+class _BM25Field:
+    def __init__(self, texts):
+        self.tf = [Counter(trigrams(t)) for t in texts]
+        self.len = np.array([sum(c.values()) for c in self.tf], dtype=np.float32)
+        self.avg = float(self.len.mean()) if len(self.len) else 0.0
+        df = Counter(tok for c in self.tf for tok in c)
+        n = len(texts)
+        self.idf = {tok: math.log(1 + (n - d + 0.5) / (d + 0.5)) for tok, d in df.items()}
+
+    def scores(self, query_tokens):
+        out = np.zeros(len(self.tf), dtype=np.float32)
+        if not self.avg:
+            return out
+        norm = BM25_K1 * (1 - BM25_B + BM25_B * self.len / self.avg)
+        for tok in set(query_tokens):
+            idf = self.idf.get(tok)
+            if idf is None:
+                continue
+            tf = np.array([c.get(tok, 0) for c in self.tf], dtype=np.float32)
+            out += idf * tf * (BM25_K1 + 1) / (tf + norm)
+        return out
+
+
+class _Query:
+    def __init__(self, store):
+        self.store = store
+
+    def near_vector(self, near_vector, limit=10, return_metadata=None, return_properties=None,
+                    include_vector=False, **_):
+        scores = self.store.dense_scores(near_vector)
+        return self.store.result(scores, limit, return_properties, include_vector, "distance")
+
+    def bm25(self, query, query_properties=None, limit=10, return_metadata=None, return_properties=None,
+             include_vector=False, **_):
+        scores = self.store.bm25_scores(query, query_properties)
+        return self.store.result(scores, limit, return_properties, include_vector, "score", positive_only=True)
+
+    def hybrid(self, query, vector=None, alpha=0.5, query_properties=None, limit=10, return_metadata=None,
+               return_properties=None, include_vector=False, **_):
+        def relative(s):
+            lo, hi = float(s.min()), float(s.max())
+            return (s - lo) / (hi - lo) if hi > lo else np.zeros_like(s)
+
+        dense = relative(self.store.dense_scores(vector)) if vector is not None else 0.0
+        sparse = relative(self.store.bm25_scores(query, query_properties))
+        scores = alpha * dense + (1 - alpha) * sparse
+        return self.store.result(scores, limit, return_properties, include_vector, "score")
+
+
+class StandinCollection:
+    def __init__(self, objects, name="ConfluenceChunk"):
+        self.name = name
+        self.objects = list(objects)
+        self.vectors = np.asarray([o["vector"] for o in self.objects], dtype=np.float32)
+        self._bm25 = {}
+        self.query = _Query(self)
+
+    @classmethod
+    def from_jsonl(cls, path: str, name="ConfluenceChunk"):
+        with open(path, encoding="utf-8") as f:
+            return cls([json.loads(line) for line in f if line.strip()], name)
+
+    @classmethod
+    def from_chunks(cls, chunks, vectors, name="ConfluenceChunk"):
+        """chunks（properties の dict）と埋め込み済みベクトルから作る。uuid は pageId / chunkIndex から決める。"""
+        objects = [
+            {
+                "uuid": str(uuidlib.uuid5(uuidlib.NAMESPACE_URL, f"confluence:{p.get('pageId')}:{p.get('chunkIndex')}")),
+                "properties": p,
+                "vector": v,
+            }
+            for p, v in zip(chunks, vectors)
+        ]
+        return cls(objects, name)
+
+    def __len__(self):
+        return len(self.objects)
+
+    def _field(self, name):
+        if name not in self._bm25:
+            self._bm25[name] = _BM25Field([o["properties"].get(name) or "" for o in self.objects])
+        return self._bm25[name]
+
+    def dense_scores(self, vec):
+        return self.vectors @ np.asarray(vec, dtype=np.float32)
+
+    def bm25_scores(self, query, query_properties=None):
+        tokens = trigrams(query)
+        total = np.zeros(len(self.objects), dtype=np.float32)
+        for prop in query_properties or ["content"]:
+            name, _, boost = prop.partition("^")
+            total += float(boost or 1) * self._field(name).scores(tokens)
+        return total
+
+    def result(self, scores, limit, return_properties, include_vector, metric, positive_only=False):
+        order = np.argsort(-scores, kind="stable")[:limit]
+        objs = []
+        for i in order:
+            if positive_only and scores[i] <= 0:
+                break
+            o = self.objects[i]
+            props = o["properties"]
+            if return_properties:
+                props = {k: props.get(k) for k in return_properties if k in props}
+            meta = SimpleNamespace(distance=None, score=None)
+            if metric == "distance":
+                meta.distance = float(1.0 - scores[i])
+            else:
+                meta.score = float(scores[i])
+            objs.append(SimpleNamespace(
+                uuid=o["uuid"], properties=props, metadata=meta,
+                vector={"default": o["vector"]} if include_vector else {},
+            ))
+        return SimpleNamespace(objects=objs)
@@ -0,0 +1,112 @@
+# phase2/scripts/devtools/weaviate_standin.py
+"""
+ベンチマーク用の Weaviate REST スタンドイン（標準ライブラリのみ）。
+オブジェクトはメモリ上の dict に保存し、1リクエストごとに latency 秒だけ待って
+サーバー側の処理時間を模擬する。対応エンドポイント:
+  DELETE /v1/objects/{id}
+  POST   /v1/objects
+  POST   /v1/batch/objects
+  DELETE /v1/batch/objects   (where: Equal / GreaterThanEqual / And のみ)
+"""
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+
+    def log_message(self, fmt, *args):  # アクセスログは出さない
+        pass
+
+    def _body(self):
+        n = int(self.headers.get("Content-Length") or 0)
+        return json.loads(self.rfile.read(n) or b"{}") if n else {}
+
+    def _send(self, status, payload=None):
+        data = json.dumps(payload).encode() if payload is not None else b""
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_POST(self):
+        body = self._body()
+        self.server.hit()
+        path = self.path.split("?")[0]
+        if path == "/v1/objects":
+            self.server.put(body)
+            return self._send(200, body)
+        if path == "/v1/batch/objects":
+            objs = body.get("objects", [])
+            for o in objs:
+                self.server.put(o)
+            return self._send(200, [{"id": o.get("id"), "result": {}} for o in objs])
+        self._send(404, {"error": path})
+
+    def do_DELETE(self):
+        path = self.path.split("?")[0]
+        body = self._body()
+        self.server.hit()
+        if path.startswith("/v1/objects/"):
+            found = self.server.delete(path.rsplit("/", 1)[-1])
+            return self._send(204 if found else 404)
+        if path == "/v1/batch/objects":
+            n = self.server.delete_where((body.get("match") or {}).get("where") or {})
+            return self._send(200, {"results": {"matches": n, "successful": n, "failed": 0}})
+        self._send(404, {"error": path})
+
+
+def _match(where, props):
+    op = where.get("operator")
+    if op == "And":
+        return all(_match(w, props) for w in where.get("operands", []))
+    value = props.get(where.get("path", [""])[0])
+    expected = where.get("valueText", where.get("valueInt"))
+    if op == "Equal":
+        return value == expected
+    if op == "GreaterThanEqual":
+        return value is not None and value >= expected
+    return False
+
+
+class WeaviateStandin(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, port=0, latency=0.005):
+        super().__init__(("127.0.0.1", port), _Handler)
+        self.latency = latency
+        self.objects = {}
+        self.requests = 0
+        self._lock = threading.Lock()
+
+    @property
+    def url(self):
+        return f"http://127.0.0.1:{self.server_address[1]}"
+
+    def hit(self):
+        with self._lock:
+            self.requests += 1
+        if self.latency:
+            time.sleep(self.latency)
+
+    def put(self, obj):
+        with self._lock:
+            self.objects[obj.get("id")] = obj
+
+    def delete(self, obj_id):
+        with self._lock:
+            return self.objects.pop(obj_id, None) is not None
+
+    def delete_where(self, where):
+        with self._lock:
+            ids = [k for k, o in self.objects.items() if _match(where, o.get("properties") or {})]
+            for k in ids:
+                del self.objects[k]
+        return len(ids)
+
+    def start(self):
+        threading.Thread(target=self.serve_forever, daemon=True).start()
+        return self
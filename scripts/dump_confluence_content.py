@@ -5,6 +5,8 @@ import weaviate
 from dotenv import load_dotenv
 from weaviate.classes.query import Filter
 
+from collection_alias import resolve_alias
+
 # ---- env 読み込み（phase2/.env を明示）----
 ENV_PATH = os.path.join(os.path.dirname(__file__), "..", ".env")
 load_dotenv(dotenv_path=ENV_PATH)
@@ -20,7 +22,7 @@ BATCH = 100  # 1リクエストで取る件数（必要に応じて調整）
 def dump_all(page_id: str | None):
     client = weaviate.connect_to_local(host=HOST, port=PORT, grpc_port=GRPC_PORT)
     try:
-        coll = client.collections.get(CLASS_NAME)
+        coll = client.collections.get(resolve_alias(CLASS_NAME))
 
         cursor = None
         total = 0
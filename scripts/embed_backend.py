@@ -0,0 +1,149 @@
+# phase2/scripts/embed_backend.py
+"""
+bge-m3 の推論バックエンド切り替え（EMBED_BACKEND）。
+
+  torch      sentence-transformers（PyTorch fp32、既定）
+  onnx       ONNX Runtime（fp32）
+  onnx-int8  ONNX Runtime + 動的 int8 量子化（初回に model_int8.onnx を作って再利用）
+
+どのバックエンドも SentenceTransformer と同じ encode(texts, batch_size=, normalize_embeddings=) を持つので、
+呼び出し側は load_embedder() の戻り値をそのまま使える。
+
+  from embed_backend import load_embedder, embed_model_id
+  model = load_embedder(MODEL_PATH or MODEL_NAME, device=DEVICE)
+  vecs = model.encode(["passage: ..."], normalize_embeddings=True)
+
+ONNX モデルは <モデルディレクトリ>/onnx/model.onnx を使う（download_bge_m3.py --onnx で取得、
+無ければ Hugging Face から onnx/ だけ取得する）。int8 は fp32 とベクトルが少し違うので、
+埋め込みキャッシュと埋め込みサービスのモデル ID は embed_model_id() で区別する。
+"""
+import os
+import time
+
+import numpy as np
+
+EMBED_BACKEND = os.getenv("EMBED_BACKEND", "torch")            # torch / onnx / onnx-int8
+EMBED_THREADS = int(os.getenv("EMBED_THREADS", "0"))            # 推論のスレッド数（0 = ライブラリ既定）
+EMBED_ONNX_PATH = os.getenv("EMBED_ONNX_PATH")                  # fp32 の .onnx（未指定ならモデル配下の onnx/model.onnx）
+EMBED_MAX_LENGTH = int(os.getenv("EMBED_MAX_LENGTH", "8192"))   # トークン数の上限（bge-m3 の最大長）
+
+BACKENDS = ("torch", "onnx", "onnx-int8")
+INT8_FILENAME = "model_int8.onnx"
+
+
+def embed_model_id(model_name: str, backend: str = EMBED_BACKEND) -> str:
+    """埋め込みキャッシュ・埋め込みサービスで使うモデル ID（int8 は fp32 と混ぜない）。"""
+    return f"{model_name}:int8" if backend == "onnx-int8" else model_name
+
+
+def _model_dir(model_name_or_path: str) -> str:
+    """ローカルのモデルディレクトリを返す（Hub の ID なら onnx/ とトークナイザだけ取得する）。"""
+    if os.path.isdir(model_name_or_path):
+        return model_name_or_path
+    from huggingface_hub import snapshot_download
+
+    return snapshot_download(
+        repo_id=model_name_or_path,
+        allow_patterns=["onnx/*", "*.json", "sentencepiece.bpe.model"],
+    )
+
+
+def onnx_path(model_name_or_path: str) -> str:
+    return EMBED_ONNX_PATH or os.path.join(_model_dir(model_name_or_path), "onnx", "model.onnx")
+
+
+def quantize_int8(src: str, dst: str = None) -> str:
+    """fp32 の ONNX モデルを動的 int8 量子化（重みのみ、MatMul/Gemm）して保存する。"""
+    from onnxruntime.quantization import QuantType, quantize_dynamic
+
+    dst = dst or os.path.join(os.path.dirname(src), INT8_FILENAME)
+    t0 = time.perf_counter()
+    print(f"[INFO] quantize {src} -> {dst} (int8, dynamic)")
+    quantize_dynamic(
+        src, dst, weight_type=QuantType.QInt8,
+        # fp32 の bge-m3 は 2GB を超えて外部データ（model.onnx_data）になっている
+        use_external_data_format=os.path.exists(src + "_data"),
+    )
+    print(f"[INFO] quantized in {time.perf_counter() - t0:.1f}s")
+    return dst
+
+
+class OnnxEmbedder:
+    """ONNX Runtime で bge-m3 の dense ベクトル（CLS プーリング）を計算する。"""
+
+    def __init__(self, model_name_or_path: str, int8: bool = False, threads: int = EMBED_THREADS,
+                 max_length: int = EMBED_MAX_LENGTH):
+        import onnxruntime as ort
+        from transformers import AutoTokenizer
+
+        src = onnx_path(model_name_or_path)
+        path = src
+        if int8:
+            path = os.path.join(os.path.dirname(src), INT8_FILENAME)
+            if not os.path.exists(path):
+                quantize_int8(src, path)
+
+        opts = ort.SessionOptions()
+        opts.graph_optimization_level = ort.GraphOptimizationLevel.ORT_ENABLE_ALL
+        if threads:
+            opts.intra_op_num_threads = threads
+            opts.inter_op_num_threads = 1
+        self.session = ort.InferenceSession(path, sess_options=opts, providers=["CPUExecutionProvider"])
+        self.input_names = {i.name for i in self.session.get_inputs()}
+        outputs = [o.name for o in self.session.get_outputs()]
+        # dense の出力名はエクスポート元で違う（sentence_embedding / dense_vecs / last_hidden_state）
+        self.output_name = next((n for n in ("sentence_embedding", "dense_vecs") if n in outputs), outputs[0])
+        tok_dir = os.path.dirname(src)
+        if not os.path.exists(os.path.join(tok_dir, "tokenizer_config.json")):
+            tok_dir = _model_dir(model_name_or_path)
+        self.tokenizer = AutoTokenizer.from_pretrained(tok_dir)
+        self.max_length = max_length
+        self.path = path
+        self._dim = None
+
+    def _forward(self, texts):
+        enc = self.tokenizer(texts, padding=True, truncation=True, max_length=self.max_length, return_tensors="np")
+        feeds = {k: v.astype(np.int64) for k, v in enc.items() if k in self.input_names}
+        out = self.session.run([self.output_name], feeds)[0]
+        # sentence_embedding / dense_vecs なら (N, dim)、last_hidden_state なら (N, seq, dim) の CLS を使う
+        return out if out.ndim == 2 else out[:, 0]
+
+    def encode(self, texts, batch_size: int = 32, normalize_embeddings: bool = False, **_):
+        if isinstance(texts, str):
+            texts = [texts]
+        # 長さの近いものをまとめるとパディングが減る（結果は元の順に戻す）
+        order = sorted(range(len(texts)), key=lambda i: len(texts[i]))
+        out = np.zeros((len(texts), self.get_sentence_embedding_dimension()), dtype=np.float32)
+        for s in range(0, len(order), batch_size):
+            idx = order[s:s + batch_size]
+            out[idx] = self._forward([texts[i] for i in idx])
+        if normalize_embeddings:
+            norms = np.linalg.norm(out, axis=1, keepdims=True)
+            out = out / np.maximum(norms, 1e-12)
+        return out
+
+    def get_sentence_embedding_dimension(self) -> int:
+        if self._dim is None:
+            self._dim = int(self._forward(["dim"]).shape[1])
+        return self._dim
+
+
+def load_embedder(model_name_or_path: str, backend: str = EMBED_BACKEND, device: str = None,
+                  threads: int = EMBED_THREADS):
+    """EMBED_BACKEND に応じたモデルを読み込む。戻り値は SentenceTransformer 互換の encode を持つ。"""
+    if backend not in BACKENDS:
+        raise ValueError(f"unknown EMBED_BACKEND={backend!r} (expected one of {', '.join(BACKENDS)})")
+    t0 = time.perf_counter()
+    if backend == "torch":
+        import torch
+        from sentence_transformers import SentenceTransformer
+
+        if threads:
+            torch.set_num_threads(threads)
+        print(f"[INFO] load model {model_name_or_path} (backend=torch, device={device or 'auto'})")
+        model = SentenceTransformer(model_name_or_path, device=device)
+    else:
+        print(f"[INFO] load model {model_name_or_path} (backend={backend}, threads={threads or 'auto'})")
+        model = OnnxEmbedder(model_name_or_path, int8=backend == "onnx-int8", threads=threads)
+    print(f"[INFO] model loaded in {time.perf_counter() - t0:.1f}s")
+    return model
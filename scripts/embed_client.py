@@ -0,0 +1,118 @@
+# phase2/scripts/embed_client.py
+"""
+常駐埋め込みサービス（embed_server.py）のクライアント。
+EMBED_SERVER_URL が設定されていて、同じモデル（EMBED_MODEL_NAME）で応答するサービスがあるときだけ使う。
+呼び出し側は EmbedServiceError を受けたらプロセス内のモデルにフォールバックする。
+
+  remote = get_embed_client("BAAI/bge-m3")
+  if remote is not None:
+      vecs = remote.encode(["query: ..."], normalize=True)
+
+サービスを --rerank-model 付きで起動していれば、再ランキングも依頼できる（get_rerank_client / rerank）。
+"""
+import os
+import time
+import base64
+import threading
+
+import numpy as np
+import requests
+
+EMBED_SERVER_URL = os.getenv("EMBED_SERVER_URL", "").rstrip("/")
+EMBED_SERVER_TIMEOUT = float(os.getenv("EMBED_SERVER_TIMEOUT", "120"))
+RECHECK_SECONDS = 30  # 使えなかったサービスを再確認する間隔
+
+
+class EmbedServiceError(Exception):
+    """埋め込みサービスに接続できない・エラーを返した。"""
+
+
+class EmbedClient:
+    def __init__(self, url: str = EMBED_SERVER_URL, timeout: float = EMBED_SERVER_TIMEOUT):
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+        self.session = requests.Session()
+
+    def health(self, timeout: float = 0.5) -> dict:
+        try:
+            r = self.session.get(f"{self.url}/healthz", timeout=timeout)
+            r.raise_for_status()
+            return r.json()
+        except (requests.RequestException, ValueError) as e:
+            raise EmbedServiceError(f"{self.url}: {e}") from e
+
+    def encode(self, texts, normalize: bool = True):
+        """texts のベクトルを list[list[float]] で返す（prefix は呼び出し側で付ける）。"""
+        if not texts:
+            return []
+        try:
+            r = self.session.post(
+                f"{self.url}/encode", json={"texts": list(texts), "normalize": normalize}, timeout=self.timeout
+            )
+            r.raise_for_status()
+            data = r.json()
+        except (requests.RequestException, ValueError) as e:
+            raise EmbedServiceError(f"{self.url}: {e}") from e
+        arr = np.frombuffer(base64.b64decode(data["vectors"]), dtype=np.float32)
+        return arr.reshape(data["count"], data["dim"]).tolist()
+
+    def rerank(self, query: str, texts):
+        """(query, text) の各ペアのクロスエンコーダのスコアを texts と同じ順で返す。"""
+        if not texts:
+            return []
+        try:
+            r = self.session.post(f"{self.url}/rerank", json={"query": query, "texts": list(texts)},
+                                  timeout=self.timeout)
+            r.raise_for_status()
+            return [float(x) for x in r.json()["scores"]]
+        except (requests.RequestException, ValueError, KeyError) as e:
+            raise EmbedServiceError(f"{self.url}: {e}") from e
+
+
+_lock = threading.Lock()
+_clients = {}     # (url, healthz の項目, モデル) -> EmbedClient
+_checked_at = {}  # (url, healthz の項目, モデル) -> 最後に使えないと判断した時刻
+
+
+def get_embed_client(model_id: str, url: str = EMBED_SERVER_URL):
+    """
+    使える埋め込みサービスがあれば EmbedClient を返し、無ければ None。
+    結果はプロセス内で覚えておき、使えなかった場合は RECHECK_SECONDS ごとに確認し直す。
+    """
+    return _get_client(url, "model_id", model_id)
+
+
+def get_rerank_client(model_name: str, url: str = EMBED_SERVER_URL):
+    """model_name のクロスエンコーダを読み込んだサービスがあれば EmbedClient を返し、無ければ None。"""
+    return _get_client(url, "rerank_model", model_name)
+
+
+def _get_client(url: str, field: str, model_id: str):
+    if not url:
+        return None
+    key = (url.rstrip("/"), field, model_id)
+    with _lock:
+        if key in _clients:
+            return _clients[key]
+        if key in _checked_at and time.monotonic() - _checked_at[key] < RECHECK_SECONDS:
+            return None
+        _checked_at[key] = time.monotonic()
+        client = EmbedClient(url)
+        try:
+            info = client.health()
+        except EmbedServiceError as e:
+            print(f"[INFO] embed service unavailable ({e}); not using it")
+            return None
+        if info.get(field) != model_id:
+            print(f"[WARN] embed service serves {field}={info.get(field)}, expected {model_id}; not using it")
+            return None
+        _clients[key] = client
+        return client
+
+
+def drop_embed_client(model_id: str, url: str = EMBED_SERVER_URL, field: str = "model_id"):
+    """encode / rerank が失敗したときに呼ぶ。RECHECK_SECONDS の間はサービスを使わない。"""
+    key = (url.rstrip("/"), field, model_id)
+    with _lock:
+        _clients.pop(key, None)
+        _checked_at[key] = time.monotonic()
@@ -0,0 +1,184 @@
+# phase2/scripts/embed_server.py
+"""
+bge-m3 を常駐させるローカル埋め込みサービス（localhost HTTP、標準ライブラリ + sentence-transformers）。
+search_weaviate.py / ingest / API サーバーは EMBED_SERVER_URL が設定されていればここに埋め込みを依頼し、
+応答が無ければ従来どおりプロセス内でモデルを読み込む（embed_client.py）。
+
+  python scripts/embed_server.py                       # 127.0.0.1:8089 で起動
+  EMBED_SERVER_URL=http://127.0.0.1:8089 python scripts/search_weaviate.py "SQL の実行方法"
+
+  POST /encode   {"texts": [...], "normalize": true}
+                 -> {"model_id", "count", "dim", "vectors": base64(float32, 行優先)}
+  POST /rerank   {"query": "...", "texts": [...]} -> {"model", "scores"}（--rerank-model を指定したときだけ）
+  GET  /healthz  -> {"model_id", "rerank_model", "device", "dim", "requests", "batches", "batch_size_hist", ...}
+
+同時に届いたリクエストは最大 EMBED_SERVER_MAX_WAIT_MS 待って、EMBED_SERVER_MAX_BATCH 件まで1回の encode にまとめる。
+--rerank-model を付けるとクロスエンコーダも読み込み、API サーバーの複数ワーカーが再ランキングを依頼できる
+（RERANK_SERVER_URL。モデルをワーカーごとに読み込まずに済む）。
+"""
+import os
+import json
+import time
+import base64
+import argparse
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import numpy as np
+from dotenv import load_dotenv
+
+from embed_backend import EMBED_BACKEND, load_embedder, embed_model_id
+from micro_batcher import MicroBatcher
+from reranker import Reranker
+
+ENV_PATH = os.path.join(os.path.dirname(__file__), "..", ".env")
+load_dotenv(dotenv_path=ENV_PATH)
+
+MODEL_PATH = os.getenv("MODEL_PATH")  # 例: ./phase2/models/bge-m3
+MODEL_NAME = os.getenv("EMBED_MODEL_NAME", "BAAI/bge-m3")
+EMBED_SERVER_HOST = os.getenv("EMBED_SERVER_HOST", "127.0.0.1")
+EMBED_SERVER_PORT = int(os.getenv("EMBED_SERVER_PORT", "8089"))
+EMBED_SERVER_MAX_BATCH = int(os.getenv("EMBED_SERVER_MAX_BATCH", "64"))
+EMBED_SERVER_MAX_WAIT_MS = float(os.getenv("EMBED_SERVER_MAX_WAIT_MS", "5"))
+EMBED_SERVER_ENCODE_BATCH = int(os.getenv("EMBED_SERVER_ENCODE_BATCH", "32"))
+EMBED_SERVER_RERANK_MODEL = os.getenv("EMBED_SERVER_RERANK_MODEL")  # 例: BAAI/bge-reranker-v2-m3
+
+# device 判定（CUDA が無ければ自動で CPU）
+try:
+    import torch  # noqa: F401
+    DEVICE = "cuda" if getattr(torch, "cuda", None) and torch.cuda.is_available() else "cpu"
+except Exception:
+    DEVICE = "cpu"
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"
+    disable_nagle_algorithm = True  # ヘッダーと本文の2回書き込みで keep-alive の応答が遅れないように
+
+    def log_message(self, fmt, *args):  # アクセスログは出さない
+        pass
+
+    def _send(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def do_GET(self):
+        if self.path.split("?")[0] != "/healthz":
+            return self._send(404, {"error": self.path})
+        self._send(200, self.server.info())
+
+    def do_POST(self):
+        path = self.path.split("?")[0]
+        if path == "/rerank" and self.server.rerank_batcher is not None:
+            return self._rerank()
+        if path != "/encode":
+            return self._send(404, {"error": self.path})
+        n = int(self.headers.get("Content-Length") or 0)
+        try:
+            body = json.loads(self.rfile.read(n) or b"{}")
+            texts = body["texts"]
+            if not isinstance(texts, list) or not all(isinstance(t, str) for t in texts):
+                raise ValueError("texts must be a list of strings")
+        except (ValueError, KeyError) as e:
+            return self._send(400, {"error": str(e)})
+        if not texts:
+            return self._send(200, {"model_id": self.server.model_id, "count": 0, "dim": self.server.dim, "vectors": ""})
+        try:
+            vecs = self.server.batcher.submit(texts, body.get("normalize", True)).result(timeout=300)
+        except Exception as e:
+            return self._send(500, {"error": f"{type(e).__name__}: {e}"})
+        arr = np.asarray(vecs, dtype=np.float32)
+        self._send(200, {
+            "model_id": self.server.model_id,
+            "count": int(arr.shape[0]),
+            "dim": int(arr.shape[1]),
+            "vectors": base64.b64encode(arr.tobytes()).decode("ascii"),
+        })
+
+    def _rerank(self):
+        n = int(self.headers.get("Content-Length") or 0)
+        try:
+            body = json.loads(self.rfile.read(n) or b"{}")
+            query, texts = body["query"], body["texts"]
+            if not isinstance(query, str) or not isinstance(texts, list) or not all(isinstance(t, str) for t in texts):
+                raise ValueError("query must be a string and texts a list of strings")
+        except (ValueError, KeyError) as e:
+            return self._send(400, {"error": str(e)})
+        try:
+            scores = self.server.rerank_batcher.submit([(query, t) for t in texts]).result(timeout=300) if texts else []
+        except Exception as e:
+            return self._send(500, {"error": f"{type(e).__name__}: {e}"})
+        self._send(200, {"model": self.server.rerank_model, "scores": [float(x) for x in scores]})
+
+
+class EmbedServer(ThreadingHTTPServer):
+    daemon_threads = True
+
+    def __init__(self, host=EMBED_SERVER_HOST, port=EMBED_SERVER_PORT, max_batch=EMBED_SERVER_MAX_BATCH,
+                 max_wait_ms=EMBED_SERVER_MAX_WAIT_MS, rerank_model=EMBED_SERVER_RERANK_MODEL):
+        t0 = time.perf_counter()
+        self.model = load_embedder(MODEL_PATH or MODEL_NAME, device=DEVICE)
+        self.model_id = embed_model_id(MODEL_NAME)
+        self.dim = self.model.get_sentence_embedding_dimension()
+        self.encode(["warmup"], True)
+        self.load_seconds = time.perf_counter() - t0
+        print(f"[INFO] model ready in {self.load_seconds:.1f}s (dim={self.dim})")
+
+        self.batcher = MicroBatcher(self.encode, max_batch, max_wait_ms)
+        # 再ランキングも (質問, 本文) のペアをリクエストをまたいで1回の predict にまとめる
+        self.rerank_model = rerank_model or None
+        self.rerank_batcher = None
+        if self.rerank_model:
+            cross = Reranker(self.rerank_model).get_model()
+            cross.predict([("warmup", "warmup")], show_progress_bar=False)
+            self.rerank_batcher = MicroBatcher(
+                lambda pairs, _normalize: cross.predict(pairs, batch_size=len(pairs), show_progress_bar=False),
+                max_batch, max_wait_ms, name="rerank-batcher",
+            )
+        self.started_at = time.time()
+        super().__init__((host, port), _Handler)
+
+    def encode(self, texts, normalize):
+        return self.model.encode(
+            texts, batch_size=EMBED_SERVER_ENCODE_BATCH, normalize_embeddings=normalize, convert_to_numpy=True
+        )
+
+    def info(self) -> dict:
+        return {
+            "model_id": self.model_id,
+            "rerank_model": self.rerank_model,
+            "device": DEVICE,
+            "backend": EMBED_BACKEND,
+            "dim": self.dim,
+            "load_seconds": round(self.load_seconds, 2),
+            "uptime_seconds": round(time.time() - self.started_at, 1),
+            **self.batcher.stats(),
+            "rerank": self.rerank_batcher.stats() if self.rerank_batcher is not None else None,
+        }
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Local bge-m3 embedding service with micro-batching")
+    ap.add_argument("--host", default=EMBED_SERVER_HOST)
+    ap.add_argument("--port", type=int, default=EMBED_SERVER_PORT)
+    ap.add_argument("--max-batch", type=int, default=EMBED_SERVER_MAX_BATCH, help="1回の encode にまとめる最大件数")
+    ap.add_argument("--max-wait-ms", type=float, default=EMBED_SERVER_MAX_WAIT_MS, help="まとめるために待つ最大時間")
+    ap.add_argument("--rerank-model", default=EMBED_SERVER_RERANK_MODEL,
+                    help="クロスエンコーダも読み込んで POST /rerank を受ける（例: BAAI/bge-reranker-v2-m3）")
+    args = ap.parse_args()
+
+    server = EmbedServer(args.host, args.port, args.max_batch, args.max_wait_ms, args.rerank_model)
+    print(f"[INFO] embed server listening on http://{args.host}:{server.server_address[1]}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,218 @@
+# phase2/scripts/embedding_cache.py
+"""
+コンテンツアドレスの埋め込みキャッシュ（ingest / search / API サーバー共通）。
+
+- キー: sha256(model id, prefix, 正規化フラグ, 正規化済みテキスト)
+- ベクトル: memmap した float16/float32 行列（vectors.f16 / vectors.f32）
+- インデックス: SQLite（key -> 行番号, 最終利用時刻）
+- 件数上限を超えたら最終利用が古い行から再利用（LRU）
+
+複数プロセスから同じディレクトリを使ってよい。行の割り当ては SQLite の
+トランザクション内で行い、ベクトルを書き終えてからインデックスを commit する。
+"""
+import os
+import re
+import time
+import sqlite3
+import hashlib
+import threading
+import unicodedata
+
+import numpy as np
+
+DEFAULT_DIR = os.path.join(os.path.dirname(__file__), "..", "data", "embed_cache")
+
+EMBED_CACHE_ENABLED = os.getenv("EMBED_CACHE", "1") not in ("0", "false", "False")
+EMBED_CACHE_DIR = os.getenv("EMBED_CACHE_DIR", DEFAULT_DIR)
+EMBED_CACHE_MAX = int(os.getenv("EMBED_CACHE_MAX", "200000"))
+EMBED_CACHE_DTYPE = os.getenv("EMBED_CACHE_DTYPE", "float16")
+
+_INITIAL_ROWS = 1024
+_SQL_CHUNK = 500
+
+
+def normalize_text(text: str) -> str:
+    text = unicodedata.normalize("NFKC", text or "")
+    return re.sub(r"\s+", " ", text).strip()
+
+
+def cache_key(model_id: str, prefix: str, text: str, normalize: bool = True) -> str:
+    raw = "\0".join([model_id, prefix, "norm" if normalize else "raw", normalize_text(text)])
+    return hashlib.sha256(raw.encode("utf-8")).hexdigest()
+
+
+class EmbeddingCache:
+    def __init__(self, path: str = EMBED_CACHE_DIR, dim: int = 1024, dtype: str = EMBED_CACHE_DTYPE,
+                 max_entries: int = EMBED_CACHE_MAX):
+        os.makedirs(path, exist_ok=True)
+        self.dim = dim
+        self.dtype = np.dtype(dtype)
+        self.max_entries = max_entries
+        self.vec_path = os.path.join(path, f"vectors.{'f16' if self.dtype == np.float16 else 'f32'}")
+        self.conn = sqlite3.connect(os.path.join(path, "index.sqlite"), timeout=30, check_same_thread=False)
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS entries (key TEXT PRIMARY KEY, row INTEGER UNIQUE, last_used REAL)"
+        )
+        self.conn.execute("CREATE INDEX IF NOT EXISTS entries_last_used ON entries(last_used)")
+        self.conn.commit()
+        self._lock = threading.Lock()
+        self._mm = None
+        self._rows = 0
+        if not os.path.exists(self.vec_path):
+            open(self.vec_path, "wb").close()
+        self._remap()
+
+        self.hits = 0
+        self.misses = 0
+        self.encode_seconds = 0.0
+
+    # ---- memmap ----
+    def _remap(self, need_rows: int = 0):
+        row_bytes = self.dim * self.dtype.itemsize
+        size = os.path.getsize(self.vec_path)
+        if need_rows * row_bytes > size:
+            rows = max(_INITIAL_ROWS, size // row_bytes)
+            while rows < need_rows:
+                rows *= 2
+            with open(self.vec_path, "r+b") as f:
+                f.truncate(min(rows, max(self.max_entries, need_rows)) * row_bytes)
+            size = os.path.getsize(self.vec_path)
+        if self._mm is not None:
+            self._mm.flush()
+            self._mm = None
+        self._rows = size // row_bytes
+        if self._rows:
+            self._mm = np.memmap(self.vec_path, dtype=self.dtype, mode="r+", shape=(self._rows, self.dim))
+
+    # ---- lookup / store ----
+    def get_many(self, keys):
+        """keys に対応するベクトル（float32 の ndarray）か None のリストを返す。"""
+        found = {}
+        with self._lock:
+            for i in range(0, len(keys), _SQL_CHUNK):
+                part = keys[i:i + _SQL_CHUNK]
+                q = f"SELECT key, row FROM entries WHERE key IN ({','.join('?' for _ in part)})"
+                found.update(self.conn.execute(q, part).fetchall())
+            if found and max(found.values()) >= self._rows:
+                self._remap()
+            out = [
+                np.asarray(self._mm[found[k]], dtype=np.float32) if k in found else None
+                for k in keys
+            ]
+            if found:
+                now = time.time()
+                self.conn.executemany(
+                    "UPDATE entries SET last_used = ? WHERE key = ?", [(now, k) for k in found]
+                )
+                self.conn.commit()
+        return out
+
+    def put_many(self, keys, vectors):
+        if not keys:
+            return
+        vectors = np.asarray(vectors, dtype=np.float32)
+        if vectors.shape[1] != self.dim:
+            raise ValueError(f"unexpected embedding dim: {vectors.shape[1]} (expected {self.dim})")
+        with self._lock:
+            cur = self.conn.cursor()
+            cur.execute("BEGIN IMMEDIATE")
+            try:
+                # 他プロセスが先に入れたキーは書かない
+                new = {}
+                for k, v in zip(keys, vectors):
+                    new.setdefault(k, v)
+                for i in range(0, len(keys), _SQL_CHUNK):
+                    part = keys[i:i + _SQL_CHUNK]
+                    q = f"SELECT key FROM entries WHERE key IN ({','.join('?' for _ in part)})"
+                    for (k,) in cur.execute(q, part).fetchall():
+                        new.pop(k, None)
+                new = list(new.items())[-self.max_entries:]
+                if not new:
+                    cur.execute("COMMIT")
+                    return
+
+                count, max_row = cur.execute("SELECT COUNT(*), MAX(row) FROM entries").fetchone()
+                next_row = -1 if max_row is None else max_row
+                overflow = count + len(new) - self.max_entries
+                rows = []
+                if overflow > 0:
+                    victims = cur.execute(
+                        "SELECT key, row FROM entries ORDER BY last_used LIMIT ?", (overflow,)
+                    ).fetchall()
+                    cur.executemany("DELETE FROM entries WHERE key = ?", [(k,) for k, _ in victims])
+                    rows = [r for _, r in victims]
+                while len(rows) < len(new):
+                    next_row += 1
+                    rows.append(next_row)
+
+                if max(rows) >= self._rows:
+                    self._remap(max(rows) + 1)
+                for r, (_, v) in zip(rows, new):
+                    self._mm[r] = v
+                self._mm.flush()
+
+                now = time.time()
+                cur.executemany(
+                    "INSERT INTO entries (key, row, last_used) VALUES (?, ?, ?)",
+                    [(k, r, now) for r, (k, _) in zip(rows, new)],
+                )
+                cur.execute("COMMIT")
+            except Exception:
+                cur.execute("ROLLBACK")
+                raise
+
+    # ---- encode helper ----
+    def encode(self, texts, encode_fn, model_id: str, prefix: str = "", normalize: bool = True):
+        """
+        キャッシュを引いてから、無かったものだけ encode_fn でまとめて計算する。
+        encode_fn は prefix 付きテキストのリストを受け取り 2次元配列を返すこと。
+        """
+        texts = list(texts)
+        keys = [cache_key(model_id, prefix, t, normalize) for t in texts]
+        cached = self.get_many(keys)
+        miss_idx = [i for i, v in enumerate(cached) if v is None]
+        self.hits += len(texts) - len(miss_idx)
+        self.misses += len(miss_idx)
+        if miss_idx:
+            t0 = time.perf_counter()
+            fresh = np.asarray(encode_fn([f"{prefix}{texts[i]}" for i in miss_idx]), dtype=np.float32)
+            self.encode_seconds += time.perf_counter() - t0
+            self.put_many([keys[i] for i in miss_idx], fresh)
+            for i, v in zip(miss_idx, fresh):
+                cached[i] = v
+        return [v.tolist() for v in cached]
+
+    def stats(self) -> dict:
+        total = self.hits + self.misses
+        per_text = self.encode_seconds / self.misses if self.misses else 0.0
+        entries = self.conn.execute("SELECT COUNT(*) FROM entries").fetchone()[0]
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": round(self.hits / total, 4) if total else 0.0,
+            "encode_seconds": round(self.encode_seconds, 3),
+            "est_saved_seconds": round(per_text * self.hits, 3),
+            "entries": entries,
+            "max_entries": self.max_entries,
+        }
+
+    def close(self):
+        with self._lock:
+            if self._mm is not None:
+                self._mm.flush()
+                self._mm = None
+            self.conn.close()
+
+
+_cache = None
+
+
+def get_cache(dim: int = 1024):
+    """プロセス共通のキャッシュ（EMBED_CACHE=0 なら None）。"""
+    global _cache
+    if not EMBED_CACHE_ENABLED:
+        return None
+    if _cache is None:
+        _cache = EmbeddingCache(dim=dim)
+    return _cache
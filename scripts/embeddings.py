@@ -0,0 +1,148 @@
+# phase2/scripts/embeddings.py
+"""
+bge-m3 の埋め込み（ingest / search_weaviate.py / API サーバー共通）。
+
+- prefix: 質問は "query: "、チャンク本文は "passage: " を付けて埋め込む（登録済みベクトルと同じ規約）
+- 正規化: 常に L2 正規化する
+- 埋め込み元: 常駐の埋め込みサービス（EMBED_SERVER_URL）→ 無ければプロセス内のモデル（EMBED_BACKEND）
+- キャッシュ: 埋め込みキャッシュ（EMBED_CACHE）を prefix 込みのキーで引く
+- 次元: EMBED_DIM（1024）と違えば EmbeddingDimError
+- 次元削減: コレクションに設定があれば（vector_reduction.py）最後に truncate / PCA をかける
+
+  from embeddings import get_embedder
+  emb = get_embedder()
+  q = emb.embed_query("SQL の実行方法")
+  vecs = emb.embed_passages(["本文1", "本文2"])
+"""
+import os
+import threading
+
+from dotenv import load_dotenv
+
+# MODEL_PATH / EMBED_BACKEND などを読む前に .env を反映する（呼び出し側の import 順に依存しないように）
+load_dotenv(dotenv_path=os.path.join(os.path.dirname(__file__), "..", ".env"))
+
+from embed_backend import load_embedder, embed_model_id  # noqa: E402
+from embed_client import get_embed_client, drop_embed_client, EmbedServiceError  # noqa: E402
+from embedding_cache import get_cache  # noqa: E402
+from vector_reduction import load_reducer  # noqa: E402
+from collection_alias import resolve_alias  # noqa: E402
+
+MODEL_PATH = os.getenv("MODEL_PATH")  # 例: ./phase2/models/bge-m3
+MODEL_NAME = os.getenv("EMBED_MODEL_NAME", "BAAI/bge-m3")
+CLASS_NAME = os.getenv("WEAVIATE_CLASS", "ConfluenceChunk")  # エイリアス（collection_alias.py）
+EMBED_DIM = 1024
+EMBED_BATCH_SIZE = int(os.getenv("EMBED_BATCH_SIZE", "16"))  # プロセス内モデルの encode バッチサイズ
+
+QUERY_PREFIX = "query: "
+PASSAGE_PREFIX = "passage: "  # 変えたら全ページの再 ingest が必要
+
+# device 判定（CUDA が無ければ自動で CPU）
+try:
+    import torch  # noqa: F401
+    DEVICE = "cuda" if getattr(torch, "cuda", None) and torch.cuda.is_available() else "cpu"
+except Exception:
+    DEVICE = "cpu"
+
+
+class EmbeddingDimError(RuntimeError):
+    """モデルの出力次元が Weaviate のスキーマ（EMBED_DIM）と合わない。"""
+
+
+def check_dim(vectors, dim: int = EMBED_DIM):
+    for v in vectors:
+        if len(v) != dim:
+            raise EmbeddingDimError(f"unexpected embedding dim: {len(v)} (expected {dim})")
+    return vectors
+
+
+class Embedder:
+    def __init__(self, model_name: str = MODEL_NAME, model_path: str = MODEL_PATH, dim: int = EMBED_DIM,
+                 batch_size: int = EMBED_BATCH_SIZE, use_cache: bool = True, class_name: str = CLASS_NAME):
+        self.model_name = model_name
+        self.model_path = model_path
+        self.model_id = embed_model_id(model_name)  # キャッシュと埋め込みサービスで使う ID
+        self.dim = dim
+        self.batch_size = batch_size
+        self.cache = get_cache(dim) if use_cache else None
+        self.class_name = class_name
+        self._reducers = {}  # 実コレクション名 -> VectorReducer / None
+        self.source = None  # 直近の encode に使ったもの（service / local）
+        self._model = None
+        self._lock = threading.Lock()
+
+    def get_model(self):
+        with self._lock:
+            if self._model is None:
+                self._model = load_embedder(self.model_path or self.model_name, device=DEVICE)
+            return self._model
+
+    def preload(self):
+        """埋め込みサービスが使えなければプロセス内のモデルを今読み込む（サーバー起動時用）。"""
+        if get_embed_client(self.model_id) is None:
+            self.get_model()
+
+    def encode(self, texts):
+        """prefix 付きのテキストを正規化済みベクトル list[list[float]] にする（キャッシュは通らない）。"""
+        texts = list(texts)
+        if not texts:
+            return []
+        remote = get_embed_client(self.model_id)
+        if remote is not None:
+            try:
+                vecs = remote.encode(texts, normalize=True)
+                self.source = "service"
+                return check_dim(vecs, self.dim)
+            except EmbedServiceError as e:
+                print(f"[WARN] embed service failed ({e}); falling back to in-process model")
+                drop_embed_client(self.model_id)
+        vecs = self.get_model().encode(
+            texts, batch_size=self.batch_size, normalize_embeddings=True, show_progress_bar=False
+        ).tolist()
+        self.source = "local"
+        return check_dim(vecs, self.dim)
+
+    @property
+    def reducer(self):
+        """エイリアスの現在の向き先に保存されているベクトルの次元削減（無ければ None）。"""
+        name = resolve_alias(self.class_name)
+        if name not in self._reducers:
+            self._reducers[name] = load_reducer(name)
+        return self._reducers[name]
+
+    @property
+    def output_dim(self) -> int:
+        """Weaviate に保存・検索するベクトルの次元。"""
+        reducer = self.reducer
+        return reducer.dim if reducer is not None else self.dim
+
+    def _embed(self, texts, prefix: str):
+        if self.cache is not None:
+            # キャッシュに全部当たればモデルの読み込み自体を省略できる
+            vecs = self.cache.encode(texts, self.encode, self.model_id, prefix=prefix)
+        else:
+            vecs = self.encode([f"{prefix}{t}" for t in texts])
+        reducer = self.reducer
+        return reducer.apply(vecs) if reducer is not None else vecs
+
+    def embed_queries(self, texts):
+        return self._embed(texts, QUERY_PREFIX)
+
+    def embed_query(self, text: str):
+        return self.embed_queries([text])[0]
+
+    def embed_passages(self, texts):
+        return self._embed(texts, PASSAGE_PREFIX)
+
+
+_embedder = None
+_embedder_lock = threading.Lock()
+
+
+def get_embedder() -> Embedder:
+    """プロセス共通の Embedder。"""
+    global _embedder
+    with _embedder_lock:
+        if _embedder is None:
+            _embedder = Embedder()
+        return _embedder
@@ -1,12 +1,28 @@
 # phase2/scripts/ingest_confluence_bge.py
 import os
-import re
 import time
 import uuid
+import queue
+import hashlib
+import argparse
+import threading
+import multiprocessing
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor
+from contextlib import contextmanager
+from datetime import datetime, timedelta
+from email.utils import parsedate_to_datetime
+
 import requests
-from bs4 import BeautifulSoup
+import weaviate
 from dotenv import load_dotenv
-from sentence_transformers import SentenceTransformer
+from requests.adapters import HTTPAdapter
+from weaviate.classes.query import Filter
+from weaviate.connect import ConnectionParams
+
+from chunker import split_page, CHUNKER_VERSION, CHUNK_MAX_TOKENS, CHUNK_MIN_TOKENS, CHARS_PER_CHUNK, CHUNK_OVERLAP
+from collection_alias import resolve_alias
+from embeddings import get_embedder
+from ingest_manifest import IngestManifest, DEFAULT_PATH as DEFAULT_MANIFEST_PATH, utcnow
 
 # ==== ENV ====
 ENV_PATH = os.path.join(os.path.dirname(__file__), "..", ".env")
@@ -16,34 +32,104 @@ CONF_BASE_URL = os.environ["CONF_BASE_URL"].rstrip("/")
 CONF_EMAIL = os.environ["CONF_EMAIL"]
 CONF_API_TOKEN = os.environ["CONF_API_TOKEN"]
 CONF_PAGE_IDS = [x.strip() for x in os.environ.get("CONF_PAGE_IDS", "").split(",") if x.strip()]
+# ページの自動検出（指定があれば CONF_PAGE_IDS の代わりに CQL 検索で対象ページを列挙）
+CONF_SPACE_KEYS = [x.strip() for x in os.environ.get("CONF_SPACE_KEYS", "").split(",") if x.strip()]
+CONF_CQL = os.environ.get("CONF_CQL", "")
+CONF_SINCE = os.environ.get("CONF_SINCE", "auto")  # auto = 前回 ingest 以降に更新されたページのみ / none = 全件
+DISCOVERY_PAGE_SIZE = int(os.environ.get("DISCOVERY_PAGE_SIZE", "100"))
 
 WEAVIATE_URL = os.environ["WEAVIATE_URL"].rstrip("/")
 WEAVIATE_API_KEY = os.environ.get("WEAVIATE_API_KEY") or None
-CLASS_NAME = os.environ.get("WEAVIATE_CLASS", "ConfluenceChunk")
+CLASS_NAME = os.environ.get("WEAVIATE_CLASS", "ConfluenceChunk")  # エイリアス（書き込み先は target_class()）
+WEAVIATE_GRPC_PORT = int(os.environ.get("WEAVIATE_GRPC_PORT", "50051"))
 
 MODEL_PATH = os.environ.get("MODEL_PATH")  # 例: ./phase2/models/bge-m3
 MODEL_NAME = os.environ.get("EMBED_MODEL_NAME", "BAAI/bge-m3")
 
 # ==== PARAMS ====
-CHARS_PER_CHUNK = 1200
-CHUNK_OVERLAP = 200
-BATCH_SIZE = 16
+# structure = 見出し・コード・表を考慮してトークン数で分割（chunker.py） / chars = 旧来の 1200 文字 + 200 重なり
+CHUNKER = os.environ.get("CHUNKER", "structure")
+
+# パイプライン: 取得（スレッド並列）→ パース・分割（プロセスプール）→ 埋め込み（1本）→ 書き込み（1本）
+FETCH_CONCURRENCY = int(os.environ.get("FETCH_CONCURRENCY", "4"))
+CONF_RATE_LIMIT = float(os.environ.get("CONF_RATE_LIMIT", "8"))  # Confluence への最大リクエスト数/秒（0 = 無制限）
+PARSE_WORKERS = int(os.environ.get("PARSE_WORKERS", str(min(4, os.cpu_count() or 1))))
+PIPELINE_QUEUE = int(os.environ.get("PIPELINE_QUEUE", "16"))  # 段間キューの最大ページ数
+EMBED_BATCH_CHUNKS = int(os.environ.get("EMBED_BATCH_CHUNKS", "64"))  # 複数ページをまとめて埋め込むチャンク数
 
-# device 判定（CUDA が無ければ自動で CPU）
-try:
-    import torch  # noqa: F401
-    DEVICE = "cuda" if getattr(torch, "cuda", None) and torch.cuda.is_available() else "cpu"
-except Exception:
-    DEVICE = "cpu"
+# Weaviate 書き込み: batch = v4 クライアントの batch API(gRPC) / rest = 旧来の1件ずつ DELETE+POST
+INGEST_MODE = os.environ.get("INGEST_MODE", "batch")
+UPSERT_BATCH_SIZE = int(os.environ.get("UPSERT_BATCH_SIZE", "100"))
+UPSERT_CONCURRENCY = int(os.environ.get("UPSERT_CONCURRENCY", "2"))
 
+# インクリメンタル ingest 用マニフェスト（pageId -> version / hash / チャンク数）
+INGEST_MANIFEST = os.environ.get("INGEST_MANIFEST", DEFAULT_MANIFEST_PATH)
 
 # ==== HTTP with retry ====
+class RateLimiter:
+    """
+    全スレッド共通のリクエスト間隔制御。
+    429 を受けたら Retry-After の間（無ければ指数バックオフ）は全スレッドの送信を止める。
+    """
+
+    def __init__(self, rate: float):
+        self.interval = 1.0 / rate if rate > 0 else 0.0
+        self._lock = threading.Lock()
+        self._next = 0.0
+        self.throttled = 0
+
+    def wait(self):
+        with self._lock:
+            now = time.monotonic()
+            at = max(now, self._next)
+            self._next = at + self.interval
+        if at > now:
+            time.sleep(at - now)
+
+    def pause(self, seconds: float):
+        with self._lock:
+            self.throttled += 1
+            self._next = max(self._next, time.monotonic() + seconds)
+
+
+def retry_after_seconds(r):
+    value = r.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(float(value), 0.0)
+    except ValueError:
+        pass
+    try:
+        return max(parsedate_to_datetime(value).timestamp() - time.time(), 0.0)
+    except (TypeError, ValueError):
+        return None
+
+
+def make_session(pool_size: int) -> requests.Session:
+    """keep-alive の接続をスレッド間で使い回すセッション。"""
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=pool_size, pool_maxsize=pool_size)
+    session.mount("https://", adapter)
+    session.mount("http://", adapter)
+    return session
+
+
+conf_session = make_session(FETCH_CONCURRENCY)
+conf_rate = RateLimiter(CONF_RATE_LIMIT)
+
+
 def req_retry(method, url, **kwargs):
     backoff = 1.0
     for _ in range(6):
-        r = requests.request(method, url, timeout=60, **kwargs)
+        conf_rate.wait()
+        r = conf_session.request(method, url, timeout=60, **kwargs)
         if r.status_code in (429, 502, 503, 504):
-            time.sleep(backoff)
+            wait = retry_after_seconds(r) or backoff
+            if r.status_code == 429:
+                conf_rate.pause(wait)  # 他のスレッドも止める
+            else:
+                time.sleep(wait)
             backoff = min(backoff * 2, 16)
             continue
         if r.status_code >= 400:
@@ -71,83 +157,111 @@ def get_page(page_id: str):
     return r.json()
 
 
-def storage_html_to_text(storage_html: str) -> str:
-    """
-    Confluence storage(XHTML) -> プレーンテキスト。
-    コードブロックの <ac:plain-text-body><![CDATA[...]]></ac:plain-text-body> を
-    事前に <pre>...</pre> に置換してからパース。
-    """
-    html = storage_html or ""
-
-    # CDATA のコード部分を <pre> に展開
-    html = re.sub(
-        r"<ac:plain-text-body><!\[CDATA\[(.*?)\]\]></ac:plain-text-body>",
-        lambda m: f"<pre>{m.group(1)}</pre>",
-        html,
-        flags=re.S,
+def get_page_version(page_id: str) -> dict:
+    """本文なしで version だけ取得（変更有無の判定用）。"""
+    url = f"{CONF_BASE_URL}/rest/api/content/{page_id}"
+    r = req_retry(
+        "GET",
+        url,
+        auth=(CONF_EMAIL, CONF_API_TOKEN),
+        headers={"Accept": "application/json"},
+        params={"expand": "version"},
     )
+    return r.json().get("version", {}) or {}
+
 
-    soup = BeautifulSoup(html, "html5lib")
-    text = soup.get_text("\n")
-    text = re.sub(r"\n{3,}", "\n\n", text).strip()
-    return text
+# ==== Page discovery (CQL) ====
+def build_cql(space_keys=None, cql: str = "", since: str = None) -> str:
+    parts = [f"({cql})"] if cql else ["type in (page, blogpost)"]
+    if space_keys:
+        parts.append("space in (" + ", ".join(f'"{k}"' for k in space_keys) + ")")
+    if since:
+        parts.append(f'lastModified >= "{since}"')
+    return " AND ".join(parts)
 
 
-# ==== Chunking ====
-def chunk_text(txt: str, size=CHARS_PER_CHUNK, overlap=CHUNK_OVERLAP):
-    txt = (txt or "").strip()
-    if not txt:
-        return []
-    out, i, n = [], 0, len(txt)
-    while i < n:
-        j = min(n, i + size)
-        out.append(txt[i:j])
-        if j == n:
-            break
-        i = max(j - overlap, 0)
-    return out
+def discover_pages(cql: str, limit: int = DISCOVERY_PAGE_SIZE):
+    """
+    CQL に一致するページを {"id", "version"} として1件ずつ返すジェネレーター。
+    content/search の cursor ページング（_links.next）を辿るので、件数が多くてもメモリは一定。
+    version が分かっているので、変更の無いページは version 取得の API 呼び出しも省ける。
+    """
+    url = f"{CONF_BASE_URL}/rest/api/content/search"
+    params = {"cql": cql, "limit": limit, "expand": "version"}
+    while url:
+        r = req_retry(
+            "GET",
+            url,
+            auth=(CONF_EMAIL, CONF_API_TOKEN),
+            headers={"Accept": "application/json"},
+            params=params,
+        )
+        data = r.json()
+        for item in data.get("results") or []:
+            if item.get("type", "page") not in ("page", "blogpost"):
+                continue
+            yield {"id": str(item["id"]), "version": (item.get("version") or {}).get("number")}
+        links = data.get("_links") or {}
+        nxt = links.get("next")
+        url = f"{links.get('base') or CONF_BASE_URL}{nxt}" if nxt else None
+        params = None  # next の URL に cql と cursor が含まれる
+
+
+def resolve_since(since: str, manifest) -> str:
+    """
+    --since の値を CQL の日付（YYYY-MM-DD）にする。auto は書き込みエラーの無かった最後の run の開始日の前日
+    （タイムゾーン差の余裕）。エラーのあった run を基準にすると、書けなかったページが次の範囲から外れて取り残される。
+    """
+    if not since or since == "none":
+        return None
+    if since != "auto":
+        return since
+    last = manifest.last_run(clean=True)
+    if not last:
+        return None
+    started = datetime.fromisoformat(last["started_at"])
+    return (started - timedelta(days=1)).strftime("%Y-%m-%d")
+
+
+# ==== Chunking（chunker.py） ====
+def chunker_id() -> str:
+    """分割方式と設定。マニフェストに記録し、変わったら本文が同じでも再分割する。"""
+    if CHUNKER == "chars":
+        return f"chars:{CHARS_PER_CHUNK}:{CHUNK_OVERLAP}"
+    return f"{CHUNKER_VERSION}:{CHUNK_MAX_TOKENS}:{CHUNK_MIN_TOKENS}"
+
+
+# ==== Embedding (bge-m3 dense only, embeddings.py) ====
+def embed_dense_passages(passages):
+    # prefix・正規化・次元チェック・埋め込みサービス / キャッシュの利用は embeddings.py に任せる
+    return get_embedder().embed_passages(passages)
 
 
-# ==== Embedding (bge-m3 dense only) ====
-_model = None
+# ==== Weaviate upsert (v1系用) ====
+weaviate_session = make_session(2)
 
 
-def get_model():
-    global _model
-    if _model is None:
-        path = MODEL_PATH if MODEL_PATH else MODEL_NAME
-        print(f"[INFO] load model {path} (device={DEVICE})")
-        _model = SentenceTransformer(path, device=DEVICE)
-    return _model
+def weaviate_headers():
+    headers = {"Content-Type": "application/json"}
+    if WEAVIATE_API_KEY:
+        headers["Authorization"] = f"Bearer {WEAVIATE_API_KEY}"
+    return headers
 
 
-def embed_dense_passages(passages):
-    m = get_model()
-    out, buf = [], []
-    for t in passages:
-        buf.append(f"passage: {t}")
-        if len(buf) == BATCH_SIZE:
-            vec = m.encode(buf, normalize_embeddings=True).tolist()
-            out.extend(vec)
-            buf = []
-    if buf:
-        vec = m.encode(buf, normalize_embeddings=True).tolist()
-        out.extend(vec)
-    return out
+def target_class() -> str:
+    """書き込み先の実コレクション（create_confluence_chunk_class.py --migrate で切り替わる）。"""
+    return resolve_alias(CLASS_NAME)
 
 
-# ==== Weaviate upsert (v1系用) ====
 def upsert_chunk(obj_id: str, props: dict, vec):
-    headers = {"Content-Type": "application/json"}
-    if WEAVIATE_API_KEY:
-        headers["Authorization"] = f"Bearer {WEAVIATE_API_KEY}"
+    headers = weaviate_headers()
 
     # まず古いのを削除（存在しなくても無視）
     try:
-        requests.delete(
+        weaviate_session.delete(
             f"{WEAVIATE_URL}/v1/objects/{obj_id}",
             headers=headers,
-            params={"class": CLASS_NAME},
+            params={"class": target_class()},
             timeout=20,
         )
     except Exception:
@@ -156,61 +270,597 @@ def upsert_chunk(obj_id: str, props: dict, vec):
     # 新規作成 (v1系は vector フィールドのみ)
     create = {
         "id": obj_id,
-        "class": CLASS_NAME,
+        "class": target_class(),
         "properties": props,
         "vector": vec,
     }
-    r = requests.post(f"{WEAVIATE_URL}/v1/objects", headers=headers, json=create, timeout=60)
+    r = weaviate_session.post(f"{WEAVIATE_URL}/v1/objects", headers=headers, json=create, timeout=60)
 
     if r.status_code >= 400:
         print(f"[ERR] upsert failed {r.status_code}: {r.text[:800]}")
         r.raise_for_status()
 
 
+def delete_stale_chunks_rest(page_id: str, keep: int) -> int:
+    """REST の batch delete で pageId のチャンクのうち chunkIndex >= keep を1回で削除。"""
+    where = {
+        "operator": "And",
+        "operands": [
+            {"path": ["pageId"], "operator": "Equal", "valueText": page_id},
+            {"path": ["chunkIndex"], "operator": "GreaterThanEqual", "valueInt": keep},
+        ],
+    }
+    r = weaviate_session.delete(
+        f"{WEAVIATE_URL}/v1/batch/objects",
+        headers=weaviate_headers(),
+        json={"match": {"class": target_class(), "where": where}},
+        timeout=60,
+    )
+    if r.status_code >= 400:
+        print(f"[ERR] stale delete failed {r.status_code}: {r.text[:800]}")
+        r.raise_for_status()
+    return int((r.json().get("results") or {}).get("successful") or 0)
+
+
 def deterministic_uuid(page_id: str, idx: int) -> str:
     ns = uuid.uuid5(uuid.NAMESPACE_URL, f"confluence:{page_id}")
     return str(uuid.uuid5(ns, f"chunk:{idx}"))
 
 
+# ==== Writers ====
+class RestWriter:
+    """旧来の書き込み方式。チャンクごとに DELETE + POST（2往復/チャンク）。"""
+
+    def __init__(self):
+        self.written = 0
+        self.errors = 0
+        self.stale_deleted = 0
+
+    def write_page(self, page_id: str, objects, on_done=None, on_failed=None):
+        # 書き込みの失敗は例外で止まるので on_failed は呼ばない（BatchWriter と同じ引数にしておく）
+        for obj_id, props, vec in objects:
+            upsert_chunk(obj_id, props, vec)
+            self.written += 1
+        self.stale_deleted += delete_stale_chunks_rest(page_id, len(objects))
+        if on_done:
+            on_done()
+
+    def delete_page(self, page_id: str) -> int:
+        n = delete_stale_chunks_rest(page_id, 0)
+        self.stale_deleted += n
+        return n
+
+    def flush(self):
+        pass
+
+    def close(self):
+        pass
+
+
+def connect_weaviate():
+    auth = weaviate.auth.AuthApiKey(WEAVIATE_API_KEY) if WEAVIATE_API_KEY else None
+    client = weaviate.WeaviateClient(
+        connection_params=ConnectionParams.from_url(WEAVIATE_URL, grpc_port=WEAVIATE_GRPC_PORT),
+        auth_client_secret=auth,
+    )
+    client.connect()
+    return client
+
+
+class BatchWriter:
+    """
+    v4 クライアントの batch API でまとめて書き込む。
+    - 複数ページ分のチャンクをバッファし、batch_size 件以上たまったら送信
+    - 同じ UUID は上書きされるので事前 DELETE は不要
+    - 送信後、チャンク数が減ったページの残骸を pageId フィルタで一括削除
+    """
+
+    def __init__(self, batch_size=UPSERT_BATCH_SIZE, concurrency=UPSERT_CONCURRENCY):
+        self.batch_size = batch_size
+        self.concurrency = concurrency
+        self.client = connect_weaviate()
+        self.pending = []  # [(page_id, objects, on_done, on_failed)]
+        self.pending_count = 0
+        self.written = 0
+        self.errors = 0
+        self.stale_deleted = 0
+
+    @property
+    def coll(self):
+        return self.client.collections.get(target_class())
+
+    def write_page(self, page_id: str, objects, on_done=None, on_failed=None):
+        """on_done はページの全チャンクが書けたとき、on_failed は1件でも失敗したときに flush の中で呼ぶ。"""
+        self.pending.append((page_id, objects, on_done, on_failed))
+        self.pending_count += len(objects)
+        if self.pending_count >= self.batch_size:
+            self.flush()
+
+    def delete_page(self, page_id: str) -> int:
+        n = delete_stale_chunks(self.coll, page_id, 0)
+        self.stale_deleted += n
+        return n
+
+    def flush(self):
+        if not self.pending:
+            return
+        page_of = {}
+        target = target_class()
+        with self.client.batch.fixed_size(
+            batch_size=self.batch_size, concurrent_requests=self.concurrency
+        ) as batch:
+            for page_id, objects, _, _ in self.pending:
+                for obj_id, props, vec in objects:
+                    batch.add_object(collection=target, properties=props, uuid=obj_id, vector=vec)
+                    page_of[str(obj_id)] = page_id
+
+        failed = self.client.batch.failed_objects
+        for err in failed:
+            obj_id = str(err.original_uuid or err.object_.uuid)
+            print(f"[ERR] batch object {obj_id} (pageId={page_of.get(obj_id)}): {err.message[:800]}")
+        self.errors += len(failed)
+        self.written += self.pending_count - len(failed)
+
+        # 失敗が無かったページのみ、範囲外になった古いチャンクを1回の呼び出しで削除
+        failed_pages = {page_of.get(str(err.original_uuid or err.object_.uuid)) for err in failed}
+        for page_id, objects, on_done, on_failed in self.pending:
+            if page_id in failed_pages:
+                if on_failed:
+                    on_failed()
+                continue
+            self.stale_deleted += delete_stale_chunks(self.coll, page_id, len(objects))
+            if on_done:
+                on_done()
+
+        self.pending = []
+        self.pending_count = 0
+
+    def close(self):
+        try:
+            self.flush()
+        finally:
+            self.client.close()
+
+
+def delete_stale_chunks(coll, page_id: str, keep: int) -> int:
+    """pageId のチャンクのうち chunkIndex >= keep のものを削除し、削除件数を返す。"""
+    where = Filter.by_property("pageId").equal(page_id) & Filter.by_property("chunkIndex").greater_or_equal(keep)
+    res = coll.data.delete_many(where=where)
+    if res.failed:
+        print(f"[ERR] stale delete failed for {page_id}: {res.failed} objects")
+    return res.successful
+
+
+def make_writer(mode: str, batch_size=UPSERT_BATCH_SIZE, concurrency=UPSERT_CONCURRENCY):
+    if mode == "rest":
+        return RestWriter()
+    if mode == "batch":
+        return BatchWriter(batch_size=batch_size, concurrency=concurrency)
+    raise ValueError(f"unknown ingest mode: {mode}")
+
+
 # ==== Main ingest ====
-def ingest_page(page_id: str):
+def content_hash(title: str, url: str, text: str) -> str:
+    return hashlib.sha256("\n".join([title or "", url or "", text]).encode("utf-8")).hexdigest()
+
+
+def fetch_page(page_id: str, manifest=None, force=False, version_no=None):
+    """
+    取り込み対象ならページ本文を取得して job(dict) を返す。
+    manifest の version と同じ（かつ分割方式も同じ）なら本文を取得せず None を返す。
+    version_no（検出時に分かっている version）があれば version だけの取得も省く。
+    """
+    prev = manifest.get(page_id) if manifest else None
+    if prev and prev.get("chunker") != chunker_id():
+        force = True
+
+    if prev and not force:
+        if version_no is None:
+            version_no = get_page_version(page_id).get("number")
+        if version_no == prev["version"]:
+            print(f"[SKIP] {page_id} version={prev['version']} unchanged")
+            return None
+
+    t0 = time.perf_counter()
     print(f"[INFO] fetch {page_id}")
     data = get_page(page_id)
-    title = data.get("title", "")
-    storage_html = data.get("body", {}).get("storage", {}).get("value", "") or ""
-    updated_at = data.get("version", {}).get("when")
     webui = data.get("_links", {}).get("webui")
-    url = f"{CONF_BASE_URL}{webui}" if webui and webui.startswith("/") else webui
-
-    text = storage_html_to_text(storage_html)
-    chunks = chunk_text(text)
-    if not chunks:
-        print(f"[WARN] no text for {page_id}")
-        return
-
-    print(f"[INFO] embed {len(chunks)} chunks (bge-m3)")
-    vecs = embed_dense_passages(chunks)
+    return {
+        "kind": "page",
+        "page_id": page_id,
+        "prev": prev,
+        "force": force,
+        "title": data.get("title", ""),
+        "url": f"{CONF_BASE_URL}{webui}" if webui and webui.startswith("/") else webui,
+        "version_no": data.get("version", {}).get("number"),
+        "updated_at": data.get("version", {}).get("when"),
+        "storage_html": data.get("body", {}).get("storage", {}).get("value", "") or "",
+        "seconds": time.perf_counter() - t0,
+    }
 
-    for v in vecs:
-        if len(v) != 1024:
-            raise RuntimeError(f"unexpected embedding dim: {len(v)} (expected 1024)")
 
-    for i, (chunk, vec) in enumerate(zip(chunks, vecs)):
-        obj_id = deterministic_uuid(page_id, i)
+def build_objects(job, vecs):
+    objects = []
+    for i, (chunk, vec) in enumerate(zip(job["chunks"], vecs)):
         props = {
-            "pageId": page_id,
-            "title": title,
-            "url": url,
-            "updatedAt": updated_at,
-            "content": chunk,
+            "pageId": job["page_id"],
+            "title": job["title"],
+            "url": job["url"],
+            "updatedAt": job["updated_at"],
+            "content": chunk["content"],
+            "headingPath": chunk["headingPath"],
             "chunkIndex": i,
         }
-        upsert_chunk(obj_id, props, vec)
-    print(f"[OK] upserted {len(chunks)} chunks for {page_id} ({title})")
+        objects.append((deterministic_uuid(job["page_id"], i), props, vec))
+    return objects
+
+
+def remove_page(page_id: str, writer, manifest) -> int:
+    n = writer.delete_page(page_id)
+    manifest.remove(page_id)
+    print(f"[DEL] {page_id}: removed {n} chunks")
+    return n
+
+
+# ==== Pipeline ====
+_DONE = object()
+
+
+class StageStats:
+    """段ごとの処理件数と、実際に処理していた秒数（busy）。"""
+
+    def __init__(self, name: str, unit: str):
+        self.name = name
+        self.unit = unit
+        self.items = 0
+        self.busy = 0.0
+        self._lock = threading.Lock()
+
+    def add(self, items: int, seconds: float):
+        with self._lock:
+            self.items += items
+            self.busy += seconds
+
+    @contextmanager
+    def timed(self, items: int = 1):
+        t0 = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.add(items, time.perf_counter() - t0)
+
+    def summary(self, wall: float) -> str:
+        rate = self.items / wall if wall > 0 else 0.0
+        return (
+            f"[STAGE] {self.name:<6} {self.items:>6} {self.unit:<6} busy={self.busy:7.1f}s "
+            f"util={self.busy / wall if wall > 0 else 0.0:6.1%}  {rate:8.1f} {self.unit}/s"
+        )
+
+
+def _mp_context():
+    # gRPC（batch writer）やスレッドが動いた後の fork は危険なので forkserver（無ければ spawn）を使う
+    methods = multiprocessing.get_all_start_methods()
+    return multiprocessing.get_context("forkserver" if "forkserver" in methods else "spawn")
+
+
+class IngestPipeline:
+    """
+    fetch（FETCH_CONCURRENCY スレッド, keep-alive セッション + レート制限）
+      -> parse（PARSE_WORKERS プロセス: storage -> テキスト + チャンク）
+      -> embed（1スレッド: 複数ページのチャンクをまとめて bge-m3）
+      -> write（1スレッド: writer.write_page / delete_page）
+    段の間は上限付きキューでつなぎ、遅い段があれば前段が待つ。
+    どこかの段で例外が起きたら全段を止め、run() で再送出する。
+    """
+
+    def __init__(self, writer, manifest, force=False, fetch_concurrency=FETCH_CONCURRENCY,
+                 parse_workers=PARSE_WORKERS, queue_size=PIPELINE_QUEUE, embed_batch=EMBED_BATCH_CHUNKS):
+        self.writer = writer
+        self.manifest = manifest
+        self.force = force
+        self.fetch_concurrency = max(1, fetch_concurrency)
+        self.parse_workers = max(1, parse_workers)
+        self.embed_batch = embed_batch
+        self.parse_q = queue.Queue(maxsize=queue_size)
+        self.embed_q = queue.Queue(maxsize=queue_size)
+        self.write_q = queue.Queue(maxsize=queue_size)
+        self.stop = threading.Event()
+        self.errors = []
+        self.statuses = []  # [(page_id, "updated" | "failed" | "skipped" | "empty" | "deleted")]
+        self.stats = {
+            "fetch": StageStats("fetch", "pages"),
+            "parse": StageStats("parse", "pages"),
+            "embed": StageStats("embed", "chunks"),
+            "write": StageStats("write", "chunks"),
+        }
+
+    # ---- キュー操作（停止時に詰まらないようにタイムアウト付き） ----
+    def _put(self, q, item):
+        while not self.stop.is_set():
+            try:
+                q.put(item, timeout=0.5)
+                return True
+            except queue.Full:
+                continue
+        return False
+
+    def _iter(self, q):
+        while True:
+            try:
+                item = q.get(timeout=0.5)
+            except queue.Empty:
+                if self.stop.is_set():
+                    return
+                continue
+            if item is _DONE:
+                return
+            yield item
+
+    def _stage(self, fn, downstream):
+        def run():
+            try:
+                fn()
+            except BaseException as e:
+                self.errors.append(e)
+                self.stop.set()
+            finally:
+                if downstream is not None:
+                    self._put(downstream, _DONE)
+        t = threading.Thread(target=run, name=fn.__name__, daemon=True)
+        t.start()
+        return t
+
+    # ---- 各段 ----
+    def _fetch_one(self, item):
+        if self.stop.is_set():
+            return
+        # item は pageId（CONF_PAGE_IDS）か discover_pages の {"id", "version"}
+        page_id, version_no = (item["id"], item["version"]) if isinstance(item, dict) else (item, None)
+        t0 = time.perf_counter()
+        try:
+            job = fetch_page(page_id, self.manifest, force=self.force, version_no=version_no)
+        except requests.HTTPError as e:
+            # Confluence 側で削除されたページはチャンクも消す
+            if e.response is not None and e.response.status_code == 404 and self.manifest.get(page_id):
+                job = {"kind": "delete", "page_id": page_id}
+            else:
+                raise
+        finally:
+            self.stats["fetch"].add(1, time.perf_counter() - t0)
+        if job is None:
+            self.statuses.append((page_id, "skipped"))
+            return
+        self._put(self.parse_q, job)
+
+    def fetch(self, pages):
+        def fetch_all():
+            # pages はジェネレーターでもよい。投入数を絞って、先読みするのは同時取得数の2倍まで
+            slots = threading.BoundedSemaphore(self.fetch_concurrency * 2)
+            in_flight = set()
+            with ThreadPoolExecutor(max_workers=self.fetch_concurrency, thread_name_prefix="fetch") as ex:
+                try:
+                    for item in pages:
+                        if self.stop.is_set():
+                            break
+                        slots.acquire()
+                        fut = ex.submit(self._fetch_one, item)
+                        fut.add_done_callback(lambda _: slots.release())
+                        in_flight.add(fut)
+                        for done in [f for f in in_flight if f.done()]:
+                            in_flight.discard(done)
+                            done.result()
+                    for fut in in_flight:
+                        fut.result()
+                except BaseException:
+                    self.stop.set()  # 残りの取得を打ち切る
+                    raise
+        return fetch_all
+
+    def parse(self, pool):
+        def dispatch():
+            # プロセスプールに投げた Future をそのまま次段へ（順序は保たれ、結果は embed 段で受け取る）
+            model = MODEL_PATH or MODEL_NAME
+            for job in self._iter(self.parse_q):
+                if job["kind"] == "page":
+                    job["future"] = pool.submit(split_page, job.pop("storage_html"), CHUNKER, model)
+                self._put(self.embed_q, job)
+        return dispatch
+
+    def _flush_embed(self, jobs):
+        texts = [c["content"] for job in jobs if job["kind"] == "page" for c in job["chunks"]]
+        vecs = []
+        if texts:
+            t0 = time.perf_counter()
+            vecs = embed_dense_passages(texts)
+            seconds = time.perf_counter() - t0
+            self.stats["embed"].add(len(texts), seconds)
+        offset = 0
+        for job in jobs:
+            if job["kind"] == "page":
+                n = len(job["chunks"])
+                job["objects"] = build_objects(job, vecs[offset:offset + n])
+                if texts:
+                    job["seconds"] += seconds * n / len(texts)
+                offset += n
+            if not self._put(self.write_q, job):
+                return
+
+    def embed(self):
+        pending, pending_chunks = [], 0
+        for job in self._iter(self.embed_q):
+            if job["kind"] == "page":
+                res = job.pop("future").result()
+                self.stats["parse"].add(1, res["seconds"])
+                job["chunks"] = res["chunks"]
+                job["seconds"] += res["seconds"]
+                job["digest"] = content_hash(job["title"], job["url"], res["text"])
+                prev = job["prev"]
+                if prev and not job["force"] and prev["content_hash"] == job["digest"]:
+                    print(f"[SKIP] {job['page_id']} version {prev['version']} -> {job['version_no']} but content unchanged")
+                    self.manifest.upsert(job["page_id"], version=job["version_no"], updated_at=job["updated_at"])
+                    self.statuses.append((job["page_id"], "skipped"))
+                    continue
+                pending_chunks += len(job["chunks"])
+            pending.append(job)
+            # 十分たまったか、前段が空（待っても来ない）なら埋め込む
+            if pending_chunks >= self.embed_batch or self.embed_q.empty():
+                self._flush_embed(pending)
+                pending, pending_chunks = [], 0
+        if pending and not self.stop.is_set():
+            self._flush_embed(pending)
+
+    def write(self):
+        for job in self._iter(self.write_q):
+            page_id = job["page_id"]
+            if job["kind"] == "delete":
+                remove_page(page_id, self.writer, self.manifest)
+                self.statuses.append((page_id, "deleted"))
+                continue
+
+            meta = dict(
+                version=job["version_no"], updated_at=job["updated_at"], content_hash=job["digest"],
+                chunk_count=len(job["chunks"]), title=job["title"], url=job["url"],
+                process_seconds=job["seconds"], chunker=chunker_id(),
+            )
+            if not job["objects"]:
+                print(f"[WARN] no text for {page_id}")
+                self.writer.delete_page(page_id)
+                self.manifest.upsert(page_id, **meta)
+                self.statuses.append((page_id, "empty"))
+                continue
+
+            def on_done(page_id=page_id, meta=meta):
+                # 書き込みが成功したページだけマニフェストを進め、updated に数える
+                self.manifest.upsert(page_id, **meta)
+                self.statuses.append((page_id, "updated"))
+
+            def on_failed(page_id=page_id):
+                self.statuses.append((page_id, "failed"))
+
+            with self.stats["write"].timed(len(job["objects"])):
+                self.writer.write_page(page_id, job["objects"], on_done, on_failed)
+            print(f"[OK] queued {len(job['objects'])} chunks for {page_id} ({job['title']})")
+        if not self.stop.is_set():
+            with self.stats["write"].timed(0):
+                self.writer.flush()
+
+    def run(self, pages):
+        """全段を起動して終わるまで待つ。経過秒数を返す。pages は pageId か {"id", "version"} の iterable。"""
+        t0 = time.perf_counter()
+        with ProcessPoolExecutor(max_workers=self.parse_workers, mp_context=_mp_context()) as pool:
+            threads = [
+                self._stage(self.fetch(pages), self.parse_q),
+                self._stage(self.parse(pool), self.embed_q),
+                self._stage(self.embed, self.write_q),
+                self._stage(self.write, None),
+            ]
+            for t in threads:
+                t.join()
+        if self.errors:
+            raise self.errors[0]
+        return time.perf_counter() - t0
+
+
+def main():
+    ap = argparse.ArgumentParser(description="Confluence -> bge-m3 -> Weaviate ingest")
+    ap.add_argument("--mode", choices=["batch", "rest"], default=INGEST_MODE, help="Weaviate 書き込み方式")
+    ap.add_argument("--batch-size", type=int, default=UPSERT_BATCH_SIZE, help="batch モードの1リクエスト件数")
+    ap.add_argument("--concurrency", type=int, default=UPSERT_CONCURRENCY, help="batch モードの同時リクエスト数")
+    ap.add_argument("--manifest", default=INGEST_MANIFEST, help="インクリメンタル ingest 用マニフェスト(SQLite)")
+    ap.add_argument("--full", action="store_true", help="マニフェストを無視して全ページを再取り込み")
+    ap.add_argument("--prune", action="store_true", help="対象（CONF_PAGE_IDS / 検出結果）から外れたページのチャンクを削除")
+    ap.add_argument("--space", action="append", default=None, help="対象スペースキー（複数指定可。CONF_SPACE_KEYS）")
+    ap.add_argument("--cql", default=CONF_CQL, help="対象ページを選ぶ CQL（CONF_CQL）")
+    ap.add_argument("--since", default=CONF_SINCE, help="検出時の更新日の下限: auto（前回 run 以降）/ none / YYYY-MM-DD")
+    ap.add_argument("--fetch-concurrency", type=int, default=FETCH_CONCURRENCY, help="Confluence の同時取得数")
+    ap.add_argument("--parse-workers", type=int, default=PARSE_WORKERS, help="パース・分割のプロセス数")
+    args = ap.parse_args()
+
+    space_keys = args.space or CONF_SPACE_KEYS
+    discovery = bool(space_keys or args.cql)
+    if not discovery and not CONF_PAGE_IDS:
+        raise SystemExit("CONF_PAGE_IDS 未設定（例: 98439,360449）または CONF_SPACE_KEYS / CONF_CQL を指定")
+
+    started_at = utcnow()
+    t0 = time.perf_counter()
+    manifest = IngestManifest(args.manifest)
+
+    if discovery:
+        since = None if args.full else resolve_since(args.since, manifest)
+        cql = build_cql(space_keys, args.cql, since)
+        print(f"[INFO] discover pages: {cql}")
+        pages = discover_pages(cql)
+        if args.prune and since:
+            print("[WARN] --prune は差分検出（--since）では使えません。--since none で全件検出したときに削除します")
+            args.prune = False
+    else:
+        pages = CONF_PAGE_IDS
+    counts = {"skipped": 0, "updated": 0, "failed": 0, "empty": 0, "deleted_pages": 0}
+    updated_pages, deleted_pages = set(), set()
+    time_saved = 0.0
+
+    writer = make_writer(args.mode, args.batch_size, args.concurrency)
+    pipeline = IngestPipeline(
+        writer, manifest, force=args.full,
+        fetch_concurrency=args.fetch_concurrency, parse_workers=args.parse_workers,
+    )
+    try:
+        wall = pipeline.run(pages)
+        for pid, status in pipeline.statuses:
+            if status == "deleted":
+                counts["deleted_pages"] += 1
+                deleted_pages.add(pid)
+                continue
+            counts[status] += 1
+            if status == "skipped":
+                time_saved += (manifest.get(pid) or {}).get("process_seconds") or 0.0
+            elif status != "failed":
+                updated_pages.add(pid)
+
+        if args.prune:
+            targets = {pid for pid, _ in pipeline.statuses} if discovery else set(CONF_PAGE_IDS)
+            for pid in set(manifest.page_ids()) - targets:
+                remove_page(pid, writer, manifest)
+                counts["deleted_pages"] += 1
+                deleted_pages.add(pid)
+    finally:
+        writer.close()
+
+    elapsed = time.perf_counter() - t0
+    cache = get_embedder().cache
+    stats = dict(
+        counts,
+        mode=args.mode,
+        written=writer.written,
+        errors=writer.errors,
+        deleted_chunks=writer.stale_deleted,
+        elapsed_seconds=round(elapsed, 1),
+        time_saved_seconds=round(time_saved, 1),
+        embed_cache=cache.stats() if cache is not None else None,
+        stages={
+            name: {"items": st.items, "busy_seconds": round(st.busy, 1)}
+            for name, st in pipeline.stats.items()
+        },
+        throttled=conf_rate.throttled,
+        source=cql if discovery else "CONF_PAGE_IDS",
+    )
+    manifest.record_run(started_at, updated_pages, deleted_pages, stats)
+    manifest.close()
+    for st in pipeline.stats.values():
+        print(st.summary(wall))
+    if conf_rate.throttled:
+        print(f"[INFO] Confluence rate limited (429) {conf_rate.throttled} times")
+    print(
+        f"[DONE] mode={args.mode} updated={counts['updated']} failed={counts['failed']} skipped={counts['skipped']} "
+        f"empty={counts['empty']} deleted_pages={counts['deleted_pages']} "
+        f"written={writer.written} deleted_chunks={writer.stale_deleted} errors={writer.errors} "
+        f"elapsed={elapsed:.1f}s saved~{time_saved:.1f}s"
+    )
+    if cache is not None:
+        print(f"[INFO] embed cache: {cache.stats()}")
+    if writer.errors:
+        raise SystemExit(1)
 
 
 if __name__ == "__main__":
-    if not CONF_PAGE_IDS:
-        raise SystemExit("CONF_PAGE_IDS 未設定（例: 98439,360449）")
-    for pid in CONF_PAGE_IDS:
-        ingest_page(pid)
+    main()
@@ -0,0 +1,134 @@
+# phase2/scripts/ingest_manifest.py
+"""
+インクリメンタル ingest 用のローカルマニフェスト（SQLite）。
+pageId ごとに取り込み済みの version / 本文ハッシュ / チャンク数を保持し、
+ingest 実行ごとの結果（更新・削除したページ）も runs に記録する。
+ingest のパイプラインの各スレッドから使うので、接続は1本をロックで共有する。
+"""
+import os
+import json
+import sqlite3
+import threading
+from datetime import datetime, timezone
+
+DEFAULT_PATH = os.path.join(os.path.dirname(__file__), "..", "data", "ingest_manifest.sqlite")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS pages (
+    page_id         TEXT PRIMARY KEY,
+    version         INTEGER,
+    updated_at      TEXT,
+    content_hash    TEXT,
+    chunk_count     INTEGER,
+    title           TEXT,
+    url             TEXT,
+    process_seconds REAL,
+    ingested_at     TEXT,
+    chunker         TEXT
+);
+CREATE TABLE IF NOT EXISTS runs (
+    id            INTEGER PRIMARY KEY AUTOINCREMENT,
+    started_at    TEXT,
+    finished_at   TEXT,
+    updated_pages TEXT,
+    deleted_pages TEXT,
+    stats         TEXT,
+    errors        INTEGER
+);
+"""
+
+_PAGE_COLS = (
+    "page_id", "version", "updated_at", "content_hash", "chunk_count",
+    "title", "url", "process_seconds", "ingested_at", "chunker",
+)
+
+
+def utcnow() -> str:
+    return datetime.now(timezone.utc).isoformat(timespec="seconds")
+
+
+class IngestManifest:
+    def __init__(self, path: str = DEFAULT_PATH):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self._lock = threading.RLock()
+        self.conn.executescript(_SCHEMA)
+        self._migrate()
+
+    def _migrate(self):
+        # 古いマニフェストに後から追加した列を足す
+        have = {r[1] for r in self.conn.execute("PRAGMA table_info(pages)")}
+        for col in ("chunker",):
+            if col not in have:
+                self.conn.execute(f"ALTER TABLE pages ADD COLUMN {col} TEXT")
+        have = {r[1] for r in self.conn.execute("PRAGMA table_info(runs)")}
+        if "errors" not in have:
+            self.conn.execute("ALTER TABLE runs ADD COLUMN errors INTEGER")
+            self.conn.execute("UPDATE runs SET errors = COALESCE(json_extract(stats, '$.errors'), 0)")
+        self.conn.commit()
+
+    def get(self, page_id: str):
+        with self._lock:
+            row = self.conn.execute(
+                f"SELECT {', '.join(_PAGE_COLS)} FROM pages WHERE page_id = ?", (page_id,)
+            ).fetchone()
+        return dict(zip(_PAGE_COLS, row)) if row else None
+
+    def page_ids(self):
+        with self._lock:
+            return [r[0] for r in self.conn.execute("SELECT page_id FROM pages")]
+
+    def upsert(self, page_id: str, **fields):
+        fields = {k: v for k, v in fields.items() if k in _PAGE_COLS and k != "page_id"}
+        fields.setdefault("ingested_at", utcnow())
+        cols = ["page_id"] + list(fields)
+        updates = ", ".join(f"{c} = excluded.{c}" for c in fields)
+        with self._lock:
+            self.conn.execute(
+                f"INSERT INTO pages ({', '.join(cols)}) VALUES ({', '.join('?' for _ in cols)}) "
+                f"ON CONFLICT(page_id) DO UPDATE SET {updates}",
+                [page_id] + list(fields.values()),
+            )
+            self.conn.commit()
+
+    def remove(self, page_id: str):
+        with self._lock:
+            self.conn.execute("DELETE FROM pages WHERE page_id = ?", (page_id,))
+            self.conn.commit()
+
+    def record_run(self, started_at: str, updated_pages, deleted_pages, stats: dict):
+        self.conn.execute(
+            "INSERT INTO runs (started_at, finished_at, updated_pages, deleted_pages, stats, errors) "
+            "VALUES (?, ?, ?, ?, ?, ?)",
+            (
+                started_at,
+                utcnow(),
+                json.dumps(sorted(updated_pages)),
+                json.dumps(sorted(deleted_pages)),
+                json.dumps(stats, ensure_ascii=False),
+                int(stats.get("errors") or 0),
+            ),
+        )
+        self.conn.commit()
+
+    def last_run(self, clean: bool = False):
+        """最新の run。clean=True なら書き込みエラーの無かった run のうち最新のもの。"""
+        where = "WHERE COALESCE(errors, 0) = 0 " if clean else ""
+        row = self.conn.execute(
+            "SELECT id, started_at, finished_at, updated_pages, deleted_pages, stats "
+            f"FROM runs {where}ORDER BY id DESC LIMIT 1"
+        ).fetchone()
+        if not row:
+            return None
+        return {
+            "id": row[0],
+            "started_at": row[1],
+            "finished_at": row[2],
+            "updated_pages": json.loads(row[3] or "[]"),
+            "deleted_pages": json.loads(row[4] or "[]"),
+            "stats": json.loads(row[5] or "{}"),
+        }
+
+    def close(self):
+        self.conn.close()
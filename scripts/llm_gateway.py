@@ -0,0 +1,336 @@
+# phase2/scripts/llm_gateway.py
+"""
+複数の Ollama への LLM 呼び出しの振り分け（asyncio 用）。
+
+- 振り分け: 空き枠のあるバックエンドのうち、実行中の数 / 枠数が最も小さいもの（least outstanding requests）
+- 枠: バックエンドごとに max_inflight（Ollama の OLLAMA_NUM_PARALLEL に合わせる）。全部埋まっていれば待ち行列に入る
+- 優先度: 待ち行列からは優先度の高い順に取り出す（整形 > 簡易回答 > 詳細回答）。待ち時間 aging_seconds ごとに1段上がる。
+  詳細回答（PRIORITY_LOW）が同時に使える枠は low_priority_max までに抑え、整形と簡易回答の枠を残す
+- ヘルスチェック: health_interval 秒ごとに GET /api/tags。応答しない・モデルが無いバックエンドには振らない
+- サーキットブレーカー: cb_failures 回続けて失敗したら cb_cooldown 秒は振らず、その後1件だけ試して戻す
+- 待ち行列が満杯、または queue_timeout 秒以内に枠が取れなければ LLMBusyError（API は 503）
+
+  gateway = LLMGateway.from_env(model, temperature=0.3)
+  async with gateway.slot(PRIORITY_HIGH) as backend:
+      result = await backend.llm.agenerate(...)
+"""
+import os
+import time
+import random
+import asyncio
+import logging
+import itertools
+from contextlib import asynccontextmanager
+
+import requests
+from langchain_community.chat_models import ChatOllama
+
+# カンマ区切りの Ollama の URL。"URL=枠数" で枠数を個別に指定できる（未指定なら LLM_MAX_INFLIGHT）
+OLLAMA_ENDPOINTS = os.getenv("OLLAMA_ENDPOINTS", "")
+OLLAMA_BASE_URL = os.getenv("OLLAMA_BASE_URL", "http://localhost:11434")
+LLM_MAX_INFLIGHT = int(os.getenv("LLM_MAX_INFLIGHT", "2"))      # バックエンドごとの同時リクエスト数
+LLM_MAX_QUEUE = int(os.getenv("LLM_MAX_QUEUE", "16"))           # 待ち行列の上限（超えたら 503）
+LLM_QUEUE_TIMEOUT = float(os.getenv("LLM_QUEUE_TIMEOUT", "60"))  # 枠が空くまで待つ秒数
+LLM_LOW_PRIORITY_MAX = int(os.getenv("LLM_LOW_PRIORITY_MAX", "0"))  # 詳細回答の同時実行数の上限（0 = 全体の枠数 - 1）
+LLM_PRIORITY_AGING_SECONDS = float(os.getenv("LLM_PRIORITY_AGING_SECONDS", "10"))  # 0 で aging なし
+LLM_HEALTH_INTERVAL = float(os.getenv("LLM_HEALTH_INTERVAL", "10"))
+LLM_HEALTH_TIMEOUT = float(os.getenv("LLM_HEALTH_TIMEOUT", "2"))
+LLM_CB_FAILURES = int(os.getenv("LLM_CB_FAILURES", "3"))
+LLM_CB_COOLDOWN = float(os.getenv("LLM_CB_COOLDOWN", "30"))
+
+PRIORITY_HIGH = 0    # 質問整形（短い）
+PRIORITY_NORMAL = 1  # 簡易回答
+PRIORITY_LOW = 2     # 詳細回答（長い生成）
+
+logger = logging.getLogger("llm_gateway")
+
+
+class LLMBusyError(Exception):
+    """LLM が混雑していて受け付けられない（使えるバックエンドが無い場合も含む）。"""
+
+
+def parse_endpoints(spec: str, default_inflight: int = LLM_MAX_INFLIGHT):
+    """"http://a:11434=2,http://b:11434" -> [("http://a:11434", 2), ("http://b:11434", default_inflight)]"""
+    out = []
+    for item in (spec or "").split(","):
+        item = item.strip()
+        if not item:
+            continue
+        url, _, slots = item.rpartition("=")
+        if url and slots.isdigit():
+            out.append((url.rstrip("/"), int(slots)))
+        else:
+            out.append((item.rstrip("/"), default_inflight))
+    return out
+
+
+class Backend:
+    def __init__(self, url: str, model: str, max_inflight: int = LLM_MAX_INFLIGHT, temperature: float = 0.3,
+                 cb_failures: int = LLM_CB_FAILURES, cb_cooldown: float = LLM_CB_COOLDOWN):
+        self.url = url
+        self.model = model
+        self.max_inflight = max(1, max_inflight)
+        self.llm = ChatOllama(model=model, base_url=url, temperature=temperature)
+        self.cb_failures = cb_failures
+        self.cb_cooldown = cb_cooldown
+        self.session = requests.Session()
+        self.outstanding = 0
+        self.healthy = True  # 最初のヘルスチェックまでは使える前提
+        self.state = "closed"  # closed / open / half_open
+        self.opened_until = 0.0
+        self.trial = False  # half_open で試しているリクエストがある
+        self.completed = 0
+        self.failures = 0
+        self.consecutive_failures = 0
+        self.latency_seconds = 0.0
+        self.last_error = None
+
+    def admits(self, now: float) -> bool:
+        if not self.healthy:
+            return False
+        if self.state == "open":
+            if now < self.opened_until:
+                return False
+            self.state = "half_open"
+        if self.state == "half_open":
+            return not self.trial
+        return self.outstanding < self.max_inflight
+
+    def record(self, ok: bool, seconds: float, error: str = None):
+        self.trial = False
+        if ok:
+            self.completed += 1
+            self.latency_seconds += seconds
+            self.consecutive_failures = 0
+            if self.state != "closed":
+                logger.info(f"{self.url}: circuit closed")
+            self.state = "closed"
+            return
+        self.failures += 1
+        self.consecutive_failures += 1
+        self.last_error = error
+        if self.state == "half_open" or self.consecutive_failures >= self.cb_failures:
+            if self.state != "open":
+                logger.warning(f"{self.url}: circuit opened for {self.cb_cooldown:.0f}s ({error})")
+            self.state = "open"
+            self.opened_until = time.monotonic() + self.cb_cooldown
+
+    def probe(self):
+        """GET /api/tags で生存とモデルの有無を確かめる。戻り値: (ok, エラー内容)"""
+        try:
+            r = self.session.get(f"{self.url}/api/tags", timeout=LLM_HEALTH_TIMEOUT)
+            r.raise_for_status()
+            names = {m.get("name") for m in r.json().get("models") or []}
+        except (requests.RequestException, ValueError) as e:
+            return False, str(e)
+        wanted = {self.model} if ":" in self.model else {self.model, f"{self.model}:latest"}
+        if not names & wanted:
+            return False, f"model {self.model} not found"
+        return True, None
+
+    def stats(self) -> dict:
+        return {
+            "url": self.url,
+            "healthy": self.healthy,
+            "circuit": self.state,
+            "outstanding": self.outstanding,
+            "max_inflight": self.max_inflight,
+            "completed": self.completed,
+            "failures": self.failures,
+            "avg_seconds": round(self.latency_seconds / self.completed, 3) if self.completed else None,
+            "last_error": self.last_error,
+        }
+
+
+class _Waiter:
+    __slots__ = ("priority", "seq", "enqueued", "exclude", "future")
+
+    def __init__(self, priority, seq, exclude, future):
+        self.priority = priority
+        self.seq = seq
+        self.enqueued = time.monotonic()
+        self.exclude = exclude
+        self.future = future
+
+
+class LLMGateway:
+    def __init__(self, backends, max_queue: int = LLM_MAX_QUEUE, queue_timeout: float = LLM_QUEUE_TIMEOUT,
+                 low_priority_max: int = LLM_LOW_PRIORITY_MAX, aging_seconds: float = LLM_PRIORITY_AGING_SECONDS,
+                 health_interval: float = LLM_HEALTH_INTERVAL):
+        self.backends = list(backends)
+        self.max_queue = max_queue
+        self.queue_timeout = queue_timeout
+        total = sum(b.max_inflight for b in self.backends)
+        self.low_priority_max = low_priority_max or max(1, total - 1)
+        self.aging_seconds = aging_seconds
+        self.health_interval = health_interval
+        self._waiters = []
+        self._seq = itertools.count()
+        self._health_task = None
+        self.in_flight = 0
+        self.low_in_flight = 0
+        self.max_waiting = 0
+        self.completed = 0
+        self.rejected = 0
+        self.queue_wait_seconds = 0.0
+
+    @classmethod
+    def from_env(cls, model: str, temperature: float = 0.3):
+        endpoints = parse_endpoints(OLLAMA_ENDPOINTS) or [(OLLAMA_BASE_URL.rstrip("/"), LLM_MAX_INFLIGHT)]
+        return cls([Backend(url, model, slots, temperature) for url, slots in endpoints])
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiters)
+
+    def available_backends(self) -> int:
+        now = time.monotonic()
+        return sum(1 for b in self.backends if b.healthy and (b.state != "open" or now >= b.opened_until))
+
+    # ---- 枠の割り当て ----
+    def _take(self, priority: int, exclude):
+        if priority >= PRIORITY_LOW and self.low_in_flight >= self.low_priority_max:
+            return None
+        now = time.monotonic()
+        # exclude（直前に失敗したバックエンド）は他にバックエンドがあるときだけ避ける
+        pool = [b for b in self.backends if b.url not in exclude] or self.backends
+        candidates = [b for b in pool if b.admits(now)]
+        if not candidates:
+            return None
+        backend = min(candidates, key=lambda b: (b.outstanding / b.max_inflight, b.outstanding, random.random()))
+        if backend.state == "half_open":
+            backend.trial = True
+        backend.outstanding += 1
+        self.in_flight += 1
+        if priority >= PRIORITY_LOW:
+            self.low_in_flight += 1
+        return backend
+
+    def _effective_priority(self, w: _Waiter, now: float) -> float:
+        if self.aging_seconds <= 0:
+            return w.priority
+        return w.priority - (now - w.enqueued) / self.aging_seconds
+
+    def _dispatch(self):
+        """空いた枠を、待っているリクエストに優先度順で割り当てる。"""
+        while self._waiters:
+            now = time.monotonic()
+            assigned = False
+            for w in sorted(self._waiters, key=lambda w: (self._effective_priority(w, now), w.seq)):
+                if w.future.done():  # タイムアウト・切断で待つのをやめた
+                    self._waiters.remove(w)
+                    continue
+                backend = self._take(w.priority, w.exclude)
+                if backend is None:
+                    continue
+                self._waiters.remove(w)
+                w.future.set_result(backend)
+                assigned = True
+                break
+            if not assigned:
+                return
+
+    def _release(self, backend: Backend, priority: int):
+        backend.outstanding -= 1
+        self.in_flight -= 1
+        if priority >= PRIORITY_LOW:
+            self.low_in_flight -= 1
+        self.completed += 1
+        self._dispatch()
+
+    @asynccontextmanager
+    async def slot(self, priority: int = PRIORITY_NORMAL, exclude=()):
+        """
+        バックエンドの枠を1つ取り、Backend を渡す。ブロック内の例外はそのバックエンドの失敗として数える
+        （クライアントの切断によるキャンセルは数えない）。exclude の URL には、他があれば振らない（再試行用）。
+        """
+        exclude = frozenset(exclude)
+        t0 = time.perf_counter()
+        backend = self._take(priority, exclude) if not self._waiters else None
+        if backend is None:
+            if len(self._waiters) >= self.max_queue:
+                self.rejected += 1
+                raise LLMBusyError(f"LLM queue full ({len(self._waiters)} waiting)")
+            waiter = _Waiter(priority, next(self._seq), exclude, asyncio.get_running_loop().create_future())
+            self._waiters.append(waiter)
+            self.max_waiting = max(self.max_waiting, len(self._waiters))
+            self._dispatch()  # 前に待っているのが詳細回答だけなら、すぐ枠が取れることがある
+            try:
+                backend = await asyncio.wait_for(waiter.future, timeout=self.queue_timeout)
+            except asyncio.TimeoutError:
+                if waiter.future.done() and not waiter.future.cancelled():
+                    self._release(waiter.future.result(), priority)
+                self.rejected += 1
+                detail = "no healthy LLM backend" if not self.available_backends() else "no LLM slot"
+                raise LLMBusyError(f"{detail} within {self.queue_timeout}s")
+            except asyncio.CancelledError:
+                # 割り当てと同時にキャンセルされたら枠を返す
+                if waiter.future.done() and not waiter.future.cancelled():
+                    self._release(waiter.future.result(), priority)
+                raise
+            finally:
+                if waiter in self._waiters:
+                    self._waiters.remove(waiter)
+                self.queue_wait_seconds += time.perf_counter() - t0
+
+        t_start = time.perf_counter()
+        try:
+            yield backend
+        except (asyncio.CancelledError, GeneratorExit):
+            backend.trial = False
+            raise
+        except Exception as e:
+            backend.record(False, time.perf_counter() - t_start, f"{type(e).__name__}: {e}"[:200])
+            raise
+        else:
+            backend.record(True, time.perf_counter() - t_start)
+        finally:
+            self._release(backend, priority)
+
+    # ---- ヘルスチェック ----
+    async def check_health(self):
+        loop = asyncio.get_running_loop()
+        results = await asyncio.gather(*(loop.run_in_executor(None, b.probe) for b in self.backends))
+        for b, (ok, error) in zip(self.backends, results):
+            if ok != b.healthy:
+                logger.log(logging.INFO if ok else logging.WARNING,
+                           f"{b.url}: {'healthy' if ok else 'unhealthy'}{'' if ok else f' ({error})'}")
+            b.healthy = ok
+            if not ok:
+                b.last_error = error
+        self._dispatch()
+
+    async def _health_loop(self):
+        while True:
+            try:
+                await self.check_health()
+            except Exception:
+                logger.exception("LLM health check failed")
+            await asyncio.sleep(self.health_interval)
+
+    def start(self):
+        """ヘルスチェックを始める（イベントループの中で呼ぶ）。"""
+        if self._health_task is None and self.health_interval > 0:
+            self._health_task = asyncio.create_task(self._health_loop())
+
+    async def close(self):
+        if self._health_task is not None:
+            self._health_task.cancel()
+            self._health_task = None
+
+    def stats(self) -> dict:
+        return {
+            "in_flight": self.in_flight,
+            "low_priority_in_flight": self.low_in_flight,
+            "low_priority_max": self.low_priority_max,
+            "queue_depth": len(self._waiters),
+            "queue_by_priority": {
+                p: sum(1 for w in self._waiters if w.priority == p) for p in (PRIORITY_HIGH, PRIORITY_NORMAL, PRIORITY_LOW)
+            },
+            "max_queue_depth": self.max_waiting,
+            "max_queue": self.max_queue,
+            "completed": self.completed,
+            "rejected": self.rejected,
+            "avg_queue_wait_seconds": round(self.queue_wait_seconds / max(self.completed + self.rejected, 1), 3),
+            "backends": [b.stats() for b in self.backends],
+        }
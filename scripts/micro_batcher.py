@@ -0,0 +1,138 @@
+# phase2/scripts/micro_batcher.py
+"""
+同時に届いた埋め込み要求を1回の encode にまとめるマイクロバッチャ（標準ライブラリのみ）。
+embed_server.py（常駐埋め込みサービス）と api_server_phase2.py（クエリ埋め込み）で使う。
+
+  batcher = MicroBatcher(lambda texts, normalize: model.encode(texts, normalize_embeddings=normalize),
+                         max_batch=16, max_wait_ms=3)
+  vecs = batcher.submit(["query: ..."]).result()              # スレッドから
+  vecs = await asyncio.wrap_future(batcher.submit([...]))     # イベントループから
+
+最初の要求が来てから max_wait_ms、または合計 max_batch 件に達するまで待ってからまとめて encode_fn を呼ぶ。
+待ち時間を延ばすとバッチは大きくなる（スループット↑）が、1件あたりのレイテンシの下限も延びる。
+"""
+import time
+import queue
+import logging
+import threading
+from concurrent.futures import Future
+
+HIST_BUCKETS = (1, 2, 4, 8, 16, 32, 64, 128)
+
+logger = logging.getLogger(__name__)
+
+
+class _Request:
+    __slots__ = ("texts", "normalize", "future", "queued_at")
+
+    def __init__(self, texts, normalize):
+        self.texts = texts
+        self.normalize = normalize
+        self.future = Future()
+        self.queued_at = time.perf_counter()
+
+
+def _resolve(future: Future, result=None, exception=None):
+    """結果を渡す。1件の Future の失敗でバッチャのスレッドが止まらないよう、例外は握りつぶす。"""
+    try:
+        if exception is not None:
+            future.set_exception(exception)
+        else:
+            future.set_result(result)
+    except Exception as e:
+        logger.warning(f"could not deliver embedding result: {e}")
+
+
+class MicroBatcher:
+    """
+    encode 要求を1本のスレッドでまとめて処理する。
+    encode_fn(texts, normalize) は texts と同じ順のベクトル列を返すこと。normalize が違う要求は別々に encode する。
+    histogram（request_metrics.Histogram など observe() を持つもの）を渡すと、バッチごとの件数も記録する。
+    """
+
+    def __init__(self, encode_fn, max_batch: int = 64, max_wait_ms: float = 5, name: str = "micro-batcher",
+                 histogram=None):
+        self.encode_fn = encode_fn
+        self.histogram = histogram
+        self.max_batch = max_batch
+        self.max_wait = max_wait_ms / 1000
+        self._q = queue.Queue()
+        self.requests = 0
+        self.batches = 0
+        self.texts = 0
+        self.encode_seconds = 0.0
+        self.queue_seconds = 0.0
+        self.hist = {b: 0 for b in HIST_BUCKETS}
+        threading.Thread(target=self._loop, name=name, daemon=True).start()
+
+    def submit(self, texts, normalize=True) -> Future:
+        req = _Request(list(texts), bool(normalize))
+        self._q.put(req)
+        return req.future
+
+    def _collect(self):
+        items = [self._q.get()]
+        n = len(items[0].texts)
+        deadline = time.perf_counter() + self.max_wait
+        while n < self.max_batch:
+            timeout = deadline - time.perf_counter()
+            if timeout <= 0:
+                break
+            try:
+                req = self._q.get(timeout=timeout)
+            except queue.Empty:
+                break
+            items.append(req)
+            n += len(req.texts)
+        return items, n
+
+    def _record(self, n_requests, n_texts, seconds):
+        self.requests += n_requests
+        self.batches += 1
+        self.texts += n_texts
+        self.encode_seconds += seconds
+        bucket = next((b for b in HIST_BUCKETS if n_texts <= b), HIST_BUCKETS[-1])
+        self.hist[bucket] += 1
+        if self.histogram is not None:
+            self.histogram.observe(n_texts)
+
+    def _loop(self):
+        while True:
+            items, n = self._collect()
+            now = time.perf_counter()
+            self.queue_seconds += sum(now - it.queued_at for it in items)
+            # 待っている間にキャンセルされた要求（クライアントの切断・タイムアウト）は encode しない
+            items = [it for it in items if it.future.set_running_or_notify_cancel()]
+            for normalize in (True, False):
+                group = [it for it in items if it.normalize == normalize]
+                if group:
+                    self._run(group, normalize)
+
+    def _run(self, group, normalize):
+        texts = [t for it in group for t in it.texts]
+        t0 = time.perf_counter()
+        try:
+            vecs = self.encode_fn(texts, normalize)
+        except Exception as e:
+            for it in group:
+                _resolve(it.future, exception=e)
+            return
+        self._record(len(group), len(texts), time.perf_counter() - t0)
+        offset = 0
+        for it in group:
+            _resolve(it.future, result=vecs[offset:offset + len(it.texts)])
+            offset += len(it.texts)
+
+    def stats(self) -> dict:
+        return {
+            "max_batch": self.max_batch,
+            "max_wait_ms": self.max_wait * 1000,
+            "requests": self.requests,
+            "batches": self.batches,
+            "texts": self.texts,
+            "avg_batch_texts": round(self.texts / self.batches, 2) if self.batches else 0.0,
+            "avg_encode_ms": round(self.encode_seconds / self.batches * 1000, 2) if self.batches else 0.0,
+            "avg_queue_ms": round(self.queue_seconds / self.requests * 1000, 2) if self.requests else 0.0,
+            "batch_size_hist": {f"<={b}": c for b, c in self.hist.items()},
+            "queue_depth": self._q.qsize(),
+        }
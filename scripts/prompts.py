@@ -0,0 +1,61 @@
+# phase2/scripts/prompts.py
+"""
+LLM に渡すプロンプトの組み立て（API サーバーと devtools/bench_retrieval.py で共通）。
+"""
+from typing import Optional
+
+
+def build_refine_prompt(raw_question: str) -> str:
+    return (
+        "Here is a question input by a user in Japanese.\n"
+        "Please refine it into a technically clear and precise format that is easy for an AI to understand.\n"
+        "If the question is vague, add reasonable clarifications.\n"
+        "The output should be in Japanese, concise, and structured (e.g., bullet points or a well-organized sentence).\n\n"
+        f"【ユーザーの入力】\n{raw_question}\n\n"
+        "【整形された質問（日本語）】"
+    )
+
+
+def resolve_prompt_mode(prompt_type: Optional[str]) -> str:
+    if (prompt_type or "詳細回答ver") in ["詳細回答ver", "Detailed Answer"]:
+        return "detail"
+    return "simple"
+
+
+def build_answer_prompt(query_text: str, prompt_mode: str, combined_text: str) -> str:
+    if prompt_mode == "detail":
+        return (
+            f"The following is a set of past Confluence docs (topK=3).\n"
+            f"Please answer the following question **in Japanese**, based only on the information explicitly written in the documents.\n\n"
+            f"Question:\n{query_text}\n\n"
+            f"Instructions:\n"
+            f"- Output must be in **Markdown format**.\n"
+            f"- Do **not** use headings like 'Conclusion' or 'Details'.\n"
+            f"- Start with a natural sentence that clearly answers the question.\n"
+            f"- Then add background or explanation **without repeating the same wording or phrases used in the initial sentence.**\n"
+            f"- Bullet points are allowed if they improve clarity.\n"
+            f"- Use `**bold**` to emphasize important elements such as logic changes, validations, or team actions.\n"
+            f"- Do not bold common phrases.\n"
+            f"- At the end, include this line as a footnote **only if the answer is clearly supported by the docs**:\n"
+            f"\n  *この情報は、Confluenceドキュメントに基づいています。*\n"
+            f"- Do not use general knowledge or assumptions.\n\n"
+            f"Reference data:\n{combined_text}"
+        )
+    else:
+        return (
+            f"The following is a set of past Confluence docs (topK=3).\n"
+            f"Please answer the following question **in Japanese**, based only on the information explicitly written in the documents.\n\n"
+            f"Question:\n{query_text}\n\n"
+            f"Instructions:\n"
+            f"- Output must be in **Markdown format**.\n"
+            f"- Start with a natural sentence that clearly answers the question.\n"
+            f"- If necessary, add one short supporting sentence without repeating the same wording.\n"
+            f"- Do not include background or assumptions.\n"
+            f"- Do not use bullet points.\n"
+            f"- Use `**bold**` only for key values, specific terms, or decisions.\n"
+            f"- At the end, include this line as a footnote **only if the answer is clearly supported by the docs**:\n"
+            f"\n  *この情報は、Confluenceドキュメントに基づいています。*\n"
+            f"- Do not use general knowledge or assumptions.\n\n"
+            f"Reference data:\n{combined_text}"
+        )
+
@@ -0,0 +1,262 @@
+# phase2/scripts/request_metrics.py
+"""
+API サーバーの計測（標準ライブラリのみ）。
+  - Prometheus のテキスト形式のメトリクス（Counter / Gauge / Histogram、GET /metrics で出力）
+  - リクエストごとのコンテキスト（request id・段ごとの秒数・付加情報）。contextvars で持つので、
+    ハンドラの中のどこからでも request_timings() / annotate() で書き込める
+  - Server-Timing ヘッダーと JSON のアクセスログ
+
+段の名前は api_server_phase2.py の timings と同じ（embed / search / dense / bm25 / fuse / rerank / prompt / llm ...）。
+"""
+import os
+import sys
+import json
+import time
+import logging
+import threading
+import contextvars
+from datetime import datetime, timezone
+
+ACCESS_LOG = os.getenv("ACCESS_LOG", "1") not in ("0", "false", "False")
+ACCESS_LOG_FILE = os.getenv("ACCESS_LOG_FILE")  # 未指定なら標準出力
+
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60)
+SCORE_BUCKETS = (0.1, 0.2, 0.3, 0.4, 0.5, 0.6, 0.7, 0.8, 0.9, 1.0)
+COUNT_BUCKETS = (0, 1, 2, 3, 5, 10, 20, 30, 50)
+TOKEN_RATE_BUCKETS = (1, 2, 5, 10, 20, 30, 50, 100, 200)
+TOKEN_BUCKETS = (16, 64, 128, 256, 512, 1024, 2048, 4096, 8192)
+
+
+REGISTRY = []  # 定義したメトリクス（render_metrics() で出力する順）
+
+
+def _escape(value) -> str:
+    return str(value).replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _labels(names, values) -> str:
+    if not names:
+        return ""
+    return "{" + ",".join(f'{n}="{_escape(v)}"' for n, v in zip(names, values)) + "}"
+
+
+def _num(v) -> str:
+    if v == float("inf"):
+        return "+Inf"
+    return repr(float(v)) if isinstance(v, float) else str(v)
+
+
+class _Metric:
+    kind = ""
+
+    def __init__(self, name: str, help_text: str, labels=()):
+        self.name = name
+        self.help = help_text
+        self.label_names = tuple(labels)
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    def _header(self):
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+
+
+class Counter(_Metric):
+    kind = "counter"
+
+    def __init__(self, name, help_text, labels=()):
+        super().__init__(name, help_text, labels)
+        self._values = {}
+
+    def inc(self, *labels, amount=1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def render(self):
+        with self._lock:
+            items = sorted(self._values.items())
+        return self._header() + [f"{self.name}{_labels(self.label_names, k)} {_num(v)}" for k, v in items]
+
+
+class Gauge(_Metric):
+    kind = "gauge"
+
+    def __init__(self, name, help_text, labels=(), fn=None):
+        super().__init__(name, help_text, labels)
+        self._values = {}
+        self._fn = fn  # 出力時に値を取る関数（ラベルなし）
+
+    def inc(self, *labels, amount=1.0):
+        with self._lock:
+            self._values[labels] = self._values.get(labels, 0.0) + amount
+
+    def dec(self, *labels, amount=1.0):
+        self.inc(*labels, amount=-amount)
+
+    def set(self, value, *labels):
+        with self._lock:
+            self._values[labels] = float(value)
+
+    def render(self):
+        if self._fn is not None:
+            return self._header() + [f"{self.name} {_num(float(self._fn()))}"]
+        with self._lock:
+            items = sorted(self._values.items())
+        return self._header() + [f"{self.name}{_labels(self.label_names, k)} {_num(v)}" for k, v in items]
+
+
+class Histogram(_Metric):
+    kind = "histogram"
+
+    def __init__(self, name, help_text, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help_text, labels)
+        self.buckets = tuple(buckets) + (float("inf"),)
+        self._values = {}  # labels -> [bucket counts..., sum, count]
+
+    def observe(self, value, *labels):
+        if value is None:
+            return
+        with self._lock:
+            v = self._values.setdefault(labels, [0] * len(self.buckets) + [0.0, 0])
+            for i, b in enumerate(self.buckets):
+                if value <= b:
+                    v[i] += 1
+            v[-2] += value
+            v[-1] += 1
+
+    def render(self):
+        with self._lock:
+            items = sorted((k, list(v)) for k, v in self._values.items())
+        lines = self._header()
+        for labels, v in items:
+            for b, c in zip(self.buckets, v):
+                lines.append(f"{self.name}_bucket{_labels(self.label_names + ('le',), labels + (_num(b),))} {c}")
+            lines.append(f"{self.name}_sum{_labels(self.label_names, labels)} {_num(float(v[-2]))}")
+            lines.append(f"{self.name}_count{_labels(self.label_names, labels)} {v[-1]}")
+        return lines
+
+
+def render_metrics() -> str:
+    return "\n".join(line for m in REGISTRY for line in m.render()) + "\n"
+
+
+# ---- API サーバーのメトリクス ----
+REQUESTS = Counter("rag_requests_total", "Requests by endpoint and status", ("endpoint", "status"))
+REQUEST_SECONDS = Histogram("rag_request_seconds", "Request latency (until the last byte)", ("endpoint",))
+STAGE_SECONDS = Histogram("rag_stage_seconds", "Latency of each stage within a request", ("endpoint", "stage"))
+INFLIGHT = Gauge("rag_inflight_requests", "Requests currently being processed", ("endpoint",))
+LLM_TOKENS = Counter("rag_llm_tokens_total", "Tokens processed by the LLM", ("kind",))
+LLM_PROMPT_TOKENS = Histogram("rag_llm_prompt_tokens", "Prompt tokens per LLM call", buckets=TOKEN_BUCKETS)
+LLM_TOKENS_PER_SECOND = Histogram("rag_llm_tokens_per_second", "LLM generation speed per call",
+                                  buckets=TOKEN_RATE_BUCKETS)
+RETRIEVED_K = Histogram("rag_retrieved_chunks", "Chunks returned by retrieval per request", ("endpoint",),
+                        buckets=COUNT_BUCKETS)
+RETRIEVAL_TOP_SCORE = Histogram("rag_retrieval_top_score", "Score of the best chunk per request", ("endpoint",),
+                                buckets=SCORE_BUCKETS)
+RETRIEVAL_SCORE = Histogram("rag_retrieval_score", "Scores of all returned chunks", ("endpoint",),
+                            buckets=SCORE_BUCKETS)
+
+
+# ---- リクエストごとのコンテキスト ----
+_ctx = contextvars.ContextVar("request_ctx", default=None)
+
+
+def start_request(request_id: str, endpoint: str) -> dict:
+    ctx = {"request_id": request_id, "endpoint": endpoint, "timings": {}, "extra": {}, "t0": time.perf_counter()}
+    _ctx.set(ctx)
+    INFLIGHT.inc(endpoint)
+    return ctx
+
+
+def current():
+    return _ctx.get()
+
+
+def request_id():
+    ctx = _ctx.get()
+    return ctx["request_id"] if ctx else None
+
+
+def request_timings() -> dict:
+    """現在のリクエストの timings（段の名前 -> 秒）。リクエスト外なら新しい dict。"""
+    ctx = _ctx.get()
+    return ctx["timings"] if ctx else {}
+
+
+def annotate(**fields):
+    """アクセスログに載せる付加情報（retrieved_k / cached など）。"""
+    ctx = _ctx.get()
+    if ctx:
+        ctx["extra"].update(fields)
+
+
+def _endpoint():
+    ctx = _ctx.get()
+    return ctx["endpoint"] if ctx else "-"
+
+
+def observe_retrieval(hits):
+    endpoint = _endpoint()
+    scores = [h.get("score") for h in hits if h.get("score") is not None]
+    RETRIEVED_K.observe(len(hits), endpoint)
+    for sc in scores:
+        RETRIEVAL_SCORE.observe(sc, endpoint)
+    if scores:
+        RETRIEVAL_TOP_SCORE.observe(scores[0], endpoint)
+    annotate(retrieved_k=len(hits), top_score=round(scores[0], 4) if scores else None)
+
+
+def observe_llm(prompt_tokens, completion_tokens, gen_seconds):
+    """1回の LLM 呼び出し。gen_seconds は最初のトークンから最後までの秒数（無ければ呼び出し全体）。"""
+    if prompt_tokens:
+        LLM_TOKENS.inc("prompt", amount=prompt_tokens)
+        LLM_PROMPT_TOKENS.observe(prompt_tokens)
+    if completion_tokens:
+        LLM_TOKENS.inc("completion", amount=completion_tokens)
+        if gen_seconds and gen_seconds > 0:
+            LLM_TOKENS_PER_SECOND.observe(completion_tokens / gen_seconds)
+    ctx = _ctx.get()
+    if ctx:
+        extra = ctx["extra"]
+        extra["prompt_tokens"] = extra.get("prompt_tokens", 0) + (prompt_tokens or 0)
+        extra["completion_tokens"] = extra.get("completion_tokens", 0) + (completion_tokens or 0)
+
+
+def server_timing(timings: dict) -> str:
+    """timings を Server-Timing ヘッダーの値にする（ブラウザの開発者ツールで段ごとに見える）。"""
+    return ", ".join(f"{name};dur={sec * 1000:.1f}" for name, sec in timings.items())
+
+
+def finish_request(ctx: dict, status: int, method: str = "", log: bool = True):
+    """リクエストの最後（ストリーミングは最後のバイトを送った後）に1回呼ぶ。log=False ならアクセスログは出さない。"""
+    endpoint = ctx["endpoint"]
+    duration = time.perf_counter() - ctx["t0"]
+    INFLIGHT.dec(endpoint)
+    REQUESTS.inc(endpoint, str(status))
+    REQUEST_SECONDS.observe(duration, endpoint)
+    for stage, sec in ctx["timings"].items():
+        STAGE_SECONDS.observe(sec, endpoint, stage)
+    if ACCESS_LOG and log:
+        access_logger.info(json.dumps({
+            "ts": datetime.now(timezone.utc).isoformat(timespec="milliseconds"),
+            "request_id": ctx["request_id"],
+            "method": method,
+            "path": endpoint,
+            "status": status,
+            "duration_ms": round(duration * 1000, 1),
+            "timings_ms": {k: round(v * 1000, 1) for k, v in ctx["timings"].items()},
+            **ctx["extra"],
+        }, ensure_ascii=False, default=str))
+
+
+def _make_access_logger():
+    log = logging.getLogger("access")
+    log.setLevel(logging.INFO)
+    log.propagate = False  # uvicorn / api_server のログ形式と混ぜない（1行1 JSON）
+    if not log.handlers:
+        handler = logging.FileHandler(ACCESS_LOG_FILE, encoding="utf-8") if ACCESS_LOG_FILE else logging.StreamHandler(sys.stdout)
+        handler.setFormatter(logging.Formatter("%(message)s"))
+        log.addHandler(handler)
+    return log
+
+
+access_logger = _make_access_logger()
@@ -0,0 +1,113 @@
+# phase2/scripts/reranker.py
+"""
+クロスエンコーダ（bge-reranker）による再ランキング。
+検索で多めに取った候補を (質問, チャンク本文) のペアとして1回の forward でまとめて採点する。
+スコアは (質問ハッシュ, チャンクID, 本文ハッシュ) をキーに LRU キャッシュする。
+RERANK_SERVER_URL を設定すると、推論は --rerank-model 付きの embed_server.py に依頼し、モデルはこのプロセスに読み込まない
+（サービスが使えないときは例外になり、呼び出し側は検索順にフォールバックする）。
+"""
+import os
+import hashlib
+import threading
+from collections import OrderedDict
+
+from embed_client import get_rerank_client, drop_embed_client, EmbedServiceError
+
+RERANK_ENABLED = os.getenv("RERANK", "1") not in ("0", "false", "False")
+RERANK_MODEL = os.getenv("RERANK_MODEL", "BAAI/bge-reranker-v2-m3")
+RERANK_CANDIDATES = int(os.getenv("RERANK_CANDIDATES", "30"))
+RERANK_BUDGET_MS = float(os.getenv("RERANK_BUDGET_MS", "1500"))
+RERANK_MAX_LENGTH = int(os.getenv("RERANK_MAX_LENGTH", "512"))
+RERANK_CACHE_SIZE = int(os.getenv("RERANK_CACHE_SIZE", "20000"))
+RERANK_SERVER_URL = os.getenv("RERANK_SERVER_URL", "").rstrip("/")
+
+# device 判定（CUDA が無ければ自動で CPU）
+try:
+    import torch  # noqa: F401
+    DEVICE = "cuda" if getattr(torch, "cuda", None) and torch.cuda.is_available() else "cpu"
+except Exception:
+    DEVICE = "cpu"
+
+
+def _sha(text: str) -> str:
+    return hashlib.sha256((text or "").encode("utf-8")).hexdigest()[:24]
+
+
+class Reranker:
+    def __init__(self, model_name: str = RERANK_MODEL, max_length: int = RERANK_MAX_LENGTH,
+                 cache_size: int = RERANK_CACHE_SIZE, server_url: str = RERANK_SERVER_URL):
+        self.model_name = model_name
+        self.server_url = server_url
+        self.max_length = max_length
+        self.cache_size = cache_size
+        self._model = None
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+        self.cache_hits = 0
+        self.cache_misses = 0
+        self.fallbacks = 0  # 時間予算を超えて検索順のまま返した回数（呼び出し側で加算）
+
+    def get_model(self):
+        if self._model is None:
+            from sentence_transformers import CrossEncoder
+
+            print(f"[INFO] load reranker {self.model_name} (device={DEVICE})")
+            self._model = CrossEncoder(self.model_name, max_length=self.max_length, device=DEVICE)
+        return self._model
+
+    def predict(self, query: str, texts):
+        if self.server_url:
+            remote = get_rerank_client(self.model_name, self.server_url)
+            if remote is None:
+                raise EmbedServiceError(f"rerank service {self.server_url} unavailable")
+            try:
+                return remote.rerank(query, texts)
+            except EmbedServiceError:
+                drop_embed_client(self.model_name, self.server_url, field="rerank_model")
+                raise
+        pairs = [(query, t) for t in texts]
+        return self.get_model().predict(pairs, batch_size=len(pairs), show_progress_bar=False)
+
+    def score(self, query: str, hits):
+        """hits（retrieval のヒット）それぞれの関連度スコアを返す。未キャッシュ分だけ1回で推論する。"""
+        qh = _sha(query)
+        keys = [(qh, h["uuid"], _sha(h["properties"].get("content"))) for h in hits]
+        with self._lock:
+            scores = [self._cache.get(k) for k in keys]
+            for k, sc in zip(keys, scores):
+                if sc is not None:
+                    self._cache.move_to_end(k)
+        missing = [i for i, sc in enumerate(scores) if sc is None]
+        self.cache_hits += len(hits) - len(missing)
+        self.cache_misses += len(missing)
+
+        if missing:
+            fresh = self.predict(query, [hits[i]["properties"].get("content") or "" for i in missing])
+            with self._lock:
+                for i, sc in zip(missing, fresh):
+                    scores[i] = float(sc)
+                    self._cache[keys[i]] = float(sc)
+                while len(self._cache) > self.cache_size:
+                    self._cache.popitem(last=False)
+        return scores
+
+    def rerank(self, query: str, hits, top_k: int):
+        scores = self.score(query, hits)
+        ranked = [dict(h, rerank=sc, retrieval_score=h["score"], score=sc) for h, sc in zip(hits, scores)]
+        return sorted(ranked, key=lambda h: h["rerank"], reverse=True)[:top_k]
+
+    def stats(self) -> dict:
+        total = self.cache_hits + self.cache_misses
+        return {
+            "model": self.model_name,
+            "server": self.server_url or None,
+            "cache_entries": len(self._cache),
+            "cache_hits": self.cache_hits,
+            "cache_misses": self.cache_misses,
+            "cache_hit_rate": round(self.cache_hits / total, 4) if total else 0.0,
+            "fallbacks": self.fallbacks,
+        }
+
+
+def make_reranker():
+    return Reranker() if RERANK_ENABLED else None
@@ -0,0 +1,206 @@
+# phase2/scripts/retrieval.py
+"""
+ConfluenceChunk の検索（search_weaviate.py / API サーバー共通）。
+
+mode:
+  dense  : bge-m3 ベクトルの near_vector
+  bm25   : content / title の BM25
+  hybrid : 上記2つを融合
+           fusion=rrf      -> 両方を並列に over-fetch してクライアント側で Reciprocal Rank Fusion
+           fusion=weaviate -> Weaviate の hybrid(alpha, relativeScoreFusion)
+
+戻り値のヒットは dict:
+  {"uuid", "properties", "score", "distance", "bm25", "ranks", "vector"}
+score は mode によらず大きいほど関連が高い値（0〜1 目安）。
+dense の score はコレクションの距離関数（cosine / dot / l2-squared）によらず cos 類似度相当に直す
+（ベクトルは正規化済みなので同じ値になり、refine の閾値や回答キャッシュの判定を距離関数ごとに変えなくてよい）。
+"""
+import os
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from weaviate.classes.query import HybridFusion, MetadataQuery
+
+RETRIEVAL_MODE = os.getenv("RETRIEVAL_MODE", "hybrid")        # dense / bm25 / hybrid
+HYBRID_FUSION = os.getenv("HYBRID_FUSION", "rrf")             # rrf / weaviate
+HYBRID_ALPHA = float(os.getenv("HYBRID_ALPHA", "0.5"))        # 1.0 = dense のみ, 0.0 = bm25 のみ
+HYBRID_CANDIDATES = int(os.getenv("HYBRID_CANDIDATES", "20"))  # rrf で各検索から取る件数
+RRF_K = int(os.getenv("RRF_K", "60"))
+
+RETURN_PROPERTIES = ["pageId", "title", "chunkIndex", "headingPath", "url", "content", "updatedAt"]
+BM25_PROPERTIES = ["content", "title^2"]
+
+_pool = ThreadPoolExecutor(max_workers=4, thread_name_prefix="retrieval")
+_distance_metrics = {}  # コレクション名 -> 距離関数（config は1回だけ取得する）
+
+
+def near_vector_compat(coll, vec, k, include_vector=False, return_properties=None):
+    """weaviate-client v4.6.0 / v4.16 どちらでも動くように引数名を切替"""
+    kwargs_base = dict(
+        limit=k,
+        return_properties=return_properties or RETURN_PROPERTIES,
+        include_vector=include_vector,
+    )
+
+    # まずは v4.6.0 互換（near_vector= / return_metadata=）
+    try:
+        return coll.query.near_vector(
+            near_vector=vec,
+            return_metadata=MetadataQuery(distance=True),
+            **kwargs_base,
+        )
+    except TypeError:
+        # 新しめのAPI（vector= / metadata=）にフォールバック
+        return coll.query.near_vector(
+            vector=vec,
+            metadata=MetadataQuery(distance=True),
+            **kwargs_base,
+        )
+
+
+def _vector_of(o):
+    vec = getattr(o, "vector", None)
+    if isinstance(vec, dict):  # named vectors 形式（例: {"default": [...] }）
+        return next(iter(vec.values()), None)
+    return vec or None
+
+
+def _hit(o, **extra):
+    hit = {
+        "uuid": str(o.uuid),
+        "properties": dict(o.properties or {}),
+        "score": None,
+        "distance": None,
+        "bm25": None,
+        "ranks": {},
+        "vector": _vector_of(o),
+    }
+    hit.update(extra)
+    return hit
+
+
+def distance_metric(coll) -> str:
+    """コレクションの距離関数（create_confluence_chunk_class.py --distance）。取得できなければ cosine とみなす。"""
+    name = getattr(coll, "name", None)
+    if name not in _distance_metrics:
+        try:
+            _distance_metrics[name] = coll.config.get().vector_index_config.distance_metric.value
+        except Exception:
+            _distance_metrics[name] = "cosine"
+    return _distance_metrics[name]
+
+
+def distance_to_score(dist: float, metric: str) -> float:
+    """正規化ベクトルの距離を cos 類似度に直す（dot は -内積、l2-squared は 2 - 2cos）。"""
+    if metric == "dot":
+        return -dist
+    if metric == "l2-squared":
+        return 1.0 - dist / 2
+    return 1.0 - dist
+
+
+def dense_search(coll, vec, k, include_vector=False):
+    res = near_vector_compat(coll, vec, k, include_vector=include_vector)
+    metric = distance_metric(coll)
+    hits = []
+    for rank, o in enumerate(res.objects):
+        dist = getattr(getattr(o, "metadata", None), "distance", None)
+        score = distance_to_score(dist, metric) if dist is not None else None
+        hits.append(_hit(o, distance=dist, score=score, ranks={"dense": rank}))
+    return hits
+
+
+def bm25_search(coll, query, k, include_vector=False):
+    res = coll.query.bm25(
+        query=query,
+        query_properties=BM25_PROPERTIES,
+        limit=k,
+        return_metadata=MetadataQuery(score=True),
+        return_properties=RETURN_PROPERTIES,
+        include_vector=include_vector,
+    )
+    hits = []
+    for rank, o in enumerate(res.objects):
+        bm25 = getattr(o.metadata, "score", None)
+        hits.append(_hit(o, bm25=bm25, score=bm25, ranks={"bm25": rank}))
+    return hits
+
+
+def weaviate_hybrid(coll, query, vec, k, alpha, include_vector=False):
+    res = coll.query.hybrid(
+        query=query,
+        vector=vec,
+        alpha=alpha,
+        query_properties=BM25_PROPERTIES,
+        fusion_type=HybridFusion.RELATIVE_SCORE,
+        limit=k,
+        return_metadata=MetadataQuery(score=True),
+        return_properties=RETURN_PROPERTIES,
+        include_vector=include_vector,
+    )
+    return [
+        _hit(o, score=getattr(o.metadata, "score", None), ranks={"hybrid": rank})
+        for rank, o in enumerate(res.objects)
+    ]
+
+
+def rrf_fuse(named_lists, k, rrf_k=RRF_K, weights=None):
+    """
+    Reciprocal Rank Fusion。named_lists は {"dense": hits, "bm25": hits}。
+    score は「全リストで1位」のときに 1.0 になるよう正規化する。
+    """
+    weights = weights or {name: 1.0 for name in named_lists}
+    fused = {}
+    for name, hits in named_lists.items():
+        w = weights.get(name, 1.0)
+        for rank, h in enumerate(hits):
+            cur = fused.get(h["uuid"])
+            if cur is None:
+                cur = fused[h["uuid"]] = dict(h, ranks={}, score=0.0)
+            cur["ranks"][name] = rank
+            cur["score"] += w / (rrf_k + rank + 1)
+            for key in ("distance", "bm25", "vector"):
+                if cur.get(key) is None and h.get(key) is not None:
+                    cur[key] = h[key]
+    best = sum(weights.get(name, 1.0) for name in named_lists) / (rrf_k + 1)
+    out = sorted(fused.values(), key=lambda h: h["score"], reverse=True)[:k]
+    for h in out:
+        h["score"] = h["score"] / best if best else h["score"]
+    return out
+
+
+def _timed(timings, name, fn, *args, **kwargs):
+    t0 = time.perf_counter()
+    try:
+        return fn(*args, **kwargs)
+    finally:
+        timings[name] = time.perf_counter() - t0
+
+
+def search(coll, query, vec, k, mode=None, fusion=None, alpha=None, candidates=None,
+           include_vector=False, timings=None):
+    """
+    mode に応じて検索し、ヒットのリストを返す。timings（dict）を渡すと段階ごとの秒数を記録する。
+    vec は mode=bm25 のときは不要（None 可）。
+    """
+    mode = mode or RETRIEVAL_MODE
+    fusion = fusion or HYBRID_FUSION
+    alpha = HYBRID_ALPHA if alpha is None else alpha
+    timings = {} if timings is None else timings
+
+    if mode == "dense":
+        return _timed(timings, "dense", dense_search, coll, vec, k, include_vector)
+    if mode == "bm25":
+        return _timed(timings, "bm25", bm25_search, coll, query, k, include_vector)
+    if mode != "hybrid":
+        raise ValueError(f"unknown retrieval mode: {mode}")
+
+    if fusion == "weaviate":
+        return _timed(timings, "hybrid", weaviate_hybrid, coll, query, vec, k, alpha, include_vector)
+
+    n = max(k, candidates or HYBRID_CANDIDATES)
+    f_dense = _pool.submit(_timed, timings, "dense", dense_search, coll, vec, n, include_vector)
+    f_bm25 = _pool.submit(_timed, timings, "bm25", bm25_search, coll, query, n, include_vector)
+    lists = {"dense": f_dense.result(), "bm25": f_bm25.result()}
+    weights = {"dense": alpha, "bm25": 1.0 - alpha}
+    return _timed(timings, "fuse", rrf_fuse, lists, k, RRF_K, weights)
@@ -1,9 +1,14 @@
 import os
+import time
 import argparse
 import json
 import weaviate
 from dotenv import load_dotenv
-from sentence_transformers import SentenceTransformer
+
+import retrieval
+from collection_alias import resolve_alias
+from embeddings import get_embedder
+from reranker import Reranker, RERANK_CANDIDATES
 
 # ---- env ----
 ENV_PATH = os.path.join(os.path.dirname(__file__), "..", ".env")
@@ -14,97 +19,75 @@ WEAVIATE_PORT = int(os.getenv("WEAVIATE_PORT", "8080"))
 WEAVIATE_GRPC = int(os.getenv("WEAVIATE_GRPC_PORT", "50051"))
 CLASS_NAME    = os.getenv("WEAVIATE_CLASS", "ConfluenceChunk")
 
-MODEL_PATH = os.getenv("MODEL_PATH")  # 例: ./phase2/models/bge-m3
-MODEL_NAME = os.getenv("EMBED_MODEL_NAME", "BAAI/bge-m3")
-
-# device
-try:
-    import torch  # noqa
-    DEVICE = "cuda" if getattr(torch, "cuda", None) and torch.cuda.is_available() else "cpu"
-except Exception:
-    DEVICE = "cpu"
-
-def get_model():
-    path = MODEL_PATH if MODEL_PATH else MODEL_NAME
-    print(f"[INFO] load model {path} (device={DEVICE})")
-    return SentenceTransformer(path, device=DEVICE)
-
 def embed_query(text: str):
-    model = get_model()
-    vec = model.encode([f"query: {text}"], normalize_embeddings=True)[0]
-    return vec.tolist()
-
-def near_vector_compat(coll, vec, k):
-    """weaviate-client v4.6.0 / v4.16 どちらでも動くように引数名を切替"""
-    try:
-        # 4.x 系で共通の型
-        from weaviate.classes.query import MetadataQuery
-    except Exception:
-        MetadataQuery = None
-
-    kwargs_base = dict(
-        limit=k,
-        return_properties=["pageId", "title", "chunkIndex", "url", "content"],
-        include_vector=False,
-    )
-
-    # まずは v4.6.0 互換（near_vector= / return_metadata=）
-    try:
-        if MetadataQuery:
-            return coll.query.near_vector(
-                near_vector=vec,
-                return_metadata=MetadataQuery(distance=True),
-                **kwargs_base,
-            )
-        else:
-            return coll.query.near_vector(near_vector=vec, **kwargs_base)
-    except TypeError:
-        # 新しめのAPI（vector= / metadata=）にフォールバック
-        if MetadataQuery:
-            return coll.query.near_vector(
-                vector=vec,
-                metadata=MetadataQuery(distance=True),
-                **kwargs_base,
-            )
-        else:
-            return coll.query.near_vector(vector=vec, **kwargs_base)
-
-def search_with_client(query: str, k: int = 5):
-    vec = embed_query(query)
+    """埋め込みサービス → キャッシュ → その場でモデル読み込み、の順で使えるもので埋め込む（embeddings.py）。"""
+    embedder = get_embedder()
+    vec = embedder.embed_query(text)
+    if embedder.source == "service":
+        print("[INFO] embedded via service")
+    return vec
+
+def search_with_client(query: str, k: int = 5, mode=None, fusion=None, alpha=None, timings=None, rerank=False):
+    timings = {} if timings is None else timings
+    mode = mode or retrieval.RETRIEVAL_MODE
+    vec = None
+    if mode != "bm25":
+        t0 = time.perf_counter()
+        vec = embed_query(query)
+        timings["embed"] = time.perf_counter() - t0
+    t0 = time.perf_counter()
     client = weaviate.connect_to_local(host=WEAVIATE_HOST, port=WEAVIATE_PORT, grpc_port=WEAVIATE_GRPC)
+    timings["connect"] = time.perf_counter() - t0
     try:
-        coll = client.collections.get(CLASS_NAME)
-        res = near_vector_compat(coll, vec, k)
-        return res
+        coll = client.collections.get(resolve_alias(CLASS_NAME))
+        n = max(k, RERANK_CANDIDATES) if rerank else k
+        hits = retrieval.search(coll, query, vec, n, mode=mode, fusion=fusion, alpha=alpha, timings=timings)
     finally:
         client.close()
+    if rerank:
+        t0 = time.perf_counter()
+        hits = Reranker().rerank(query, hits, k)
+        timings["rerank"] = time.perf_counter() - t0
+    return hits
 
 def main():
     ap = argparse.ArgumentParser(description="Vector search against Weaviate (ConfluenceChunk)")
     ap.add_argument("query", nargs="*", help="検索クエリ（例: SQL の実行方法）")
     ap.add_argument("-k", "--limit", type=int, default=5, help="返す件数")
     ap.add_argument("--raw", action="store_true", help="生JSONを出力")
+    ap.add_argument("--mode", choices=["dense", "bm25", "hybrid"], default=retrieval.RETRIEVAL_MODE, help="検索方式")
+    ap.add_argument("--fusion", choices=["rrf", "weaviate"], default=retrieval.HYBRID_FUSION, help="hybrid の融合方式")
+    ap.add_argument("--alpha", type=float, default=retrieval.HYBRID_ALPHA, help="hybrid の重み（1.0=dense のみ）")
+    ap.add_argument("--rerank", action="store_true", help=f"上位 {RERANK_CANDIDATES} 件をクロスエンコーダで並べ替える")
     args = ap.parse_args()
 
     q = " ".join(args.query) if args.query else "SQL の実行方法"
-    print(f"[INFO] query: {q}  (k={args.limit})")
+    print(f"[INFO] query: {q}  (k={args.limit}, mode={args.mode})")
 
-    res = search_with_client(q, k=args.limit)
-    objs = getattr(res, "objects", []) or []
+    timings = {}
+    objs = search_with_client(
+        q, k=args.limit, mode=args.mode, fusion=args.fusion, alpha=args.alpha, timings=timings, rerank=args.rerank
+    )
+    print("[INFO] timings " + "  ".join(f"{name}={sec * 1000:.1f}ms" for name, sec in timings.items()))
+    cache = get_embedder().cache
+    if cache is not None:
+        print(f"[INFO] embed cache: {cache.stats()}")
 
     if args.raw:
         payload = {
             "objects": [
                 {
-                    "id": o.uuid,
-                    "properties": o.properties,
-                    # v4.6 は o.metadata.distance が入る想定（ない場合は None）
-                    "distance": getattr(getattr(o, "metadata", None), "distance", None),
+                    "id": o["uuid"],
+                    "properties": o["properties"],
+                    "score": o["score"],
+                    "distance": o["distance"],
+                    "bm25": o["bm25"],
+                    "ranks": o["ranks"],
                 }
                 for o in objs
             ]
         }
-        print(json.dumps(payload, ensure_ascii=False, indent=2))
+        print(json.dumps(payload, ensure_ascii=False, indent=2, default=str))
         return
 
     if not objs:
@@ -112,10 +95,15 @@ def main():
         return
 
     for i, o in enumerate(objs, 1):
-        p = o.properties or {}
-        dist = getattr(getattr(o, "metadata", None), "distance", None)
+        p = o["properties"]
+        score = f"{o['score']:.3f}" if o["score"] is not None else None
         head = (p.get("content") or "").replace("\n", " ")[:120]
-        print(f"{i}. {p.get('title')}  (pageId={p.get('pageId')}, chunk={p.get('chunkIndex')}, dist={dist})")
+        print(
+            f"{i}. {p.get('title')}  (pageId={p.get('pageId')}, chunk={p.get('chunkIndex')}, "
+            f"score={score}, dist={o['distance']}, ranks={o['ranks']})"
+        )
+        if p.get("headingPath"):
+            print(f"   [{p['headingPath']}]")
         print(f"   {head} ...")
         if p.get("url"):
             print(f"   {p['url']}")
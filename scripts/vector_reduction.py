@@ -0,0 +1,93 @@
+# phase2/scripts/vector_reduction.py
+"""
+Weaviate に保存するベクトルの次元削減（create_confluence_chunk_class.py --reduce で設定）。
+
+  truncate:256  先頭 256 次元だけを使う（学習不要）
+  pca:256       コーパスのベクトルで PCA を学習し、上位 256 主成分に射影する
+
+設定は data/vector_reduction/<コレクション名>.npz に保存され、embeddings.py が読み込んで
+passage（ingest）と質問（search / API）の両方に同じ変換をかける。変換後は L2 正規化し直す。
+埋め込みキャッシュと埋め込みサービスは 1024 次元のまま扱い、変換は最後にかける。
+"""
+import os
+
+import numpy as np
+
+REDUCTION_DIR = os.path.join(os.path.dirname(__file__), "..", "data", "vector_reduction")
+
+
+def reducer_path(class_name: str) -> str:
+    return os.path.join(REDUCTION_DIR, f"{class_name}.npz")
+
+
+def parse_spec(spec: str):
+    """'pca:256' -> ('pca', 256)、'none' / '' -> (None, None)。"""
+    if not spec or spec == "none":
+        return None, None
+    method, _, dim = spec.partition(":")
+    if method not in ("truncate", "pca") or not dim.isdigit():
+        raise ValueError(f"invalid reduction {spec!r} (expected none / truncate:<dim> / pca:<dim>)")
+    return method, int(dim)
+
+
+class VectorReducer:
+    def __init__(self, method: str, dim: int, mean=None, components=None):
+        self.method = method
+        self.dim = dim
+        self.mean = mean              # pca: (in_dim,)
+        self.components = components  # pca: (dim, in_dim)
+
+    @classmethod
+    def truncate(cls, dim: int):
+        return cls("truncate", dim)
+
+    @classmethod
+    def fit_pca(cls, vectors, dim: int):
+        x = np.asarray(vectors, dtype=np.float32)
+        if len(x) < dim:
+            raise ValueError(f"PCA needs at least {dim} vectors to fit (got {len(x)})")
+        mean = x.mean(axis=0)
+        # 共分散行列の固有ベクトル（in_dim x in_dim なので件数に依らず軽い）
+        cov = np.cov(x - mean, rowvar=False)
+        eigvals, eigvecs = np.linalg.eigh(cov)
+        top = np.argsort(eigvals)[::-1][:dim]
+        reducer = cls("pca", dim, mean, eigvecs[:, top].T.astype(np.float32))
+        reducer.explained = float(eigvals[top].sum() / eigvals.sum())
+        return reducer
+
+    def apply(self, vectors):
+        """list[list[float]] -> 次元削減 + L2 正規化した list[list[float]]。"""
+        if not len(vectors):
+            return []
+        x = np.asarray(vectors, dtype=np.float32)
+        if self.method == "truncate":
+            y = x[:, :self.dim]
+        else:
+            y = (x - self.mean) @ self.components.T
+        y = y / np.maximum(np.linalg.norm(y, axis=1, keepdims=True), 1e-12)
+        return y.tolist()
+
+    @property
+    def spec(self) -> str:
+        return f"{self.method}:{self.dim}"
+
+    def save(self, path: str):
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        arrays = {"method": np.array(self.method), "dim": np.array(self.dim)}
+        if self.method == "pca":
+            arrays.update(mean=self.mean, components=self.components)
+        np.savez(path, **arrays)
+
+    @classmethod
+    def load(cls, path: str):
+        with np.load(path) as z:
+            method, dim = str(z["method"]), int(z["dim"])
+            if method == "pca":
+                return cls(method, dim, z["mean"], z["components"])
+            return cls(method, dim)
+
+
+def load_reducer(class_name: str):
+    """コレクションに次元削減が設定されていれば VectorReducer、無ければ None。"""
+    path = reducer_path(class_name)
+    return VectorReducer.load(path) if os.path.exists(path) else None
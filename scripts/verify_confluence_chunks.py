@@ -4,6 +4,10 @@ import weaviate
 from dotenv import load_dotenv
 from weaviate.classes.query import Filter
 
+from collection_alias import resolve_alias
+from embeddings import EMBED_DIM
+from vector_reduction import load_reducer
+
 # ---- env 読み込み（phase2/.env を明示）----
 ENV_PATH = os.path.join(os.path.dirname(__file__), "..", ".env")
 load_dotenv(dotenv_path=ENV_PATH)
@@ -19,15 +23,23 @@ GRPC_PORT = int(os.getenv("WEAVIATE_GRPC_PORT", "50051"))
 TARGET_PAGE_ID = sys.argv[1] if len(sys.argv) > 1 else None
 
 
+def dim_status(dim: int) -> str:
+    reducer = load_reducer(resolve_alias(CLASS_NAME))
+    expected = reducer.dim if reducer is not None else EMBED_DIM
+    label = f"bge-m3 {reducer.spec}" if reducer is not None else "bge-m3"
+    return "OK" if dim == expected else f"MISMATCH: expected {expected} for {label}"
+
+
 def main():
     client = weaviate.connect_to_local(host=HOST, port=PORT, grpc_port=GRPC_PORT)
     try:
-        coll = client.collections.get(CLASS_NAME)
+        name = resolve_alias(CLASS_NAME)
+        coll = client.collections.get(name)
 
         # 1) 総件数
         agg = coll.aggregate.over_all(total_count=True)
         total = agg.total_count or 0
-        print(f"== {CLASS_NAME} total objects: {total}")
+        print(f"== {CLASS_NAME} ({name}) total objects: {total}")
 
         # 2) サンプル表示（最新10件）
         print("\n== sample objects (limit=10)")
@@ -48,13 +60,13 @@ def main():
             res2 = coll.query.fetch_objects(
                 filters=filt,
                 limit=100,
-                return_properties=["pageId", "title", "chunkIndex", "updatedAt", "content"],
+                return_properties=["pageId", "title", "chunkIndex", "headingPath", "updatedAt", "content"],
                 include_vector=False,
             )
             for o in res2.objects:
                 p = o.properties
                 head = (p.get("content") or "").replace("\n", " ")[:120]
-                print(f"- chunk={p.get('chunkIndex'):>3}  title={p.get('title')}")
+                print(f"- chunk={p.get('chunkIndex'):>3}  title={p.get('title')}  heading={p.get('headingPath') or '-'}")
                 print(f"  {head} ...")
             print(f"(found {len(res2.objects)} chunks)")
 
@@ -66,9 +78,9 @@ def main():
             if isinstance(vec, dict):  # named vectors 形式（例: {"default": [...] }）
                 name, arr = next(iter(vec.items()))
                 dim = len(arr) if arr is not None else 0
-                print(f"vector name={name}, dim={dim}  (expected 1024 for bge-m3)")
+                print(f"vector name={name}, dim={dim}  ({dim_status(dim)})")
             elif isinstance(vec, list):  # 単一ベクトル（旧形式）
-                print(f"vector dim={len(vec)}  (expected 1024 for bge-m3)")
+                print(f"vector dim={len(vec)}  ({dim_status(len(vec))})")
             else:
                 print("no vector on object")
         else:
@@ -0,0 +1,86 @@
+import os
+import sys
+import asyncio
+import threading
+
+sys.path.insert(0, os.path.join(os.path.dirname(__file__), "..", "scripts"))
+
+from micro_batcher import MicroBatcher  # noqa: E402
+
+
+def make_blocking_batcher():
+    """最初の encode だけ gate が開くまで止まるバッチャ（その間に後続の要求を待ち行列に積める）。"""
+    gate = threading.Event()
+    started = threading.Event()
+    calls = []
+
+    def encode(texts, normalize):
+        calls.append(list(texts))
+        if len(calls) == 1:
+            started.set()
+            gate.wait(5)
+        return [[float(len(t))] for t in texts]
+
+    return MicroBatcher(encode, max_batch=8, max_wait_ms=1), gate, started, calls
+
+
+def test_cancelled_request_does_not_stop_batcher():
+    batcher, gate, started, calls = make_blocking_batcher()
+    first = batcher.submit(["a"])
+    assert started.wait(5)
+    cancelled = batcher.submit(["bb"])
+    assert cancelled.cancel()
+    gate.set()
+    assert first.result(timeout=5) == [[1.0]]
+
+    assert batcher.submit(["ccc"]).result(timeout=5) == [[3.0]]
+    assert ["bb"] not in calls
+
+
+def test_wrap_future_timeout_does_not_stop_batcher():
+    batcher, gate, started, _ = make_blocking_batcher()
+
+    async def scenario():
+        # api_server の embed_query_async と同じく asyncio.wrap_future で待ち、タイムアウトで諦める
+        blocked = asyncio.wrap_future(batcher.submit(["a"]))
+        await asyncio.get_running_loop().run_in_executor(None, started.wait, 5)
+        queued = asyncio.wrap_future(batcher.submit(["bb"]))
+        try:
+            await asyncio.wait_for(queued, timeout=0.01)
+        except asyncio.TimeoutError:
+            pass
+        gate.set()
+        await blocked
+        return await asyncio.wait_for(asyncio.wrap_future(batcher.submit(["ccc"])), timeout=5)
+
+    assert asyncio.run(scenario()) == [[3.0]]
+
+
+def test_encode_error_is_delivered_and_batcher_keeps_running():
+    def encode(texts, normalize):
+        if "bad" in texts:
+            raise ValueError("boom")
+        return [[1.0] for _ in texts]
+
+    batcher = MicroBatcher(encode, max_batch=1, max_wait_ms=0)
+    try:
+        batcher.submit(["bad"]).result(timeout=5)
+    except ValueError as e:
+        assert str(e) == "boom"
+    else:
+        raise AssertionError("expected ValueError")
+    assert batcher.submit(["ok"]).result(timeout=5) == [[1.0]]
+
+
+def test_batch_sizes_are_observed_by_histogram():
+    from request_metrics import Histogram, REGISTRY
+    from micro_batcher import HIST_BUCKETS
+
+    hist = Histogram("test_embed_batch_size", "Texts per batch", buckets=HIST_BUCKETS)
+    REGISTRY.remove(hist)
+    batcher = MicroBatcher(lambda texts, normalize: [[0.0] for _ in texts], max_batch=8, max_wait_ms=1,
+                           histogram=hist)
+    batcher.submit(["a", "b", "c"]).result(timeout=5)
+    lines = hist.render()
+    assert "test_embed_batch_size_count 1" in lines
+    assert "test_embed_batch_size_sum 3.0" in lines
@@ -0,0 +1,104 @@
+# /ui/history_store.py
+"""
+質問履歴の保存先（SQLite, WAL モード）。
+
+以前は回答のたびに logs/confluence_qa_history.json 全体を書き直し、セッションごとに全件を読み込んでいたため、
+履歴の件数に比例して遅くなり、複数ユーザーが同時に書くと互いの追記を上書きしていた。
+ここでは1件ずつ INSERT し、表示はユーザーごとに1ページ分だけ読む。
+WAL なので書き込み中でも他のセッション（別プロセスの Streamlit を含む）から読める。
+
+既存の JSON 履歴は、初回に開いたときに1度だけ取り込む（元のファイルは残す）。
+"""
+import os
+import json
+import sqlite3
+import threading
+
+DEFAULT_PATH = os.getenv("HISTORY_DB", os.path.join("logs", "confluence_qa_history.sqlite"))
+LEGACY_JSON_PATH = os.path.join("logs", "confluence_qa_history.json")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS history (
+    id               INTEGER PRIMARY KEY AUTOINCREMENT,
+    user_id          TEXT,
+    question         TEXT,
+    refined_question TEXT,
+    answer           TEXT,
+    timestamp        TEXT
+);
+CREATE INDEX IF NOT EXISTS history_user_id ON history (user_id, id);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT
+);
+"""
+
+_COLS = ("id", "user_id", "question", "refined_question", "answer", "timestamp")
+
+
+class HistoryStore:
+    def __init__(self, path: str = DEFAULT_PATH, legacy_json: str = LEGACY_JSON_PATH):
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self.path = path
+        self.conn = sqlite3.connect(path, check_same_thread=False, timeout=10)
+        self._lock = threading.Lock()
+        self.conn.execute("PRAGMA journal_mode=WAL")
+        self.conn.execute("PRAGMA synchronous=NORMAL")
+        self.conn.executescript(_SCHEMA)
+        if legacy_json:
+            self._import_json(legacy_json)
+
+    def _import_json(self, path: str):
+        if not os.path.exists(path) or os.path.getsize(path) == 0:
+            return
+        with self._lock:
+            # 複数プロセスが同時に開いても1回だけ取り込むよう、確認と取り込みを1トランザクションで行う
+            self.conn.execute("BEGIN IMMEDIATE")
+            try:
+                if not self.conn.execute("SELECT 1 FROM meta WHERE key = 'imported_json'").fetchone():
+                    with open(path, encoding="utf-8") as f:
+                        items = json.load(f)
+                    self.conn.executemany(
+                        "INSERT INTO history (user_id, question, refined_question, answer, timestamp) "
+                        "VALUES (?, ?, ?, ?, ?)",
+                        [
+                            (it.get("user_id"), it.get("question"), it.get("refined_question"), it.get("answer"),
+                             it.get("timestamp"))
+                            for it in items
+                        ],
+                    )
+                    self.conn.execute("INSERT INTO meta (key, value) VALUES ('imported_json', ?)", (path,))
+                self.conn.commit()
+            except Exception:
+                self.conn.rollback()
+                raise
+
+    def append(self, user_id: str, question: str, answer: str, timestamp: str, refined_question: str = None) -> int:
+        with self._lock, self.conn:
+            cur = self.conn.execute(
+                "INSERT INTO history (user_id, question, refined_question, answer, timestamp) VALUES (?, ?, ?, ?, ?)",
+                (user_id, question, refined_question, answer, timestamp),
+            )
+            return cur.lastrowid
+
+    def page(self, user_id: str, page: int = 0, page_size: int = 10):
+        """user_id の履歴を新しい順に page 番目（0 始まり）の1ページ分だけ返す。"""
+        with self._lock:
+            rows = self.conn.execute(
+                f"SELECT {', '.join(_COLS)} FROM history WHERE user_id = ? ORDER BY id DESC LIMIT ? OFFSET ?",
+                (user_id, page_size, page * page_size),
+            ).fetchall()
+        return [dict(zip(_COLS, r)) for r in rows]
+
+    def count(self, user_id: str) -> int:
+        with self._lock:
+            return self.conn.execute("SELECT COUNT(*) FROM history WHERE user_id = ?", (user_id,)).fetchone()[0]
+
+    def delete(self, record_id: int, user_id: str) -> bool:
+        """1件削除する。他のユーザーの履歴は消さない。"""
+        with self._lock, self.conn:
+            cur = self.conn.execute("DELETE FROM history WHERE id = ? AND user_id = ?", (record_id, user_id))
+            return cur.rowcount > 0
+
+    def close(self):
+        self.conn.close()
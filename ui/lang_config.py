@@ -29,6 +29,10 @@ LANG = {
         "cleared": "履歴を削除しました",
         "user": "ユーザー",
         "time": "日時",
+        "no_history": "履歴はまだありません",
+        "prev_page": "◀ 前へ",
+        "next_page": "次へ ▶",
+        "page_info": "{page} / {pages} ページ（全 {total} 件）",
         "prompt_type_label": "プロンプトタイプを選んでください",
         "prompt_type_detail": "詳細回答ver",
         "prompt_type_simple": "簡易回答ver",
@@ -62,6 +66,10 @@ LANG = {
         "cleared": "History cleared.",
         "user": "User",
         "time": "Time",
+        "no_history": "No history yet.",
+        "prev_page": "◀ Prev",
+        "next_page": "Next ▶",
+        "page_info": "Page {page} of {pages} ({total} items)",
         "prompt_type_label": "Select prompt type",
         "prompt_type_detail": "Detailed Answer",
         "prompt_type_simple": "Simple Answer",
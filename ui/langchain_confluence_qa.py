@@ -5,9 +5,12 @@ import requests
 import json
 import logging
 import os
+import time
+import uuid
 import pandas as pd
 from datetime import datetime
 from lang_config import LANG
+from history_store import HistoryStore
 
 # ===== ページ設定 =====
 st.set_page_config(page_title="Confluence QA Bot", layout="centered")
@@ -21,6 +24,22 @@ logging.basicConfig(
     filemode="a",
 )
 
+
+def iter_sse(res):
+    """Server-Sent Events のレスポンスを (event, data) の順に返す（data は JSON）。"""
+    event, data = "message", []
+    for line in res.iter_lines(decode_unicode=True):
+        if line is None:
+            continue
+        if not line:
+            if data:
+                yield event, json.loads("\n".join(data))
+            event, data = "message", []
+        elif line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data.append(line[len("data:"):].strip())
+
 # ===== 言語設定 =====
 if "lang" not in st.session_state:
     st.session_state.lang = "ja"  # ← 初期値は日本語
@@ -79,14 +98,18 @@ if st.sidebar.button(T["logout"]):
     st.session_state.user = None
     st.rerun()
 
-# ===== 履歴読み込み =====
-history_path = "logs/confluence_qa_history.json"
-if "history" not in st.session_state:
-    if os.path.exists(history_path) and os.path.getsize(history_path) > 0:
-        with open(history_path, "r", encoding="utf-8") as f:
-            st.session_state.history = json.load(f)
-    else:
-        st.session_state.history = []
+# ===== 履歴（SQLite。全セッションで1つの接続を共有し、表示は1ページ分だけ読む） =====
+HISTORY_PAGE_SIZE = int(os.getenv("HISTORY_PAGE_SIZE", "10"))
+
+
+@st.cache_resource
+def get_history_store():
+    return HistoryStore()
+
+
+history_store = get_history_store()
+if "history_page" not in st.session_state:
+    st.session_state.history_page = 0
 
 if "loading" not in st.session_state:
     st.session_state.loading = False
@@ -108,57 +131,74 @@ input_is_empty = not st.session_state.query_text.strip()
 button_disabled = input_is_empty or st.session_state.loading
 
 if st.button(T["ask_btn"], disabled=button_disabled):
-    logging.info(f"Question: {st.session_state.query_text}")
+    # API サーバーのアクセスログ（request_id）と突き合わせられるよう、質問ごとに id を振って送る
+    request_id = uuid.uuid4().hex
+    logging.info(f"Question: request_id={request_id} {st.session_state.query_text}")
     st.session_state.loading = True
 
     with st.spinner(T["loading"]):
         try:
-            refine_res = requests.post(
-                "http://localhost:8000/refine_question",
-                json={"raw_question": st.session_state.query_text},
-            )
-            if refine_res.status_code != 200:
-                st.error(T["refine_error"])
-                st.session_state.loading = False
-                raise Exception("Refine error")
-
-            refined_question = refine_res.json()["refined_question"]
-
+            # 質問の整形（必要な場合のみ）と回答を1リクエストで行い、回答はトークンごとに表示する
+            t_start = time.perf_counter()
             res = requests.post(
-                "http://localhost:8000/query",
+                "http://localhost:8000/ask_stream",
                 json={
-                    "question": refined_question,
+                    "raw_question": st.session_state.query_text,
                     "prompt_type": prompt_type
-                }
+                },
+                headers={"X-Request-ID": request_id},
+                stream=True,
             )
 
+            stream_error = None
             if res.status_code == 200:
-                result = res.json()
-                st.session_state.answer = result["answer"]
-                st.session_state.sources = result["sources"]
+                res.encoding = "utf-8"
+                placeholder = st.empty()
+                answer, sources, ttft = "", [], None
+                refined_question = st.session_state.query_text
+                for event, data in iter_sse(res):
+                    if event == "sources":
+                        sources = data["sources"]
+                    elif event == "token":
+                        if ttft is None:
+                            ttft = time.perf_counter() - t_start
+                        answer += data["t"]
+                        placeholder.markdown(answer + "▌")
+                    elif event == "done":
+                        answer = data["answer"]
+                        refined_question = data.get("refined_question", refined_question)
+                    elif event == "error":
+                        stream_error = data.get("detail")
+                        break
+                placeholder.empty()
+
+            if res.status_code == 200 and stream_error is None:
+                st.session_state.answer = answer
+                st.session_state.sources = sources
                 st.session_state.last_query = st.session_state.query_text
+                ttft_txt = f"{ttft:.3f}s" if ttft is not None else "n/a"
+                logging.info(
+                    f"Answer streamed: request_id={request_id} ttft={ttft_txt} total={time.perf_counter() - t_start:.3f}s "
+                    f"refined={refined_question != st.session_state.query_text}"
+                )
 
                 timestamp = datetime.now().strftime("%Y-%m-%d %H:%M:%S")
-                st.session_state.history.append(
-                    {
-                        "user_id": st.session_state.user,
-                        "question": st.session_state.query_text,
-                        "refined_question": refined_question,
-                        "answer": st.session_state.answer,
-                        "timestamp": timestamp,
-                    }
+                history_store.append(
+                    user_id=st.session_state.user,
+                    question=st.session_state.query_text,
+                    refined_question=refined_question,
+                    answer=st.session_state.answer,
+                    timestamp=timestamp,
                 )
-
-                with open(history_path, "w", encoding="utf-8") as f:
-                    json.dump(st.session_state.history, f, ensure_ascii=False, indent=2)
+                st.session_state.history_page = 0
 
                 logging.info("Answer generated successfully")
             else:
-                logging.error(f"API error: Status code {res.status_code}")
+                logging.error(f"API error: request_id={request_id} status={res.status_code} {stream_error or ''}")
                 st.error(T["api_error"])
 
         except Exception:
-            logging.exception("API call error")
+            logging.exception(f"API call error: request_id={request_id}")
             st.error(T["conn_error"])
 
         finally:
@@ -183,30 +223,50 @@ if "answer" in st.session_state and not st.session_state.loading:
                 st.markdown(f"**{i}. [{title}]({url})**")
             else:
                 st.markdown(f"**{i}. {title}**")
+            heading = s["metadata"].get("headingPath")
+            if heading:
+                st.caption(f"📑 {heading}")
             if score is not None:
                 st.caption(f"関連度スコア: `{score:.2f}`")
 
-            # 本文プレビュー（冒頭だけ表示）
-            preview = s.get("page_content", "")
+            # 本文プレビュー（API サーバーが冒頭だけ返す）
+            preview = s.get("preview", "")
             if preview:
                 st.text_area(
                     "抜粋",
-                    preview[:300] + ("..." if len(preview) > 300 else ""),
+                    preview,
                     height=100,
                     disabled=True,
                 )
 
-# ===== 履歴表示 =====
+# ===== 履歴表示（ログイン中のユーザーの履歴を新しい順に1ページずつ） =====
 with st.expander(T["history"], expanded=False):
-    for idx, item in enumerate(reversed(st.session_state.history)):
-        st.markdown(f"👤 **{T['user']}**: {item.get('user_id', 'Unknown')}")
-        st.markdown(f"🕒 **{T['time']}**: {item.get('timestamp', 'Unknown time')}")
+    total = history_store.count(st.session_state.user)
+    pages = max(1, -(-total // HISTORY_PAGE_SIZE))
+    page = min(st.session_state.history_page, pages - 1)
+    items = history_store.page(st.session_state.user, page, HISTORY_PAGE_SIZE)
+    if not items:
+        st.caption(T["no_history"])
+
+    for item in items:
+        st.markdown(f"👤 **{T['user']}**: {item.get('user_id') or 'Unknown'}")
+        st.markdown(f"🕒 **{T['time']}**: {item.get('timestamp') or 'Unknown time'}")
         st.markdown(f"**Q:** {item['question']}")
         st.markdown(f"**A:** {item['answer']}")
 
-        if st.button("🗑️ この履歴を削除", key=f"delete_{idx}"):
-            del st.session_state.history[len(st.session_state.history) - 1 - idx]
+        if st.button("🗑️ この履歴を削除", key=f"delete_{item['id']}"):
+            history_store.delete(item["id"], st.session_state.user)
             st.success("履歴を削除しました。")
             st.rerun()
 
         st.markdown("---")
+
+    if pages > 1:
+        col_prev, col_info, col_next = st.columns([1, 2, 1])
+        if col_prev.button(T["prev_page"], disabled=page == 0, key="history_prev"):
+            st.session_state.history_page = page - 1
+            st.rerun()
+        col_info.caption(T["page_info"].format(page=page + 1, pages=pages, total=total))
+        if col_next.button(T["next_page"], disabled=page >= pages - 1, key="history_next"):
+            st.session_state.history_page = page + 1
+            st.rerun()